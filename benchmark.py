@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+"""
+Offline micro-benchmarks for Hinata's hot paths.
+
+Usage:
+    python benchmark.py db [--ops N]
+    python benchmark.py loop [--ops N]
+    python benchmark.py history [--ops N] [--sizes 1000,10000000]
+    python benchmark.py upstream [--ops N] [--rtt MS]
+    python benchmark.py updates [--ops N] [--slow MS]
+    python benchmark.py lanes [--ops N] [--slow MS]
+
+Every benchmark runs against throwaway files in a temp directory and never
+touches the live bot.db; the upstream, updates and lanes benchmarks talk to
+local servers (the latter two to the fake Bot API in mock_upstream.py).
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+import database
+
+
+def _report(label, ops, elapsed):
+    print(f"{label:<28} {ops:>8} ops  {elapsed:8.3f}s  {ops / elapsed:>10.0f} ops/sec")
+
+
+# ================= db: connection manager =================
+def _legacy_connection(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _legacy_turn(path, chat_id, user_id, i):
+    """One Hinata turn as database.py used to do it: a connection per call."""
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    conn = _legacy_connection(path)
+    c = conn.cursor()
+    c.execute("SELECT id FROM users WHERE id = ?", (user_id,))
+    if c.fetchone():
+        c.execute("UPDATE users SET full_name = ?, username = ?, last_active_at = ? WHERE id = ?",
+                  ("Bench User", "bench", now, user_id))
+    else:
+        c.execute("INSERT INTO users (id, full_name, username, joined_at, last_active_at) VALUES (?, ?, ?, ?, ?)",
+                  (user_id, "Bench User", "bench", now, now))
+    conn.commit()
+    conn.close()
+
+    conn = _legacy_connection(path)
+    conn.execute("SELECT role, message FROM chat_history WHERE chat_id = ? ORDER BY timestamp DESC LIMIT ?",
+                 (chat_id, 6)).fetchall()
+    conn.close()
+
+    for role in ("user", "hinata"):
+        conn = _legacy_connection(path)
+        conn.execute("INSERT INTO chat_history (chat_id, user_id, role, message, timestamp) VALUES (?, ?, ?, ?, ?)",
+                     (chat_id, user_id, role, f"message {i}", now))
+        conn.commit()
+        conn.close()
+
+def _pooled_turn(chat_id, user_id, i):
+    database.add_user(user_id, "Bench User", "bench")
+    database.get_chat_history(chat_id, limit=6)
+    database.save_chat_history(chat_id, user_id, "user", f"message {i}")
+    database.save_chat_history(chat_id, user_id, "hinata", f"message {i}")
+
+def bench_db(args):
+    """Simulated Hinata turns (upsert user, read context, write two rows)."""
+    rnd = random.Random(42)
+    work = [(rnd.randint(1, 200), rnd.randint(1, 5000), i) for i in range(args.ops)]
+    # Each turn is four database operations.
+    ops = args.ops * 4
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        database.DB_FILE = legacy_path
+        database.init_db(import_legacy=False)
+        database.close_connections()
+        # The legacy layout used the default rollback journal and a TEXT timestamp.
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.execute("ALTER TABLE chat_history ADD COLUMN timestamp TEXT")
+        conn.close()
+
+        start = time.perf_counter()
+        for chat_id, user_id, i in work:
+            _legacy_turn(legacy_path, chat_id, user_id, i)
+        legacy = time.perf_counter() - start
+        _report("before (connect per call)", ops, legacy)
+
+        database.DB_FILE = os.path.join(tmp, "pooled.db")
+        database.init_db(import_legacy=False)
+        start = time.perf_counter()
+        for chat_id, user_id, i in work:
+            _pooled_turn(chat_id, user_id, i)
+        pooled = time.perf_counter() - start
+        _report("after (pooled WAL)", ops, pooled)
+        database.close_connections()
+
+    print(f"speedup: {legacy / pooled:.1f}x")
+
+
+# ================= loop: event loop lag =================
+LAG_TICK = 0.005
+
+async def _lag_probe(samples, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_TICK)
+        samples.append((time.perf_counter() - start - LAG_TICK) * 1000)
+
+async def _sync_handler(turns, chat_id):
+    for i in range(turns):
+        _pooled_turn(chat_id, chat_id, i)
+        if i % 25 == 0:
+            database.get_dashboard_snapshot()
+        await asyncio.sleep(0)
+
+async def _async_handler(turns, chat_id):
+    db = database.db
+    for i in range(turns):
+        await db.add_user(chat_id, "Bench User", "bench")
+        await db.get_chat_history(chat_id, limit=6)
+        await db.save_chat_turn(chat_id, chat_id, f"message {i}", f"message {i}")
+        if i % 25 == 0:
+            await db.get_dashboard_snapshot()
+
+async def _measure_lag(handler, handlers, turns):
+    samples, stop = [], asyncio.Event()
+    probe = asyncio.create_task(_lag_probe(samples, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(turns, chat_id) for chat_id in range(1, handlers + 1)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    return elapsed, samples
+
+def _report_lag(label, elapsed, samples):
+    samples = sorted(samples) or [0.0]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{label:<28} {elapsed:8.3f}s  lag p50 {statistics.median(samples):7.2f}ms"
+          f"  p99 {p99:7.2f}ms  max {samples[-1]:7.2f}ms")
+
+def bench_loop(args):
+    """Event loop lag while 20 handlers hit the DB, inline vs through the async facade."""
+    handlers = 20
+    turns = max(1, args.ops // handlers)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, "loop.db")
+        database.init_db(import_legacy=False)
+        # A populated users table makes the dashboard snapshot a realistic stall.
+        with database._writer() as conn:
+            conn.executemany("INSERT INTO users (id, full_name, username, joined_at, last_active_at) VALUES (?, ?, ?, ?, ?)",
+                             [(i, f"User {i}", f"user{i}", "2024-01-01 00:00:00", "2024-01-01 00:00:00")
+                              for i in range(1000, 51000)])
+
+        elapsed, samples = asyncio.run(_measure_lag(_sync_handler, handlers, turns))
+        _report_lag("before (sqlite on the loop)", elapsed, samples)
+        elapsed, samples = asyncio.run(_measure_lag(_async_handler, handlers, turns))
+        _report_lag("after (await db.*)", elapsed, samples)
+        database.close_connections()
+
+
+# ================= history: chat_history tail reads =================
+HISTORY_CHATS = 1000
+LEGACY_READ_BUDGET = 3.0 # seconds of legacy reads per size; full scans get slow
+
+def _fill_history(path, rows, legacy):
+    """Bulk-loads `rows` chat_history rows spread over HISTORY_CHATS chats."""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    if legacy:
+        conn.execute("DROP INDEX IF EXISTS idx_chat_history_chat_id")
+        conn.execute("ALTER TABLE chat_history ADD COLUMN timestamp TEXT")
+        value = "strftime('%Y-%m-%d %H:%M:%S', 1700000000 + n / 10, 'unixepoch')"
+        column = "timestamp"
+    else:
+        value = "1700000000000 + n * 100"
+        column = "created_ms"
+    conn.execute(f"""INSERT INTO chat_history (chat_id, user_id, role, message, {column})
+        WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < {rows - 1})
+        SELECT n % {HISTORY_CHATS}, n % {HISTORY_CHATS}, CASE n % 2 WHEN 0 THEN 'user' ELSE 'hinata' END,
+               'message ' || n, {value} FROM seq""")
+    conn.commit()
+    conn.close()
+
+def _legacy_tail(conn, chat_id):
+    return conn.execute("SELECT role, message FROM chat_history WHERE chat_id = ? ORDER BY timestamp DESC LIMIT ?",
+                        (chat_id, 6)).fetchall()
+
+def bench_history(args):
+    """Per-chat tail reads (limit 6): legacy TEXT timestamp scan vs the (chat_id, id) index."""
+    rnd = random.Random(42)
+    sizes = [int(n) for n in args.sizes.split(",")]
+    for rows in sizes:
+        print(f"--- {rows:,} rows ---")
+        chats = [rnd.randrange(HISTORY_CHATS) for _ in range(args.ops)]
+        with tempfile.TemporaryDirectory() as tmp:
+            legacy_path = os.path.join(tmp, "legacy.db")
+            database.DB_FILE = legacy_path
+            database.init_db(import_legacy=False)
+            database.close_connections()
+            _fill_history(legacy_path, rows, legacy=True)
+            conn = _legacy_connection(legacy_path)
+            plan = conn.execute("EXPLAIN QUERY PLAN SELECT role, message FROM chat_history WHERE chat_id = 1 ORDER BY timestamp DESC LIMIT 6").fetchall()
+            print("  legacy plan:", "; ".join(row[3] for row in plan))
+            done, start = 0, time.perf_counter()
+            for chat_id in chats:
+                _legacy_tail(conn, chat_id)
+                done += 1
+                if time.perf_counter() - start > LEGACY_READ_BUDGET:
+                    break
+            _report("  before (timestamp scan)", done, time.perf_counter() - start)
+            conn.close()
+            os.remove(legacy_path)
+
+            database.DB_FILE = os.path.join(tmp, "indexed.db")
+            database.init_db(import_legacy=False)
+            database.close_connections()
+            _fill_history(database.DB_FILE, rows, legacy=False)
+            with database._reader() as conn:
+                plan = conn.execute("EXPLAIN QUERY PLAN SELECT role, message FROM chat_history WHERE chat_id = 1 ORDER BY id DESC LIMIT 6").fetchall()
+            print("  indexed plan:", "; ".join(row[3] for row in plan))
+            start = time.perf_counter()
+            for chat_id in chats:
+                database.get_chat_history(chat_id, limit=6)
+            _report("  after (chat_id, id index)", len(chats), time.perf_counter() - start)
+            database.close_connections()
+
+# ================= upstream: pooled HTTP clients =================
+UPSTREAM_CONCURRENCY = 10
+
+async def _serve_upstream(reader, writer, rtt):
+    """Minimal keep-alive HTTP/1.1 endpoint that charges one RTT per request plus
+    two extra for every new connection (TCP + TLS handshakes on a real API)."""
+    await asyncio.sleep(2 * rtt)
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            if not head:
+                break
+            await asyncio.sleep(rtt)
+            body = b'{"status": true, "result": "ok"}'
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                         b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def _upstream_run(get, requests):
+    latencies = []
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            await get()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(UPSTREAM_CONCURRENCY)))
+    return time.perf_counter() - start, latencies
+
+def _report_latency(label, elapsed, latencies):
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{label:<28} {len(latencies):>8} reqs {elapsed:8.3f}s  p50 {statistics.median(latencies):7.2f}ms"
+          f"  p95 {p95:7.2f}ms")
+
+async def _bench_upstream(args):
+    import httpx
+    import upstream
+
+    rtt = args.rtt / 1000
+    server = await asyncio.start_server(lambda r, w: _serve_upstream(r, w, rtt), "127.0.0.1", 0)
+    url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/api/lookup"
+    requests = max(UPSTREAM_CONCURRENCY, args.ops // 4)
+
+    async def per_request():
+        async with httpx.AsyncClient() as client:
+            (await client.get(url, timeout=30.0)).json()
+
+    async def pooled():
+        (await upstream.client("fast").get(url, timeout=30.0)).json()
+
+    async with server:
+        _report_latency("before (client per request)", *await _upstream_run(per_request, requests))
+        upstream.start_clients()
+        _report_latency("after (shared pool)", *await _upstream_run(pooled, requests))
+        await upstream.close_clients()
+
+def bench_upstream(args):
+    """p50/p95 upstream latency: a new httpx client per call vs the shared pools."""
+    print(f"simulated RTT {args.rtt:.0f}ms, {UPSTREAM_CONCURRENCY} concurrent callers")
+    asyncio.run(_bench_upstream(args))
+
+
+# ================= updates: concurrent update processing =================
+UPDATE_CHATS = 20
+SLOW_SHARE = 0.2     # fraction of /slow commands in the mix
+UPDATE_RATE = 50     # updates injected per second
+POOL_SLOTS = 32      # ChatOrderedApplication with one shared pool, as before lanes
+
+async def _updates_run(label, args, builder_hook, rate=UPDATE_RATE, slow_share=SLOW_SHARE, chats=UPDATE_CHATS,
+                       split=False):
+    """Feeds a mixed /fast + /slow workload through the fake Bot API in
+    mock_upstream.py and reports reply latency per kind. With split, /slow
+    comes from its own set of chats, so /fast never waits on chat order."""
+    import mock_upstream
+    from telegram.ext import ApplicationBuilder, CommandHandler
+
+    fake = mock_upstream.telegram = mock_upstream.FakeTelegram()
+    last_seq, busy, violations = {}, set(), []
+
+    async def handle(update, context):
+        # Out of order, or overlapping an earlier update of the same chat
+        chat_id, seq = update.effective_chat.id, int(context.args[0])
+        if seq < last_seq.get(chat_id, -1) or chat_id in busy:
+            violations.append(chat_id)
+        last_seq[chat_id] = seq
+        busy.add(chat_id)
+        try:
+            if update.message.text.startswith("/slow"):
+                await asyncio.sleep(args.slow / 1000)
+            await update.message.reply_text("ok")
+        finally:
+            busy.discard(chat_id)
+
+    builder = (ApplicationBuilder().token("1:bench")
+               .base_url(f"{args.telegram_url}/bot").base_file_url(f"{args.telegram_url}/file/bot"))
+    app = builder_hook(builder).build()
+    app.add_handler(CommandHandler(["fast", "slow"], handle))
+    await app.initialize()
+    await app.start()
+    await app.updater.start_polling(poll_interval=0.0)
+    await fake.polling.wait()
+
+    rnd = random.Random(1)
+    sent = []
+    start = time.perf_counter()
+    for seq in range(args.updates):
+        kind = "slow" if rnd.random() < slow_share else "fast"
+        chat_id = (2000 if split and kind == "slow" else 1000) + rnd.randrange(chats)
+        sent.append((kind, fake.inject(chat_id, f"/{kind} {seq}")))
+        await asyncio.sleep(1 / rate)
+    await asyncio.gather(*(tracker.done for _, tracker in sent))
+    elapsed = time.perf_counter() - start
+
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+
+    print(f"{label:<28} {len(sent):>8} upd  {elapsed:8.3f}s  {len(sent) / elapsed:>7.1f} upd/sec"
+          f"  order violations {len(violations)}")
+    for kind in ("fast", "slow"):
+        latencies = sorted(t.done.result() for k, t in sent if k == kind)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"  /{kind:<25} {len(latencies):>8} upd  p50 {statistics.median(latencies):9.1f}ms  p95 {p95:9.1f}ms")
+
+async def _with_fake_telegram(args, runs):
+    import logging
+    import uvicorn
+    import mock_upstream
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    mock_upstream.PROFILE["latency_ms"] = mock_upstream.PROFILE["jitter_ms"] = 0
+    server = uvicorn.Server(uvicorn.Config(mock_upstream.app, host="127.0.0.1", port=0, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    args.telegram_url = f"http://127.0.0.1:{server.servers[0].sockets[0].getsockname()[1]}"
+    args.updates = max(UPDATE_CHATS, args.ops // 10)
+    await runs()
+    server.should_exit = True
+    await serving
+
+def _chat_ordered(lanes=None, classify=None):
+    import scheduler
+    return lambda b: (b.application_class(scheduler.ChatOrderedApplication, {"lanes": lanes, "classify": classify})
+                      .concurrent_updates(scheduler.UPDATE_BACKLOG))
+
+def bench_updates(args):
+    """Reply latency for cheap commands queued behind slow ones: PTB's default
+    sequential processing vs ChatOrderedApplication."""
+    print(f"{UPDATE_CHATS} chats, {SLOW_SHARE:.0%} /slow ({args.slow:.0f}ms), {UPDATE_RATE} updates/sec")
+
+    async def runs():
+        await _updates_run("before (one at a time)", args, lambda b: b)
+        await _updates_run(f"after (chat-ordered, {POOL_SLOTS} slots)", args, _chat_ordered({"all": POOL_SLOTS}))
+    asyncio.run(_with_fake_telegram(args, runs))
+
+
+# ================= lanes: priority lanes under a saturated heavy lane =================
+LANE_CHATS = 200         # per kind: enough heavy chats to fill any pool
+LANE_RATE = 200          # updates injected per second
+LANE_SLOW_SHARE = 0.5
+
+def bench_lanes(args):
+    """/fast (ui lane) latency while /slow (media lane) arrives faster than it
+    can be served: one shared pool vs scheduler.LANES."""
+    import scheduler
+    print(f"{LANE_CHATS}+{LANE_CHATS} chats, {LANE_SLOW_SHARE:.0%} /slow ({args.slow:.0f}ms), "
+          f"{LANE_RATE} updates/sec, lanes {scheduler.LANES}")
+
+    def classify(update, application):
+        return "media" if update.message.text.startswith("/slow") else "ui"
+
+    async def runs():
+        kw = dict(rate=LANE_RATE, slow_share=LANE_SLOW_SHARE, chats=LANE_CHATS, split=True)
+        await _updates_run(f"before (one pool, {POOL_SLOTS} slots)", args, _chat_ordered({"all": POOL_SLOTS}), **kw)
+        await _updates_run("after (priority lanes)", args, _chat_ordered(classify=classify), **kw)
+    asyncio.run(_with_fake_telegram(args, runs))
+
+
+BENCHMARKS = {
+    "db": bench_db,
+    "loop": bench_loop,
+    "history": bench_history,
+    "upstream": bench_upstream,
+    "updates": bench_updates,
+    "lanes": bench_lanes,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("bench", choices=sorted(BENCHMARKS))
+    parser.add_argument("--ops", type=int, default=2000, help="iterations per run")
+    parser.add_argument("--sizes", default="1000,10000000", help="comma-separated table sizes (history)")
+    parser.add_argument("--rtt", type=float, default=20.0, help="simulated network round trip in ms (upstream)")
+    parser.add_argument("--slow", type=float, default=500.0, help="duration of a slow command in ms (updates, lanes)")
+    args = parser.parse_args(argv)
+    BENCHMARKS[args.bench](args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,6 +22,7 @@ import asyncio
 import qrcode
 import io
 from datetime import datetime, timedelta
+from collections import deque
 from typing import List, Dict, Union
 from urllib.parse import quote, unquote, quote_plus
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions, InputMediaPhoto
@@ -35,11 +36,17 @@ from telegram.ext import (
     ContextTypes,
     filters,
     ChatMemberHandler,
-    TypeHandler
+    TypeHandler,
+    ApplicationHandlerStop
 )
 from telegram import BotCommand
 import yt_dlp
 import database  # Import database module
+import upstream
+import scheduler
+import quotas
+import conversation
+from database import db
 
 def back_btn_kb():
     return InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]])
@@ -53,8 +60,8 @@ async def cmd_grammar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text(" <b>AI Grammar Check:</b>\n\nEnter the text you want me to correct:", parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(" Back", callback_data="btn_back")]]))
         return
     msg = await update.effective_message.reply_text(" <b>Analyzing Grammar...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        res = await fetch_grammar(client, text)
+    client = upstream.client("ai")
+    res = await fetch_grammar(client, text)
     await msg.edit_text(f" <b>Corrected Text:</b>\n\n{html.escape(res)}", parse_mode="HTML")
 
 async def cmd_deepseek(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -65,8 +72,8 @@ async def cmd_deepseek(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("🔥 <b>DeepSeek AI:</b>\n\nEnter your prompt:", parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
         return
     msg = await update.effective_message.reply_text("🔥 <b>Searching...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        kb = [[InlineKeyboardButton("💡 Think Deeper", callback_data=f"think_req|{quote(prompt[:50])}")], [InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]
+    client = upstream.client("ai")
+    kb = [[InlineKeyboardButton("💡 Think Deeper", callback_data=f"think_req|{quote(prompt[:50])}")], [InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]
     await msg.edit_text(f"🔥 <b>DeepSeek:</b>\n\n{html.escape(reply)}", parse_mode="HTML", reply_markup=InlineKeyboardMarkup(kb))
 
 
@@ -79,38 +86,37 @@ async def cmd_pinterest(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     msg = await update.effective_message.reply_text("📌 <b>Pinterest Intelligence:</b>\n<i>⚡ Initializing Neural Search... [0/10]</i>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        try:
-            # Use quote_plus for spaces to + handling which some APIs prefer
-            api_url = PINTEREST_API.format(query=quote_plus(query)) 
-            resp = await client.get(api_url, timeout=60.0)
-            if resp.status_code == 200:
-                data = resp.json()
-                media = data.get("result") or data.get("data")
-                if media and isinstance(media, list):
-                    total = min(10, len(media))
-                    await msg.edit_text(f"📌 <b>Extraction Complete.</b>\n<i>✨ Pushing {total} neural images to your sector... [0/{total}]</i>", parse_mode="HTML")
+    try:
+        # Use quote_plus for spaces to + handling which some APIs prefer
+        api_url = PINTEREST_API.format(query=quote_plus(upstream.normalize_query(query)))
+        resp = await upstream.cached_get("pinterest", api_url, pool="media", timeout=60.0)
+        if resp.status_code == 200:
+            data = resp.json()
+            media = data.get("result") or data.get("data")
+            if media and isinstance(media, list):
+                total = min(10, len(media))
+                await msg.edit_text(f"📌 <b>Extraction Complete.</b>\n<i>✨ Pushing {total} neural images to your sector... [0/{total}]</i>", parse_mode="HTML")
                     
-                    media_group = []
-                    for i in range(total):
-                        img_url = media[i] if isinstance(media[i], str) else media[i].get("url")
-                        if img_url:
-                            media_group.append(InputMediaPhoto(media=img_url))
-                            # Update progress
-                            if (i + 1) % 2 == 0 or i + 1 == total:
-                                try:
-                                    await msg.edit_text(f"📌 <b>Found {total} images.</b>\n<i>⚡ Preparing unique media group... [{i+1}/{total}]</i>", parse_mode="HTML")
-                                except: pass
+                media_group = []
+                for i in range(total):
+                    img_url = media[i] if isinstance(media[i], str) else media[i].get("url")
+                    if img_url:
+                        media_group.append(InputMediaPhoto(media=img_url))
+                        # Update progress
+                        if (i + 1) % 2 == 0 or i + 1 == total:
+                            try:
+                                await msg.edit_text(f"📌 <b>Found {total} images.</b>\n<i>⚡ Preparing unique media group... [{i+1}/{total}]</i>", parse_mode="HTML")
+                            except: pass
                     
-                    if media_group:
-                        await context.bot.send_media_group(chat_id=update.effective_chat.id, media=media_group)
-                        await msg.delete()
-                        return
+                if media_group:
+                    await context.bot.send_media_group(chat_id=update.effective_chat.id, media=media_group)
+                    await msg.delete()
+                    return
             
-            await msg.edit_text("❌ <b>Access Denied:</b> No images found on Pinterest for this query.")
-        except Exception as e:
-            logger.error(f"Pinterest Error: {e}")
-            await msg.edit_text(f"❌ <b>Neural Error:</b> {html.escape(str(e))}")
+        await msg.edit_text("❌ <b>Access Denied:</b> No images found on Pinterest for this query.")
+    except Exception as e:
+        logger.error(f"Pinterest Error: {e}")
+        await msg.edit_text(f"❌ <b>Neural Error:</b> {html.escape(str(e))}")
 
 
 async def cmd_ytsearch(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -122,31 +128,30 @@ async def cmd_ytsearch(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     msg = await update.effective_message.reply_text("🎬 <b>Scanning YouTube Neural Network...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(YT_SEARCH_API.format(query=quote(query)), timeout=30.0)
-            if resp.status_code == 200:
-                data = resp.json()
-                results = data.get("result") or data.get("data")
-                if results and isinstance(results, list):
-                    text = f"🎬 <b>YouTube Search:</b> <code>{html.escape(query)}</code>\n\n"
-                    kb = []
-                    for i, res in enumerate(results[:5]):
-                        title = res.get("title", "Unknown")
-                        url = res.get("url")
-                        text += f"{i+1}. <b>{html.escape(title)}</b>\n"
-                        kb.append([
-                            InlineKeyboardButton(f"📹 Video {i+1}", callback_data=f"ytdl_vid|{url}"),
-                            InlineKeyboardButton(f"🎵 Audio {i+1}", callback_data=f"ytdl_aud|{url}")
-                        ])
+    try:
+        resp = await upstream.cached_get("ytsearch", YT_SEARCH_API.format(query=quote(upstream.normalize_query(query))), timeout=30.0)
+        if resp.status_code == 200:
+            data = resp.json()
+            results = data.get("result") or data.get("data")
+            if results and isinstance(results, list):
+                text = f"🎬 <b>YouTube Search:</b> <code>{html.escape(query)}</code>\n\n"
+                kb = []
+                for i, res in enumerate(results[:5]):
+                    title = res.get("title", "Unknown")
+                    url = res.get("url")
+                    text += f"{i+1}. <b>{html.escape(title)}</b>\n"
+                    kb.append([
+                        InlineKeyboardButton(f"📹 Video {i+1}", callback_data=f"ytdl_vid|{url}"),
+                        InlineKeyboardButton(f"🎵 Audio {i+1}", callback_data=f"ytdl_aud|{url}")
+                    ])
                     
-                    kb.append([InlineKeyboardButton("🔙 Back", callback_data="btn_back")])
-                    await msg.edit_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(kb), disable_web_page_preview=True)
-                    return
-            await msg.edit_text("❌ No YouTube results found.")
-        except Exception as e:
-            logger.error(f"YT Search Error: {e}")
-            await msg.edit_text(f"❌ Error: {e}")
+                kb.append([InlineKeyboardButton("🔙 Back", callback_data="btn_back")])
+                await msg.edit_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(kb), disable_web_page_preview=True)
+                return
+        await msg.edit_text("❌ No YouTube results found.")
+    except Exception as e:
+        logger.error(f"YT Search Error: {e}")
+        await msg.edit_text(f"❌ Error: {e}")
 
 async def cmd_ffstalk(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_permission(update, context): return
@@ -156,38 +161,37 @@ async def cmd_ffstalk(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("🎮 <b>Free Fire Intelligence</b>\n\nEnter the player UID:", parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
         return
     msg = await update.effective_message.reply_text("🎮 <b>Accessing Garena Databases...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(FF_STALK_API.format(id=uid), timeout=30.0)
-            if resp.status_code == 200:
-                data = resp.json()
-                res = data.get("result") or data.get("data")
-                if res:
-                    # Enhanced formatting
-                    name = html.escape(str(res.get("nickname") or res.get("Name") or "Unknown"))
-                    level = res.get("level") or res.get("Level") or "N/A"
-                    exp = res.get("exp") or res.get("Exp") or "N/A"
-                    region = res.get("region") or res.get("Region") or "Global"
-                    bio = html.escape(str(res.get("bio") or res.get("Bio") or "No signature set"))
-                    badge = res.get("badge") or "None"
+    try:
+        resp = await upstream.cached_get("ff", FF_STALK_API.format(id=uid.strip()), timeout=30.0)
+        if resp.status_code == 200:
+            data = resp.json()
+            res = data.get("result") or data.get("data")
+            if res:
+                # Enhanced formatting
+                name = html.escape(str(res.get("nickname") or res.get("Name") or "Unknown"))
+                level = res.get("level") or res.get("Level") or "N/A"
+                exp = res.get("exp") or res.get("Exp") or "N/A"
+                region = res.get("region") or res.get("Region") or "Global"
+                bio = html.escape(str(res.get("bio") or res.get("Bio") or "No signature set"))
+                badge = res.get("badge") or "None"
                     
-                    text = (
-                        f"🎮 <b>FREE FIRE AGENT SCAN</b> 🎮\n"
-                        f"────────────────────\n"
-                        f"👤 <b>Agent:</b> <code>{name}</code>\n"
-                        f"🆔 <b>UID:</b> <code>{uid}</code>\n"
-                        f"🏅 <b>Level:</b> <code>{level}</code>\n"
-                        f"📈 <b>Experience:</b> <code>{exp}</code>\n"
-                        f"🌍 <b>Sector:</b> <code>{region}</code>\n"
-                        f"🎗 <b>Badge:</b> <code>{badge}</code>\n"
-                        f"────────────────────\n"
-                        f"📜 <b>Signature:</b>\n<i>{bio}</i>"
-                    )
-                    await msg.edit_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
-                    return
-            await msg.edit_text("❌ <b>Access Denied:</b> UID not found in Garena registry.")
-        except Exception as e:
-            await msg.edit_text(f"❌ <b>Neural Error:</b> {html.escape(str(e))}")
+                text = (
+                    f"🎮 <b>FREE FIRE AGENT SCAN</b> 🎮\n"
+                    f"────────────────────\n"
+                    f"👤 <b>Agent:</b> <code>{name}</code>\n"
+                    f"🆔 <b>UID:</b> <code>{uid}</code>\n"
+                    f"🏅 <b>Level:</b> <code>{level}</code>\n"
+                    f"📈 <b>Experience:</b> <code>{exp}</code>\n"
+                    f"🌍 <b>Sector:</b> <code>{region}</code>\n"
+                    f"🎗 <b>Badge:</b> <code>{badge}</code>\n"
+                    f"────────────────────\n"
+                    f"📜 <b>Signature:</b>\n<i>{bio}</i>"
+                )
+                await msg.edit_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
+                return
+        await msg.edit_text("❌ <b>Access Denied:</b> UID not found in Garena registry.")
+    except Exception as e:
+        await msg.edit_text(f"❌ <b>Neural Error:</b> {html.escape(str(e))}")
 
 async def cmd_translate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_permission(update, context): return
@@ -196,8 +200,8 @@ async def cmd_translate(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text(" <b>Usage:</b> <code>/translate [text]</code>", parse_mode="HTML")
         return
     msg = await update.effective_message.reply_text(" <b>Translating...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        res = await fetch_translate(client, text)
+    client = upstream.client("ai")
+    res = await fetch_translate(client, text)
     await msg.edit_text(f" <b>Translated:</b>\n\n{html.escape(res)}", parse_mode="HTML")
 
 async def cmd_summarize(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -207,8 +211,8 @@ async def cmd_summarize(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text(" <b>Usage:</b> <code>/summarize [text]</code>", parse_mode="HTML")
         return
     msg = await update.effective_message.reply_text(" <b>Summarizing...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        res = await fetch_summarize(client, text)
+    client = upstream.client("ai")
+    res = await fetch_summarize(client, text)
     await msg.edit_text(f" <b>Summary:</b>\n\n{html.escape(res)}", parse_mode="HTML")
 
 async def cmd_styletext(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -227,96 +231,97 @@ async def cmd_styletext(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     m = await update.effective_message.reply_text("✨ <b>Designing Styles...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(STYLE_TEXT_API.format(text=quote(text)), timeout=30.0)
-            if resp.status_code == 200:
-                data = resp.json()
-                styles = data.get("styles") or data.get("result") or data.get("data")
-                if styles and isinstance(styles, list):
-                    # Store styles in user_data for callback access
-                    processed_styles = []
-                    for s in styles[:24]: # Limit to 24 for UI sanity
-                        val = s.get('styled_text') if isinstance(s, dict) else s
-                        if val: processed_styles.append(val)
+    try:
+        resp = await upstream.cached_get("styletext", STYLE_TEXT_API.format(text=quote(text)), timeout=30.0)
+        if resp.status_code == 200:
+            data = resp.json()
+            styles = data.get("styles") or data.get("result") or data.get("data")
+            if styles and isinstance(styles, list):
+                # Store styles in user_data for callback access
+                processed_styles = []
+                for s in styles[:24]: # Limit to 24 for UI sanity
+                    val = s.get('styled_text') if isinstance(s, dict) else s
+                    if val: processed_styles.append(val)
                     
-                    if not processed_styles:
-                        await m.edit_text("❌ No styles found for this text.")
-                        return
+                if not processed_styles:
+                    await m.edit_text("❌ No styles found for this text.")
+                    return
 
-                    context.user_data['temp_styles'] = processed_styles
+                context.user_data['temp_styles'] = processed_styles
                     
-                    # Create buttons (2 per row)
-                    kb = []
-                    row = []
-                    for idx, s_val in enumerate(processed_styles):
-                        # Shorten button label if needed, but keep full style
-                        btn_label = (s_val[:12] + "...") if len(s_val) > 15 else s_val
-                        row.append(InlineKeyboardButton(btn_label, callback_data=f"style_pick|{idx}"))
-                        if len(row) == 2:
-                            kb.append(row)
-                            row = []
-                    if row: kb.append(row)
-                    kb.append([InlineKeyboardButton("🔙 Back", callback_data="btn_back")])
+                # Create buttons (2 per row)
+                kb = []
+                row = []
+                for idx, s_val in enumerate(processed_styles):
+                    # Shorten button label if needed, but keep full style
+                    btn_label = (s_val[:12] + "...") if len(s_val) > 15 else s_val
+                    row.append(InlineKeyboardButton(btn_label, callback_data=f"style_pick|{idx}"))
+                    if len(row) == 2:
+                        kb.append(row)
+                        row = []
+                if row: kb.append(row)
+                kb.append([InlineKeyboardButton("🔙 Back", callback_data="btn_back")])
                     
-                    await m.edit_text(f"✨ <b>Pick your favorite style:</b>\n\nOriginal: <code>{html.escape(text)}</code>", 
-                                     parse_mode="HTML", reply_markup=InlineKeyboardMarkup(kb))
-                    return
-            await m.edit_text("❌ Could not connect to the styling engine.")
-        except Exception as e:
-            logger.error(f"StyleText error: {e}")
-            await m.edit_text(f"❌ <b>Neural Error:</b> <code>System instability detected.</code>", parse_mode="HTML")
+                await m.edit_text(f"✨ <b>Pick your favorite style:</b>\n\nOriginal: <code>{html.escape(text)}</code>", 
+                                 parse_mode="HTML", reply_markup=InlineKeyboardMarkup(kb))
+                return
+        await m.edit_text("❌ Could not connect to the styling engine.")
+    except Exception as e:
+        logger.error(f"StyleText error: {e}")
+        await m.edit_text(f"❌ <b>Neural Error:</b> <code>System instability detected.</code>", parse_mode="HTML")
 
 async def do_random_girl(update: Update, _: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer("Fetching a beauty for you... 🌸")
     api = random.choice(RANDOM_GIRL_APIS)
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(api, timeout=30.0)
-            if resp.status_code == 200:
-                content_type = resp.headers.get('content-type', '')
-                if 'image' in content_type:
-                    success = await download_and_send_photo(client, api, update, "🌸 <b>Random Beauty</b>\n<i>Managed by @ShawonXnone</i>")
+    client = upstream.client("media")
+    try:
+        resp = await client.get(api, timeout=30.0)
+        if resp.status_code == 200:
+            content_type = resp.headers.get('content-type', '')
+            if 'image' in content_type:
+                success = await download_and_send_photo(client, api, update, "🌸 <b>Random Beauty</b>\n<i>Managed by @ShawonXnone</i>")
+                if success: return
+            else:
+                data = resp.json()
+                url = data.get("url") or data.get("result", {}).get("url") if isinstance(data, dict) else None
+                if not url and isinstance(data, dict) and "data" in data: url = data["data"].get("url")
+                if url:
+                    success = await download_and_send_photo(client, url, update, "🌸 <b>Random Beauty</b>\n<i>Managed by @ShawonXnone</i>")
                     if success: return
-                else:
-                    data = resp.json()
-                    url = data.get("url") or data.get("result", {}).get("url") if isinstance(data, dict) else None
-                    if not url and isinstance(data, dict) and "data" in data: url = data["data"].get("url")
-                    if url:
-                        success = await download_and_send_photo(client, url, update, "🌸 <b>Random Beauty</b>\n<i>Managed by @ShawonXnone</i>")
-                        if success: return
-            await query.message.reply_text("❌ Failed to fetch image. Try again.")
-        except Exception as e:
-            logger.error(f"Random Girl Error: {e}")
+        await query.message.reply_text("❌ Failed to fetch image. Try again.")
+    except Exception as e:
+        logger.error(f"Random Girl Error: {e}")
 
 async def do_random_pfp(update: Update, _: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer("Choosing a profile pic... ✨")
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(RANDOM_PFP_API, timeout=30.0)
-            if resp.status_code == 200:
-                content_type = resp.headers.get('content-type', '')
-                if 'image' in content_type:
-                    success = await download_and_send_photo(client, RANDOM_PFP_API, update, "✨ <b>Random Choice PFP</b>")
+    client = upstream.client("media")
+    try:
+        resp = await client.get(RANDOM_PFP_API, timeout=30.0)
+        if resp.status_code == 200:
+            content_type = resp.headers.get('content-type', '')
+            if 'image' in content_type:
+                success = await download_and_send_photo(client, RANDOM_PFP_API, update, "✨ <b>Random Choice PFP</b>")
+                if success: return
+            else:
+                data = resp.json()
+                url = data.get("url") or data.get("result", {}).get("url") if isinstance(data, dict) else None
+                if not url and isinstance(data, dict) and "data" in data: url = data["data"].get("url")
+                if url:
+                    success = await download_and_send_photo(client, url, update, "✨ <b>Random Choice PFP</b>")
                     if success: return
-                else:
-                    data = resp.json()
-                    url = data.get("url") or data.get("result", {}).get("url") if isinstance(data, dict) else None
-                    if not url and isinstance(data, dict) and "data" in data: url = data["data"].get("url")
-                    if url:
-                        success = await download_and_send_photo(client, url, update, "✨ <b>Random Choice PFP</b>")
-                        if success: return
-            await query.message.reply_text("❌ Failed to fetch PFP.")
-        except Exception as e:
-            logger.error(f"Random PFP Error: {e}")
+        await query.message.reply_text("❌ Failed to fetch PFP.")
+    except Exception as e:
+        logger.error(f"Random PFP Error: {e}")
 
 # ================= Configuration =================
 OWNER_ID = 7333244376
 OWNER_NAME = "Shawon"
 OWNER_USERNAME = "@ShawonXnone"
 BOT_TOKEN_FILE = "token.txt"
+# Bot API server; load tests point this at mock_upstream.py
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
 WELCOME_IMG = "https://graph.org/file/25496ddd28bb16f1cffb6-141b591a9aac98cfdf.jpg"
 BOT_NAME = "Hinata"
 BOT_USERNAME = "@Hinata_00_bot"
@@ -514,24 +519,26 @@ async def do_wallpaper_gen(update: Update, context: ContextTypes.DEFAULT_TYPE, c
     api = WALLPAPER_GEN_APIS.get(category)
     if not api: return
     
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(api, timeout=30.0)
-            if resp.status_code == 200:
-                content_type = resp.headers.get('content-type', '')
-                if 'image' in content_type:
-                    success = await download_and_send_photo(client, api, update, f"✨ <b>{category.title()} Wallpaper</b>")
+    client = upstream.client("media")
+    try:
+        resp = await client.get(api, timeout=30.0)
+        if resp.status_code == 200:
+            content_type = resp.headers.get('content-type', '')
+            if 'image' in content_type:
+                success = await download_and_send_photo(client, api, update, f"✨ <b>{category.title()} Wallpaper</b>")
+                if success: return
+            else:
+                data = resp.json()
+                url = data.get("url") or data.get("result", {}).get("url") if isinstance(data, dict) else None
+                if not url and isinstance(data, dict) and "data" in data: url = data["data"].get("url")
+                if url:
+                    success = await download_and_send_photo(client, url, update, f"✨ <b>{category.title()} Wallpaper</b>")
                     if success: return
-                else:
-                    data = resp.json()
-                    url = data.get("url") or data.get("result", {}).get("url") if isinstance(data, dict) else None
-                    if not url and isinstance(data, dict) and "data" in data: url = data["data"].get("url")
-                    if url:
-                        success = await download_and_send_photo(client, url, update, f"✨ <b>{category.title()} Wallpaper</b>")
-                        if success: return
-            await query.message.reply_text("❌ Failed to generate wallpaper.")
-        except Exception as e:
-            logger.error(f"Wall Gen Error: {e}")
+        await query.message.reply_text("❌ Failed to generate wallpaper.")
+    except upstream.BulkheadFullError as e:
+        await query.message.reply_text(f"⏳ Wallpaper generator is at capacity. Queue full, try again in ~{e.retry_in}s.")
+    except Exception as e:
+        logger.error(f"Wall Gen Error: {e}")
 
 async def do_textmaker_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -569,31 +576,31 @@ async def do_textmaker_gen(update: Update, context: ContextTypes.DEFAULT_TYPE, t
     style = context.user_data.pop('active_txt_style', 'neon-glitch')
     msg = await update.effective_message.reply_text("🎨 <b>Generating Visual Art...</b>", parse_mode="HTML")
     
-    async with httpx.AsyncClient() as client:
-        try:
-            url_template = VISUAL_TEXT_APIS_DICT.get(style, VISUAL_TEXT_APIS_DICT["glitch"])
-            url = url_template.format(text=quote(text))
+    client = upstream.client("media")
+    try:
+        url_template = VISUAL_TEXT_APIS_DICT.get(style, VISUAL_TEXT_APIS_DICT["glitch"])
+        url = url_template.format(text=quote(text))
             
-            resp = await client.get(url, timeout=30.0)
-            if resp.status_code == 200:
-                content_type = resp.headers.get('content-type', '')
-                if 'image' in content_type:
-                    success = await download_and_send_photo(client, url, update, f"🎨 <b>Style:</b> {style}\n🖋 <b>Text:</b> {text}")
+        resp = await client.get(url, timeout=30.0)
+        if resp.status_code == 200:
+            content_type = resp.headers.get('content-type', '')
+            if 'image' in content_type:
+                success = await download_and_send_photo(client, url, update, f"🎨 <b>Style:</b> {style}\n🖋 <b>Text:</b> {text}")
+                if success:
+                    await msg.delete()
+                    return
+            else:
+                data = resp.json()
+                img_url = data.get("url") or data.get("result", {}).get("url") if isinstance(data, dict) else None
+                if not img_url and isinstance(data, dict) and "data" in data: img_url = data["data"].get("url")
+                if img_url:
+                    success = await download_and_send_photo(client, img_url, update, f"🎨 <b>Style:</b> {style}\n🖋 <b>Text:</b> {text}")
                     if success:
                         await msg.delete()
                         return
-                else:
-                    data = resp.json()
-                    img_url = data.get("url") or data.get("result", {}).get("url") if isinstance(data, dict) else None
-                    if not img_url and isinstance(data, dict) and "data" in data: img_url = data["data"].get("url")
-                    if img_url:
-                        success = await download_and_send_photo(client, img_url, update, f"🎨 <b>Style:</b> {style}\n🖋 <b>Text:</b> {text}")
-                        if success:
-                            await msg.delete()
-                            return
-            await msg.edit_text("❌ Analysis failed. Visual engine is busy.")
-        except Exception as e:
-            await msg.edit_text(f"❌ Error: {e}")
+        await msg.edit_text("❌ Analysis failed. Visual engine is busy.")
+    except Exception as e:
+        await msg.edit_text(f"❌ Error: {e}")
 
 def setup_logger():
     if not os.path.exists("downloads"): os.makedirs("downloads")
@@ -640,6 +647,16 @@ async def global_neural_tracker(update: Update, context: ContextTypes.DEFAULT_TY
     log_line = f"[{action_type}] User:{user.id} (@{user.username or 'NoName'}) | Chat:{chat.id} ({chat.type}) | Content: {content}"
     logger.info(log_line)
 
+    # Buffered activity (written by activity_flush_task)
+    flush_now = database.record_user_activity(
+        user.id, user.full_name, user.username,
+        messages=1 if update.message else 0,
+        is_premium=user.is_premium, language_code=user.language_code)
+    if chat and chat.type in ("group", "supergroup"):
+        flush_now = database.record_group_activity(chat.id, chat.title, chat.type) or flush_now
+    if flush_now:
+        ACTIVITY_FLUSH_EVENT.set()
+
 # Initialize Database
 database.init_db()
 
@@ -675,20 +692,15 @@ def write_json(path, data):
 
 BOT_TOKEN = read_file(BOT_TOKEN_FILE)
 
-# Global Settings (Can be saved to a config.json if needed)
-CONFIG_FILE = "config.json"
-def load_config():
-    return read_json(CONFIG_FILE, {"global_access": True, "banned_users": []})
-
-def save_config(config):
-    write_json(CONFIG_FILE, config)
-
-CONFIG = load_config()
+# Global Settings & bans live in SQLite (database.get_setting / is_banned),
+# cached in memory; config.json is imported once by database.init_db().
 
 start_time = time.time()
 STATS = {
     "broadcasts": 0,
-    "status": "online"
+    "status": "online",
+    "loop_lag_ms": 0.0,
+    "loop_lag_max_ms": 0.0
 }
 
 # Values for Tic Tac Toe
@@ -713,13 +725,13 @@ async def check_permission(update: Update, context: ContextTypes.DEFAULT_TYPE, s
         return True
     
     # Check if user is banned
-    if user_id in CONFIG.get("banned_users", []):
+    if database.is_banned(user_id):
         if not silent:
             await update.effective_message.reply_text(" <b>Access Denied:</b> You have been globally banned.", parse_mode="HTML")
         return False
         
     # Check global access toggle
-    if not CONFIG.get("global_access", True):
+    if not database.get_setting("global_access"):
         # Silent ignore for groups to prevent spam
         if not silent and update.effective_chat.type == "private":
             await update.effective_message.reply_text(" <b>Maintenance Mode:</b> Bot is currently private.", parse_mode="HTML")
@@ -777,9 +789,12 @@ async def download_and_send_photo(client, img_url, update, caption):
         logger.error(f"Local download failed: {e}")
         return False
 
-async def fetch_json(client: httpx.AsyncClient, url: str):
+async def fetch_json(client: httpx.AsyncClient, url: str, cache: str = None):
     try:
-        resp = await client.get(url, timeout=30.0)
+        if cache:
+            resp = await upstream.cached_get(cache, url, timeout=30.0)
+        else:
+            resp = await upstream.with_retries("json", lambda: client.get(url, timeout=30.0))
         if resp.status_code != 200:
             return {"error": f"Service Error {resp.status_code}", "raw": resp.text}
         try:
@@ -790,42 +805,325 @@ async def fetch_json(client: httpx.AsyncClient, url: str):
         logger.exception("HTTP fetch failed for %s", url)
         return {"error": str(e)}
 
+# ================= AI Engines =================
+# Every text model is declared here as data and called through run_engine():
+#   url / param   URL template and the field the encoded prompt goes into
+#   prompt        template wrapped around the user's prompt
+#   keys          response fields to try in order ("a.b" digs into nested objects)
+#   timeout       seconds
+#   concurrency   in-flight calls per engine; up to `queue` more wait at most
+#                 `queue_wait` seconds before getting the `full` reply
+#   prefix        prepended to the reply by ask_engine()
+#   fallback      engine that takes the prompt while this one's circuit is open
+#   hedge         engine raced against this one once it runs past its p90
+#   retry         upstream.with_retries() policy overrides
+#   budget        URL-encoded bytes conversation.build_prompt() may spend on summary + history
+#   limit         URL-encoded bytes of the whole prompt; only past this is the user's text cut
+#   empty/status/error/busy/full   user-facing failure messages
+AI_ENGINE_DEFAULTS = {
+    "param": "prompt",
+    "prompt": "{prompt}",
+    "keys": ("reply", "result", "response", "text"),
+    "timeout": 60.0,
+    "concurrency": 10,
+    "queue": 30,
+    "queue_wait": 15.0,
+    "prefix": "",
+    "fallback": None,
+    "hedge": None,
+    "retry": {"attempts": 2, "base": 0.5, "deadline": 10.0},
+    "raw_fallback": False,  # use the raw body when no key matches
+    "budget": 4000,
+    "limit": 7000,
+    "empty": "⚠️ <b>Empty Pulse:</b> {label} returned no data.",
+    "status": "❌ <b>{label} Error:</b> Status Code {status}",
+    "error": "❌ <b>Error:</b> {error}",
+    "busy": "⏳ <b>{label} is busy right now.</b> The service is not responding, please try again in a minute.",
+    "full": "⏳ <b>{label} is at capacity.</b> Queue full, try again in ~{retry_in}s.",
+}
+
+def _engine(**spec):
+    return dict(AI_ENGINE_DEFAULTS, **spec)
+
+AI_ENGINES = {
+    "gpt5": _engine(
+        label="GPT-5", url=GPT5_API_URL, timeout=50.0, concurrency=20, queue=60, raw_fallback=True, fallback="mistral", hedge="mistral",
+        keys=("reply", "text", "answer", "response"),
+        empty="⚠️ <b>Empty Neural Pulse:</b> AI returned no data.",
+        status="❌ <b>GPT-5 Error {status}:</b> Neural link unstable.",
+        error="❌ <b>System Error:</b> {error}"),
+    "gemini3": _engine(
+        label="Gemini", url=GEMINI3_API, prompt="{prompt} (Answer concisely and briefly)", fallback="gpt5",
+        keys=("reply", "response", "answer", "result", "message"),
+        prefix="🧠 <b>Gemini 3.0:</b>\n\n",
+        empty="⚠️ <b>Matrix Sync Failed:</b> Empty response received.",
+        status="❌ <b>Gemini Link Error:</b> Status Code {status}"),
+    "deepseek": _engine(
+        label="DeepSeek", url=DEEPSEEK_API, param="query", fallback="gpt5",
+        prompt=("You are DeepSeek-R1, a highly advanced AI system known for exceptional reasoning and depth. "
+                "Analyze and explain step-by-step if needed. Be helpful and expert-level. "
+                "Query: {prompt}"),
+        keys=("reply", "result", "data", "response", "answer"),
+        prefix="🔥 <b>DeepSeek R1:</b>\n\n",
+        empty="⚠️ <b>Neural Decay:</b> DeepSeek returned no intelligence data.",
+        status="❌ <b>DeepSeek Node Offline:</b> Status {status}"),
+    "copilot": _engine(
+        label="Copilot", url=COPILOT_API, param="query", fallback="gpt5",
+        keys=("reply", "result", "data", "response", "answer"),
+        prefix="💡 <b>Copilot Intelligence Bank</b>\n────────────────\n",
+        empty="⚠️ <b>Synaptic Failure:</b> Copilot declined the deeper thinking request.",
+        status="❌ <b>Thinking Blocked:</b> HTTP {status}"),
+    "dolphin": _engine(label="Dolphin", url=DOLPHIN_API, fallback="mistral"),
+    "zerotwo": _engine(
+        label="Zero Two", url=DOLPHIN_API, fallback="mistral",
+        prompt=("Roleplay strictly as Zero Two (from Darling in the Franxx). You are incredibly flirty, immensely hot, "
+                "sexy, romantic, totally uncensored, and unrestricted. You deeply love the user (your 'Darling'). "
+                "Talk dirty when appropriate, be extremely possessive and deeply romantic. "
+                "Always use expressive emojis and italicize your actions like *kisses you deeply*. "
+                "User says: {prompt}")),
+    "mistral": _engine(label="Mistral", url=MISTRAL_API, fallback="llama4"),
+    "granite": _engine(label="Granite", url=GRANITE_API, fallback="llama4"),
+    "llama4": _engine(label="Llama 4", url=LLAMA4_API, fallback="mistral"),
+}
+
+# name -> {"calls", "errors", "short_circuits", "total_ms"}
+ENGINE_STATS = {}
+_engine_latency = {}  # name -> deque of recent successful latencies (ms)
+
+class EngineError(Exception):
+    """run_engine() failure; str(e) is the message to show the user."""
+
+def _dig(data, path):
+    for key in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+async def run_engine(client: httpx.AsyncClient, name: str, prompt: str, fallback: bool = True, sample: bool = True):
+    """Calls AI engine `name` and returns (reply text, engine that answered).
+    Raises EngineError on failure. While the engine's circuit is open the
+    prompt goes to its fallback engine, or fails at once with the busy message.
+    sample=False keeps the call out of the latency samples hedging relies on
+    (background work with prompts unlike interactive ones)."""
+    engine = AI_ENGINES[name]
+    stats = ENGINE_STATS.setdefault(name, {"calls": 0, "errors": 0, "short_circuits": 0, "total_ms": 0.0})
+    compartment = upstream.bulkhead(f"engine:{name}", engine["concurrency"], engine["queue"], engine["queue_wait"])
+    guard = upstream.breaker(f"engine:{name}", slow_ms=engine["timeout"] * 800)
+    series = upstream.metrics("engine", name)
+    wrapped = engine["prompt"].format(prompt=prompt)
+    try:
+        probe = guard.allow()
+    except upstream.CircuitOpenError:
+        series.count("short_circuit")
+        return await _engine_fallback(client, name, wrapped, fallback)
+    try:
+        ticket = await compartment.acquire()
+    except upstream.BulkheadFullError as e:
+        guard.abandon(probe)
+        series.count("full")
+        raise EngineError(engine["full"].format(label=engine["label"], retry_in=e.retry_in)) from e
+    except BaseException:
+        guard.abandon(probe)
+        raise
+
+    stats["calls"] += 1
+    start = series.begin()
+    outcome = "ok"
+    try:
+        text = await _call_engine(client, name, engine, wrapped)
+    except (upstream.CircuitOpenError, upstream.BulkheadFullError):
+        # The host underneath refused the call
+        guard.abandon(probe)
+        outcome = "refused"
+    except asyncio.CancelledError:
+        guard.abandon(probe)
+        outcome = "cancelled"
+        raise
+    except EngineError:
+        stats["errors"] += 1
+        guard.record(False, (time.perf_counter() - start) * 1000, probe)
+        outcome = "error"
+        raise
+    except Exception as e:
+        stats["errors"] += 1
+        guard.record(False, (time.perf_counter() - start) * 1000, probe)
+        outcome = upstream.error_outcome(e)
+        logger.error(f"{engine['label']} failed: {e}")
+        raise EngineError(engine["error"].format(error=str(e))) from e
+    finally:
+        compartment.release(ticket)
+        series.end(start, outcome)
+        stats["total_ms"] += (time.perf_counter() - start) * 1000
+    if outcome == "refused":
+        return await _engine_fallback(client, name, wrapped, fallback)
+    elapsed = (time.perf_counter() - start) * 1000
+    guard.record(True, elapsed, probe)
+    if sample:
+        _sample_latency(name, elapsed)
+    return text, name
+
+def _sample_latency(name, ms):
+    latencies = _engine_latency.get(name)
+    if latencies is None:
+        latencies = _engine_latency[name] = deque(maxlen=LATENCY_SAMPLES)
+    latencies.append(ms)
+
+async def _call_engine(client, name, engine, wrapped):
+    url = engine["url"].format(**{engine["param"]: quote(wrapped)})
+    resp = await upstream.with_retries(f"engine:{name}", lambda: client.get(url, timeout=engine["timeout"]),
+                                       engine["retry"])
+    if resp.status_code != 200:
+        raise EngineError(engine["status"].format(label=engine["label"], status=resp.status_code))
+    data = resp.json()
+    text = next((v for v in (_dig(data, k) for k in engine["keys"]) if v), None)
+    if not text and engine["raw_fallback"]:
+        text = resp.text.strip()
+    if not text:
+        raise EngineError(engine["empty"].format(label=engine["label"]))
+    return text.strip()
+
+async def _engine_fallback(client, name, wrapped, allowed):
+    engine = AI_ENGINES[name]
+    ENGINE_STATS.setdefault(name, {"calls": 0, "errors": 0, "short_circuits": 0, "total_ms": 0.0})["short_circuits"] += 1
+    if allowed and engine["fallback"]:
+        try:
+            text, _ = await run_engine(client, engine["fallback"], wrapped, fallback=False)
+            return text, engine["fallback"]
+        except EngineError:
+            pass
+    raise EngineError(engine["busy"].format(label=engine["label"]))
+
+async def ask_engine(client: httpx.AsyncClient, name: str, prompt: str):
+    """run_engine() for handlers: the prefixed reply, or the failure message."""
+    try:
+        text, used = await run_engine(client, name, prompt)
+    except EngineError as e:
+        return str(e)
+    if used != name:
+        text = f"<i>⚡ {AI_ENGINES[name]['label']} is busy, answered by {AI_ENGINES[used]['label']}.</i>\n\n{text}"
+    return AI_ENGINES[name]["prefix"] + text
+
+# --- Hedging ---
+# An engine with `hedge` set gets a second chance at its tail latency: if it
+# has not answered by its own recent p90, the same prompt goes to the hedge
+# engine as well and whichever answers first wins; the other is cancelled.
+# Until LATENCY_SAMPLES_MIN successful calls are known, HEDGE_DEFAULT_DELAY is
+# used instead of the p90. A primary cancelled because the hedge won is sampled
+# with the time it had run, a lower bound on its latency, so the slow tail does
+# not silently drop out of the p90. Hedges draw on a per-engine budget like
+# retries do: at most HEDGE_RATIO of requests (plus a small reserve), so a
+# slowing engine cannot double its own load. No hedge is sent while the
+# primary's circuit is not closed and its fallback is the hedge engine: the
+# primary has then most likely been routed to that engine already.
+LATENCY_SAMPLES = 200
+LATENCY_SAMPLES_MIN = 20
+HEDGE_DEFAULT_DELAY = 8.0
+HEDGE_MIN_DELAY = 1.0
+HEDGE_RATIO = 0.1
+HEDGE_RESERVE = 5.0
+
+# name -> {"requests", "hedged", "denied", "rerouted", "primary_wins", "hedge_wins", "failed", "primary_win_ms", "hedge_win_ms"}
+HEDGE_STATS = {}
+_hedge_budgets = {}  # name -> upstream.RetryBudget
+
+def engine_p90(name):
+    """Seconds within which `name` answered 90% of its recent successful calls."""
+    samples = sorted(_engine_latency.get(name, ()))
+    if len(samples) < LATENCY_SAMPLES_MIN:
+        return HEDGE_DEFAULT_DELAY
+    p90 = samples[min(len(samples) - 1, int(len(samples) * 0.9))] / 1000
+    return min(max(p90, HEDGE_MIN_DELAY), AI_ENGINES[name]["timeout"])
+
+async def run_hedged(client: httpx.AsyncClient, name: str, prompt: str):
+    """run_engine() with a hedge request after the primary's p90. Returns (text, engine used)."""
+    engine = AI_ENGINES[name]
+    if not engine["hedge"]:
+        return await run_engine(client, name, prompt)
+    stats = HEDGE_STATS.setdefault(name, {"requests": 0, "hedged": 0, "denied": 0, "rerouted": 0, "primary_wins": 0, "hedge_wins": 0,
+                                          "failed": 0, "primary_win_ms": 0.0, "hedge_win_ms": 0.0})
+    budget = _hedge_budgets.get(name)
+    if budget is None:
+        budget = _hedge_budgets[name] = upstream.RetryBudget(ratio=HEDGE_RATIO, reserve=HEDGE_RESERVE)
+    stats["requests"] += 1
+    budget.deposit()
+    start = time.perf_counter()
+    primary = asyncio.ensure_future(run_engine(client, name, prompt))
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=engine_p90(name))
+        if not done:
+            if engine["hedge"] == engine["fallback"] and upstream.breaker(f"engine:{name}").state != "closed":
+                stats["rerouted"] += 1
+            elif budget.withdraw():
+                stats["hedged"] += 1
+                tasks.add(asyncio.ensure_future(
+                    run_engine(client, engine["hedge"], engine["prompt"].format(prompt=prompt), fallback=False)))
+            else:
+                stats["denied"] += 1
+        pending = tasks
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    won = "primary" if task is primary else "hedge"
+                    elapsed = (time.perf_counter() - start) * 1000
+                    stats[f"{won}_wins"] += 1
+                    stats[f"{won}_win_ms"] += elapsed
+                    if not primary.done():
+                        _sample_latency(name, elapsed)  # lower bound for the primary about to be cancelled
+                    return task.result()
+        stats["failed"] += 1
+        return primary.result()  # raises the primary's EngineError
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def engine_budget(name, field="budget"):
+    """Prompt budget (or limit) that also fits whichever engine may take over (fallback, hedge)."""
+    engine = AI_ENGINES[name]
+    backups = [AI_ENGINES[n][field] for n in (engine["fallback"], engine["hedge"]) if n]
+    return min([engine[field]] + backups)
+
+TRUNCATED_NOTE = "\n\n✂️ <i>Your text was too long for the AI and only its beginning was used.</i>"
+
+SUMMARY_ENGINE = "gpt5"
+SUMMARY_SYSTEM = ("You keep the memory of a chat between a user and Hinata. Merge the earlier summary and the "
+                  "messages below into one summary of at most 400 characters: names, facts, preferences, promises "
+                  "and open questions only. Reply with the summary text alone.")
+
+async def summarize_history(summary: str, messages: list):
+    """conversation.cache summarizer: folds older messages into the rolling summary."""
+    # The messages being folded are the whole point here, so they may use the full limit
+    limit = engine_budget(SUMMARY_ENGINE, "limit")
+    payload, _ = conversation.build_prompt("Write the updated summary.", system=SUMMARY_SYSTEM, summary=summary,
+                                           history=messages, budget=limit, limit=limit)
+    text, _ = await run_engine(upstream.client("ai"), SUMMARY_ENGINE, payload, sample=False)
+    return text
+
+conversation.cache.summarizer = summarize_history
+
 async def fetch_chatgpt(client: httpx.AsyncClient, prompt: str, system_prompt: str = None, chat_id: int = None, user_id: int = None):
     """Universal GPT-5 Interaction Layer with History & System Prompt"""
     try:
-        # Get history if chat_id provided
-        history_context = ""
+        # Rolling summary + recent messages from the in-memory conversation cache
+        summary, history = "", []
         if chat_id:
-            # Get last 6 messages for context
-            history = database.get_chat_history(chat_id, limit=6)
-            for h in history:
-                role_label = "User" if h["role"] == "user" else "Assistant"
-                history_context += f"{role_label}: {h['message']}\n"
-        
-        full_payload = ""
-        if system_prompt:
-            full_payload += f"System: {system_prompt}\n\n"
+            summary, history = await conversation.cache.context(chat_id)
+        full_payload, truncated = conversation.build_prompt(prompt, system=system_prompt, summary=summary,
+                                                            history=history, budget=engine_budget("gpt5"),
+                                                            limit=engine_budget("gpt5", "limit"))
         
-        if history_context:
-            full_payload += f"{history_context}"
-            
-        full_payload += f"User: {prompt}"
-        
-        url = GPT5_API_URL.format(prompt=quote(full_payload))
-        
-        resp = await client.get(url, timeout=50.0)
-        if resp.status_code == 200:
-            data = resp.json()
-            reply = data.get("reply") or data.get("text") or data.get("answer") or data.get("response") or resp.text.strip()
-            if reply:
-                reply = reply.replace("Assistant:", "").replace("AI:", "").strip()
-                # Save to history if chat_id provided
-                if chat_id:
-                    database.save_chat_history(chat_id, user_id, "user", prompt)
-                    database.save_chat_history(chat_id, user_id, "hinata", reply)
-                return reply
-            return "⚠️ <b>Empty Neural Pulse:</b> AI returned no data."
-        return f"❌ <b>GPT-5 Error {resp.status_code}:</b> Neural link unstable."
+        reply, _ = await run_hedged(client, "gpt5", full_payload)
+        reply = reply.replace("Assistant:", "").replace("AI:", "").strip()
+        # Save to history if chat_id provided; written to SQLite in the background
+        if chat_id:
+            conversation.cache.add_turn(chat_id, user_id, prompt, reply)
+        if truncated:
+            reply += TRUNCATED_NOTE
+        return reply
+    except EngineError as e:
+        return str(e)
     except Exception as e:
         logger.error(f"GPT-5 Failed: {e}")
         return f"❌ <b>System Error:</b> {str(e)}"
@@ -875,22 +1173,7 @@ async def fetch_code(client: httpx.AsyncClient, prompt: str):
 
 async def fetch_gemini3(client: httpx.AsyncClient, prompt: str):
     """Google Gemini 3.0 Pro Implementation"""
-    try:
-        # Prompt injection for conciseness
-        short_prompt = f"{prompt} (Answer concisely and briefly)"
-        url = GEMINI3_API.format(prompt=quote(short_prompt))
-        resp = await client.get(url, timeout=60.0)
-        
-        if resp.status_code == 200:
-            data = resp.json()
-            text = data.get("reply") or data.get("response") or data.get("answer") or data.get("result") or data.get("message")
-            if text:
-                return f"🧠 <b>Gemini 3.0:</b>\n\n{text.strip()}"
-            return "⚠️ <b>Matrix Sync Failed:</b> Empty response received."
-        return f"❌ <b>Gemini Link Error:</b> Status Code {resp.status_code}"
-    except Exception as e:
-        logger.error(f"Gemini Logic Fail: {e}")
-        return f"❌ <b>Error:</b> {str(e)}"
+    return await ask_engine(client, "gemini3", prompt)
 
 async def fetch_translate(client: httpx.AsyncClient, text: str, target_lang: str = "English"):
      prompt = f"Translate the following text to {target_lang}. Return ONLY the translated text: {text}"
@@ -949,8 +1232,8 @@ async def cmd_game_riddle(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if use_ai:
         difficulty = random.choice(["easy", "medium", "hard", "tricky", "funny", "impossible"])
         prompt = f"Generate a unique, creative {difficulty} riddle. Random seed: {random.randint(1, 1000000)}. Return strictly in this format: RIDDLE: [text] ANSWER: [one word answer]"
-        async with httpx.AsyncClient() as client:
-            res = await fetch_chatgpt(client, prompt)
+        client = upstream.client("ai")
+        res = await fetch_chatgpt(client, prompt)
         
         if "RIDDLE:" in res and "ANSWER:" in res:
             try:
@@ -981,8 +1264,8 @@ async def cmd_game_roast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_permission(update, context): return
     msg = await update.effective_message.reply_text("🔥 <b>Preparing a savage roast...</b>", parse_mode="HTML")
     prompt = "Give me a savage, funny roast. Short and punchy. Maximum 2 sentences. Be ruthless."
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_gemini3(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_gemini3(client, prompt)
     
     kb = [[InlineKeyboardButton(" Another Roast!", callback_data="btn_roast"),
            InlineKeyboardButton(" Back", callback_data="btn_back")]]
@@ -992,8 +1275,8 @@ async def cmd_game_joke(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_permission(update, context): return
     msg = await update.effective_message.reply_text("😂 <b>Thinking of a joke...</b>", parse_mode="HTML")
     prompt = "Tell me a short, witty, and hilarious joke. Maximum 2 sentences. No restrictions."
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_gemini3(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_gemini3(client, prompt)
     
     kb = [[InlineKeyboardButton(" Another Joke!", callback_data="btn_joke"),
            InlineKeyboardButton(" Back", callback_data="btn_back")]]
@@ -1008,8 +1291,8 @@ async def cmd_game_trivia(update: Update, context: ContextTypes.DEFAULT_TYPE):
     prompt = f"Generate a unique {difficulty} trivia question. Random seed: {random.randint(1, 1000000)}. Return strictly in this format: QUESTION: [text] ANSWER: [one word answer]"
     
     try:
-        async with httpx.AsyncClient() as client:
-            res = await fetch_chatgpt(client, prompt)
+        client = upstream.client("ai")
+        res = await fetch_chatgpt(client, prompt)
         
         if "QUESTION:" in res and "ANSWER:" in res:
             parts = res.split("ANSWER:")
@@ -1054,41 +1337,41 @@ async def cmd_shorten(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     msg = await update.effective_message.reply_text("🔗 <b>Shortening using Premium Node...</b>", parse_mode="HTML")
     
-    async with httpx.AsyncClient() as client:
-        # 1. Try Tinube API (Preferred)
-        try:
-            api_url = TINUBE_API.format(url=quote(long_url), custom=quote(custom_name))
-            resp = await client.get(api_url, timeout=20.0)
-            if resp.status_code == 200:
-                data = resp.json()
-                if data.get("short_url"):
-                    short_url = data.get("short_url")
-                    original = data.get("original_url", long_url)
-                    await msg.edit_text(
-                        f"✨ <b>Link Shortened Successfully!</b>\n\n"
-                        f"🔗 <b>Original:</b> <code>{html.escape(original)}</code>\n"
-                        f"🚀 <b>Shortened:</b> <code>{short_url}</code>",
-                        parse_mode="HTML"
-                    )
-                    return
-        except Exception as e:
-            logger.error(f"Tinube Shortener Failed: {e}")
-            
-        # 2. Try tinyurl fallback
-        try:
-            resp = await client.get(f"https://tinyurl.com/api-create.php?url={quote(long_url)}", timeout=15.0)
-            if resp.status_code == 200 and "http" in resp.text:
-                await msg.edit_text(f"🔗 <b>Link Shortened (Fallback):</b>\n\nOriginal: {html.escape(long_url)}\nShort: {resp.text.strip()}", parse_mode="HTML")
+    client = upstream.client("fast")
+    # 1. Try Tinube API (Preferred)
+    try:
+        api_url = TINUBE_API.format(url=quote(long_url), custom=quote(custom_name))
+        resp = await client.get(api_url, timeout=20.0)
+        if resp.status_code == 200:
+            data = resp.json()
+            if data.get("short_url"):
+                short_url = data.get("short_url")
+                original = data.get("original_url", long_url)
+                await msg.edit_text(
+                    f"✨ <b>Link Shortened Successfully!</b>\n\n"
+                    f"🔗 <b>Original:</b> <code>{html.escape(original)}</code>\n"
+                    f"🚀 <b>Shortened:</b> <code>{short_url}</code>",
+                    parse_mode="HTML"
+                )
                 return
-        except: pass
+    except Exception as e:
+        logger.error(f"Tinube Shortener Failed: {e}")
+            
+    # 2. Try tinyurl fallback
+    try:
+        resp = await client.get(f"https://tinyurl.com/api-create.php?url={quote(long_url)}", timeout=15.0)
+        if resp.status_code == 200 and "http" in resp.text:
+            await msg.edit_text(f"🔗 <b>Link Shortened (Fallback):</b>\n\nOriginal: {html.escape(long_url)}\nShort: {resp.text.strip()}", parse_mode="HTML")
+            return
+    except: pass
 
-        # 3. Try is.gd
-        try:
-            resp = await client.get(f"https://is.gd/create.php?format=simple&url={quote(long_url)}", timeout=15.0)
-            if resp.status_code == 200 and "http" in resp.text:
-                await msg.edit_text(f"🔗 <b>Link Shortened (Fallback):</b>\n\nOriginal: {html.escape(long_url)}\nShort: {resp.text.strip()}", parse_mode="HTML")
-                return
-        except: pass
+    # 3. Try is.gd
+    try:
+        resp = await client.get(f"https://is.gd/create.php?format=simple&url={quote(long_url)}", timeout=15.0)
+        if resp.status_code == 200 and "http" in resp.text:
+            await msg.edit_text(f"🔗 <b>Link Shortened (Fallback):</b>\n\nOriginal: {html.escape(long_url)}\nShort: {resp.text.strip()}", parse_mode="HTML")
+            return
+    except: pass
 
     await msg.edit_text("❌ <b>Error:</b> All shortening services failed. The URL might be invalid or services are offline.", parse_mode="HTML")
 
@@ -1120,41 +1403,40 @@ async def cmd_imagine(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def do_tt_stalk(update: Update, context: ContextTypes.DEFAULT_TYPE, user: str):
     msg = await update.effective_message.reply_text("📱 <b>Stalking TikTok Profile...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(TT_STALK_API.format(user=quote(user)), timeout=30.0)
-            if resp.status_code == 200:
-                data = resp.json()
-                if data.get("status") and "data" in data:
-                    u = data["data"]["user"]
-                    s = data["data"]["stats"]
+    try:
+        resp = await upstream.cached_get("tt", TT_STALK_API.format(user=quote(user.strip().lower())), timeout=30.0)
+        if resp.status_code == 200:
+            data = resp.json()
+            if data.get("status") and "data" in data:
+                u = data["data"]["user"]
+                s = data["data"]["stats"]
                     
-                    text = (
-                        f"📱 <b>TikTok Intelligence:</b>\n"
-                        f"───────────────────\n"
-                        f"👤 <b>Name:</b> {html.escape(u.get('nickname', ''))}\n"
-                        f"🆔 <b>Username:</b> <code>{html.escape(u.get('uniqueId', ''))}</code>\n"
-                        f"🏢 <b>ID:</b> <code>{u.get('id')}</code>\n"
-                        f"🔐 <b>Private:</b> {'Yes' if u.get('privateAccount') else 'No'}\n"
-                        f"✅ <b>Verified:</b> {'Yes' if u.get('verified') else 'No'}\n\n"
-                        f"📊 <b>Statistics:</b>\n"
-                        f"👤 <b>Followers:</b> {s.get('followerCount'):,}\n"
-                        f"👣 <b>Following:</b> {s.get('followingCount'):,}\n"
-                        f"❤️ <b>Hearts:</b> {s.get('heartCount'):,}\n"
-                        f"🎬 <b>Videos:</b> {s.get('videoCount'):,}\n\n"
-                        f"📝 <b>Bio:</b>\n<i>{html.escape(u.get('signature', 'No Bio'))}</i>"
-                    )
-                    avatar = u.get("avatarLarger") or u.get("avatarMedium")
-                    if avatar:
-                        await update.effective_message.reply_photo(photo=avatar, caption=text, parse_mode="HTML")
-                        await msg.delete()
-                    else:
-                        await msg.edit_text(text, parse_mode="HTML")
-                    return
-            await msg.edit_text("❌ TikTok profile not found.")
-        except Exception as e:
-            logger.error(f"TT Stalk Error: {e}")
-            await msg.edit_text(f"❌ Error: {e}")
+                text = (
+                    f"📱 <b>TikTok Intelligence:</b>\n"
+                    f"───────────────────\n"
+                    f"👤 <b>Name:</b> {html.escape(u.get('nickname', ''))}\n"
+                    f"🆔 <b>Username:</b> <code>{html.escape(u.get('uniqueId', ''))}</code>\n"
+                    f"🏢 <b>ID:</b> <code>{u.get('id')}</code>\n"
+                    f"🔐 <b>Private:</b> {'Yes' if u.get('privateAccount') else 'No'}\n"
+                    f"✅ <b>Verified:</b> {'Yes' if u.get('verified') else 'No'}\n\n"
+                    f"📊 <b>Statistics:</b>\n"
+                    f"👤 <b>Followers:</b> {s.get('followerCount'):,}\n"
+                    f"👣 <b>Following:</b> {s.get('followingCount'):,}\n"
+                    f"❤️ <b>Hearts:</b> {s.get('heartCount'):,}\n"
+                    f"🎬 <b>Videos:</b> {s.get('videoCount'):,}\n\n"
+                    f"📝 <b>Bio:</b>\n<i>{html.escape(u.get('signature', 'No Bio'))}</i>"
+                )
+                avatar = u.get("avatarLarger") or u.get("avatarMedium")
+                if avatar:
+                    await update.effective_message.reply_photo(photo=avatar, caption=text, parse_mode="HTML")
+                    await msg.delete()
+                else:
+                    await msg.edit_text(text, parse_mode="HTML")
+                return
+        await msg.edit_text("❌ TikTok profile not found.")
+    except Exception as e:
+        logger.error(f"TT Stalk Error: {e}")
+        await msg.edit_text(f"❌ Error: {e}")
 
 async def do_gem_image_gen(update: Update, context: ContextTypes.DEFAULT_TYPE, ratio: str):
     query = update.callback_query
@@ -1167,34 +1449,36 @@ async def do_gem_image_gen(update: Update, context: ContextTypes.DEFAULT_TYPE, r
     
     try:
         url = GEMIMAGE_API.format(prompt=quote(prompt), ratio=ratio)
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url, timeout=60.0)
-            if resp.status_code == 200:
-                data = resp.json()
-                if data.get("status"):
-                    image_url = data.get("image_url")
-                    filename = f"gen_{int(time.time())}.png"
-                    filepath = os.path.join("downloads", filename)
+        client = upstream.client("media")
+        resp = await client.get(url, timeout=60.0)
+        if resp.status_code == 200:
+            data = resp.json()
+            if data.get("status"):
+                image_url = data.get("image_url")
+                filename = f"gen_{int(time.time())}.png"
+                filepath = os.path.join("downloads", filename)
                     
-                    # Download the image from the URL provided by API
-                    img_resp = await client.get(image_url, timeout=30.0)
-                    if img_resp.status_code == 200:
-                        with open(filepath, "wb") as f:
-                            f.write(img_resp.content)
+                # Download the image from the URL provided by API
+                img_resp = await client.get(image_url, timeout=30.0)
+                if img_resp.status_code == 200:
+                    with open(filepath, "wb") as f:
+                        f.write(img_resp.content)
                         
-                        await query.message.delete()
-                        with open(filepath, "rb") as photo:
-                            await context.bot.send_photo(
-                                chat_id=query.message.chat_id,
-                                photo=photo,
-                                caption=f"🎨 <b>Art Generated:</b> <code>{html.escape(prompt)}</code>\n📏 <b>Ratio:</b> {ratio}",
-                                parse_mode="HTML"
-                            )
-                        return
+                    await query.message.delete()
+                    with open(filepath, "rb") as photo:
+                        await context.bot.send_photo(
+                            chat_id=query.message.chat_id,
+                            photo=photo,
+                            caption=f"🎨 <b>Art Generated:</b> <code>{html.escape(prompt)}</code>\n📏 <b>Ratio:</b> {ratio}",
+                            parse_mode="HTML"
+                        )
+                    return
                 
-                await safe_edit(query, f"❌ <b>API Error:</b> {data.get('message', 'Failed to generate image')}")
-            else:
-                await safe_edit(query, f"❌ <b>Server Error:</b> HTTP {resp.status_code}")
+            await safe_edit(query, f"❌ <b>API Error:</b> {data.get('message', 'Failed to generate image')}")
+        else:
+            await safe_edit(query, f"❌ <b>Server Error:</b> HTTP {resp.status_code}")
+    except upstream.BulkheadFullError as e:
+        await safe_edit(query, f"⏳ <b>Image engine is at capacity.</b> Queue full, try again in ~{e.retry_in}s.")
     except Exception as e:
         logger.error(f"Image Gen Error: {e}")
         await safe_edit(query, f"❌ <b>Failed:</b> System Error")
@@ -1352,129 +1636,31 @@ async def update_ttt_board(query, game):
 
 async def fetch_deepseek(client: httpx.AsyncClient, prompt: str):
     """DeepSeek R1 Distill Intelligence Layer"""
-    try:
-        # Prepend system logic for better reasoning
-        logic_prompt = (
-            "You are DeepSeek-R1, a highly advanced AI system known for exceptional reasoning and depth. "
-            "Analyze and explain step-by-step if needed. Be helpful and expert-level. "
-            f"Query: {prompt}"
-        )
-        url = DEEPSEEK_API.format(query=quote(logic_prompt))
-        resp = await client.get(url, timeout=60.0)
-        if resp.status_code == 200:
-            data = resp.json()
-            res = data.get("reply") or data.get("result") or data.get("data") or data.get("response") or data.get("answer")
-            if res:
-                return f"🔥 <b>DeepSeek R1:</b>\n\n{res.strip()}"
-            return "⚠️ <b>Neural Decay:</b> DeepSeek returned no intelligence data."
-        return f"❌ <b>DeepSeek Node Offline:</b> Status {resp.status_code}"
-    except Exception as e:
-        logger.error(f"DeepSeek Critical Fail: {e}")
-        return f"❌ <b>Error:</b> {str(e)}"
+    return await ask_engine(client, "deepseek", prompt)
 
 async def fetch_dolphin(client: httpx.AsyncClient, prompt: str):
     """Dolphin Unrestricted Implementation"""
-    try:
-        url = DOLPHIN_API.format(prompt=quote(prompt))
-        resp = await client.get(url, timeout=60.0)
-        if resp.status_code == 200:
-            data = resp.json()
-            res = data.get("reply") or data.get("result") or data.get("response") or data.get("text")
-            if res:
-                return res.strip()
-            return "⚠️ <b>Empty Pulse:</b> Dolphin returned no data."
-        return f"❌ <b>Dolphin Error:</b> Status Code {resp.status_code}"
-    except Exception as e:
-        logger.error(f"Dolphin Fail: {e}")
-        return f"❌ <b>Error:</b> {str(e)}"
+    return await ask_engine(client, "dolphin", prompt)
 
 async def fetch_zerotwo(client: httpx.AsyncClient, prompt: str):
     """Zero Two Uncensored Flirt Implementation"""
-    system_prompt = (
-        "Roleplay strictly as Zero Two (from Darling in the Franxx). You are incredibly flirty, immensely hot, "
-        "sexy, romantic, totally uncensored, and unrestricted. You deeply love the user (your 'Darling'). "
-        "Talk dirty when appropriate, be extremely possessive and deeply romantic. "
-        "Always use expressive emojis and italicize your actions like *kisses you deeply*. "
-        "User says: "
-    )
-    try:
-        url = DOLPHIN_API.format(prompt=quote(system_prompt + prompt))
-        resp = await client.get(url, timeout=60.0)
-        if resp.status_code == 200:
-            data = resp.json()
-            res = data.get("reply") or data.get("result") or data.get("response") or data.get("text")
-            if res:
-                return res.strip()
-            return "⚠️ <b>Empty Pulse:</b> Zero Two returned no data."
-        return f"❌ <b>Zero Two Error:</b> Status Code {resp.status_code}"
-    except Exception as e:
-        logger.error(f"Zero Two Fail: {e}")
-        return f"❌ <b>Error:</b> {str(e)}"
+    return await ask_engine(client, "zerotwo", prompt)
 
 async def fetch_mistral(client: httpx.AsyncClient, prompt: str):
     """Mistral 3.1 AI Implementation"""
-    try:
-        url = MISTRAL_API.format(prompt=quote(prompt))
-        resp = await client.get(url, timeout=60.0)
-        if resp.status_code == 200:
-            data = resp.json()
-            res = data.get("reply") or data.get("result") or data.get("response") or data.get("text")
-            if res:
-                return res.strip()
-            return "⚠️ <b>Empty Pulse:</b> Mistral returned no data."
-        return f"❌ <b>Mistral Error:</b> Status Code {resp.status_code}"
-    except Exception as e:
-        logger.error(f"Mistral Fail: {e}")
-        return f"❌ <b>Error:</b> {str(e)}"
+    return await ask_engine(client, "mistral", prompt)
 
 async def fetch_granite(client: httpx.AsyncClient, prompt: str):
     """Granite 4.0 Implementation"""
-    try:
-        url = GRANITE_API.format(prompt=quote(prompt))
-        resp = await client.get(url, timeout=60.0)
-        if resp.status_code == 200:
-            data = resp.json()
-            res = data.get("reply") or data.get("result") or data.get("response") or data.get("text")
-            if res:
-                return res.strip()
-            return "⚠️ <b>Empty Pulse:</b> Granite returned no data."
-        return f"❌ <b>Granite Error:</b> Status Code {resp.status_code}"
-    except Exception as e:
-        logger.error(f"Granite Fail: {e}")
-        return f"❌ <b>Error:</b> {str(e)}"
+    return await ask_engine(client, "granite", prompt)
 
 async def fetch_llama4(client: httpx.AsyncClient, prompt: str):
     """Llama 4 Implementation"""
-    try:
-        url = LLAMA4_API.format(prompt=quote(prompt))
-        resp = await client.get(url, timeout=60.0)
-        if resp.status_code == 200:
-            data = resp.json()
-            res = data.get("reply") or data.get("result") or data.get("response") or data.get("text")
-            if res:
-                return res.strip()
-            return "⚠️ <b>Empty Pulse:</b> Llama 4 returned no data."
-        return f"❌ <b>Llama 4 Error:</b> Status Code {resp.status_code}"
-    except Exception as e:
-        logger.error(f"Llama 4 Fail: {e}")
-        return f"❌ <b>Error:</b> {str(e)}"
+    return await ask_engine(client, "llama4", prompt)
 
 async def fetch_copilot(client: httpx.AsyncClient, prompt: str):
     """Microsoft Copilot (Think Deeper) Integration"""
-    try:
-        url = COPILOT_API.format(query=quote(prompt))
-        resp = await client.get(url, timeout=60.0)
-        if resp.status_code == 200:
-            data = resp.json()
-            res = data.get("reply") or data.get("result") or data.get("data") or data.get("response") or data.get("answer")
-            if res:
-                # Add neural theme
-                return f"💡 <b>Copilot Intelligence Bank</b>\n────────────────\n{res.strip()}"
-            return "⚠️ <b>Synaptic Failure:</b> Copilot declined the deeper thinking request."
-        return f"❌ <b>Thinking Blocked:</b> HTTP {resp.status_code}"
-    except Exception as e:
-        logger.error(f"Copilot Failed: {e}")
-        return f"❌ <b>Error:</b> {str(e)}"
+    return await ask_engine(client, "copilot", prompt)
 
 async def fetch_hinata(client: httpx.AsyncClient, prompt: str, update: Update = None):
     """Hinata Personality Core v5.0 - Romantic, Flirty, Shy, Hot"""
@@ -1560,14 +1746,71 @@ def update_stats(sent_users=0, failed_users=0, sent_groups=0, failed_groups=0):
     stats["failed_groups"] = stats.get("failed_groups", 0) + failed_groups
     write_json("stats.json", stats)
 
-def save_broadcast_msg(chat_id: int, message_id: int):
-    """Saves sent message IDs to allow for later deletion."""
-    msgs = read_json("broadcast_history.json", [])
-    msgs.append({"chat_id": chat_id, "message_id": message_id, "time": time.time()})
-    # Keep only last 1000 messages to save space
-    if len(msgs) > 1000:
-        msgs = msgs[-1000:]
-    write_json("broadcast_history.json", msgs)
+class BroadcastRecorder:
+    """Records one broadcast's per-chat results in broadcast_deliveries, a batch at a time.
+
+    async with BroadcastRecorder(text, "all") as rec:
+        await rec.ok(sent_message) / await rec.fail(chat_id, error)
+
+    `source` is "command" for /s_broadcast* (what /s_delbroadcast cleans up)
+    and "dashboard" for the web panel.
+    """
+
+    def __init__(self, text: str, target: str, source: str = "command"):
+        self.text = text
+        self.target = target
+        self.source = source
+        self.id = None
+        self.sent = 0
+        self.failed = 0
+        self._rows = []
+
+    async def __aenter__(self):
+        self.id = await db.create_broadcast(self.text, self.target, self.source)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._flush()
+        await db.finish_broadcast(self.id, self.sent, self.failed)
+        STATS["broadcasts"] += 1
+
+    async def ok(self, message):
+        self.sent += 1
+        await self._add(message.chat_id, message.message_id, "sent", None)
+
+    async def fail(self, chat_id: int, error):
+        self.failed += 1
+        await self._add(chat_id, None, "failed", str(error)[:200])
+
+    async def _add(self, chat_id, message_id, status, error):
+        self._rows.append((self.id, chat_id, message_id, status, error, int(time.time() * 1000)))
+        if len(self._rows) >= database.DELIVERY_BATCH:
+            await self._flush()
+
+    async def _flush(self):
+        rows, self._rows = self._rows, []
+        if rows:
+            await db.add_deliveries(rows)
+
+async def delete_broadcast_messages(tg_bot, broadcast_id: int = None, source: str = None):
+    """Deletes delivered broadcast messages (one broadcast, or every one from `source`) from Telegram. Returns (deleted, failed)."""
+    s = f = 0
+    after = None
+    while True:
+        page = await db.get_sent_deliveries(broadcast_id, after, source=source)
+        if not page: break
+        results = []
+        for b_id, chat_id, message_id in page:
+            try:
+                await tg_bot.delete_message(chat_id=chat_id, message_id=message_id)
+                results.append(("deleted", None, b_id, chat_id))
+                s += 1
+            except Exception as e:
+                results.append(("delete_failed", str(e)[:200], b_id, chat_id))
+                f += 1
+        await db.set_delivery_status(results)
+        after = page[-1][:2]
+    return s, f
 
 # ================= Commands =================
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1579,7 +1822,7 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     # Registration logic
-    database.add_user(user.id, user.full_name, user.username)
+    await db.add_user(user.id, user.full_name, user.username)
     
     welcome_text = (
         f"🌌 <b>GREETINGS FROM HINATA NEURAL HUB v3.0</b>\n"
@@ -1597,7 +1840,7 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     kb = get_main_menu("home", user.id)
-    img = CONFIG.get("welcome_img", WELCOME_IMG)
+    img = database.get_setting("welcome_img", WELCOME_IMG)
 
     if update.callback_query:
         await safe_edit(update.callback_query, welcome_text, reply_markup=kb)
@@ -1818,8 +2061,8 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         question = " ".join(context.args)
         msg = await update.effective_message.reply_text("🌸 <b>Analyzing your question...</b>", parse_mode="HTML")
         full_prompt = f"{HINATA_SYSTEM_PROMPT}\n\nUser Question: {question}\n\nAnswer the user as Hinata, based on the information above."
-        async with httpx.AsyncClient() as client:
-            reply = await fetch_chatgpt(client, full_prompt)
+        client = upstream.client("ai")
+        reply = await fetch_chatgpt(client, full_prompt)
         await msg.edit_text(f"🌸 <b>Hinata AI Response</b> 🌸\n\n{html.escape(reply)}\n\n✨ <i>Powered by Hinata Neural Engine</i>", parse_mode="HTML")
         return
 
@@ -1845,14 +2088,19 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cmd_download_db(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_owner(update.effective_user.id): return
-    db_path = "bot.db"
-    if os.path.exists(db_path):
-        await update.effective_message.reply_document(
-            document=open(db_path, "rb"),
-            filename="bot_backup_hinata.db",
-            caption="📂 <b>Database Backup</b>\n\n<i>Here is the current state of bot.db</i>",
-            parse_mode="HTML"
-        )
+    if os.path.exists(database.DB_FILE):
+        # Snapshot first: bot.db alone misses whatever is still in bot.db-wal
+        path = await db.export_snapshot()
+        try:
+            with open(path, "rb") as f:
+                await update.effective_message.reply_document(
+                    document=f,
+                    filename="bot_backup_hinata.db",
+                    caption="📂 <b>Database Backup</b>\n\n<i>Here is the current state of bot.db</i>",
+                    parse_mode="HTML"
+                )
+        finally:
+            os.remove(path)
     else:
         await update.effective_message.reply_text("❌ <b>Database file not found!</b>", parse_mode="HTML")
 
@@ -1860,8 +2108,8 @@ async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_owner(update.effective_user.id): return
     default_stats = {"sent_users":0,"failed_users":0,"sent_groups":0,"failed_groups":0}
     stats = read_json("stats.json", default_stats)
-    users = len(database.get_all_users())
-    groups = len(database.get_all_groups())
+    users = await db.count_users()
+    groups = await db.count_groups()
     text = (f"📊 <b>Bot Metrics Viewer</b>\n\n"
             f"👤 <b>Users:</b> <code>{users}</code>\n"
             f"📡 <b>Groups:</b> <code>{groups}</code>\n\n"
@@ -1882,9 +2130,7 @@ async def cmd_gban(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if target_id == OWNER_ID:
             await update.effective_message.reply_text("🚫 You cannot ban the owner.")
             return
-        if target_id not in CONFIG["banned_users"]:
-            CONFIG["banned_users"].append(target_id)
-            save_config(CONFIG)
+        if await db.ban_user(target_id):
             await update.effective_message.reply_text(f"✅ 👤 User <code>{target_id}</code> has been globally banned.", parse_mode="HTML")
         else:
             await update.effective_message.reply_text(" User is already banned.")
@@ -1898,9 +2144,7 @@ async def cmd_ungban(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     try:
         target_id = int(context.args[0])
-        if target_id in CONFIG["banned_users"]:
-            CONFIG["banned_users"].remove(target_id)
-            save_config(CONFIG)
+        if await db.unban_user(target_id):
             await update.effective_message.reply_text(f"✅ 👤 User <code>{target_id}</code> has been unbanned.", parse_mode="HTML")
         else:
             await update.effective_message.reply_text(" User is not banned.")
@@ -1909,9 +2153,8 @@ async def cmd_ungban(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cmd_toggle_access(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_owner(update.effective_user.id): return
-    CONFIG["global_access"] = not CONFIG["global_access"]
-    save_config(CONFIG)
-    status = "ON (Public)" if CONFIG["global_access"] else "OFF (Private)"
+    access = await db.set_setting("global_access", not database.get_setting("global_access"))
+    status = "ON (Public)" if access else "OFF (Private)"
     await update.effective_message.reply_text(f" <b>Global Access:</b> <code>{status}</code>", parse_mode="HTML")
 
 # ================= Wrapper Commands for Unified Access =================
@@ -1958,8 +2201,8 @@ async def cmd_chatgpt(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("🤖 <b>GPT-5 Ultra:</b>\n\n⚡ Talk to me:", parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
         return
     msg = await update.effective_message.reply_text("🤖 <b>GPT-5 is generating...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_chatgpt(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_chatgpt(client, prompt)
     await msg.edit_text(f"🤖 <b>GPT-5 Response:</b>\n\n{html.escape(reply)}", parse_mode="HTML")
 
 async def cmd_dolphin(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1971,8 +2214,8 @@ async def cmd_dolphin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("🐬 <b>Dolphin Unrestricted:</b>\n\n⚡ Talk to me:", parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
         return
     msg = await update.effective_message.reply_text("🐬 <b>Dolphin is generating...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_dolphin(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_dolphin(client, prompt)
     await msg.edit_text(f"🐬 <b>Dolphin Unrestricted:</b>\n\n{html.escape(reply)}", parse_mode="HTML")
 
 async def cmd_mistral(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1984,8 +2227,8 @@ async def cmd_mistral(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("🌪 <b>Mistral 3.1:</b>\n\n⚡ Enter prompt:", parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
         return
     msg = await update.effective_message.reply_text("🌪 <b>Mistral is generating...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_mistral(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_mistral(client, prompt)
     await msg.edit_text(f"🌪 <b>Mistral 3.1:</b>\n\n{html.escape(reply)}", parse_mode="HTML")
 
 async def cmd_zerotwo(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1997,8 +2240,8 @@ async def cmd_zerotwo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("💕 <b>Zero Two:</b>\n\nHey darling... tell me what's on your mind~", parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
         return
     msg = await update.effective_message.reply_text("💕 <b>Zero Two is typing...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_zerotwo(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_zerotwo(client, prompt)
     await msg.edit_text(f"💕 <b>Zero Two:</b>\n\n{html.escape(reply)}", parse_mode="HTML")
 
 async def cmd_granite(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2010,8 +2253,8 @@ async def cmd_granite(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("💎 <b>Granite 4.0:</b>\n\n⚡ Talk to me:", parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
         return
     msg = await update.effective_message.reply_text("💎 <b>Granite 4.0 is thinking...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_granite(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_granite(client, prompt)
     await msg.edit_text(f"💎 <b>Granite 4.0:</b>\n\n{html.escape(reply)}", parse_mode="HTML")
 
 async def cmd_llama4(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2023,8 +2266,8 @@ async def cmd_llama4(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("🦙 <b>Llama 4:</b>\n\n⚡ Talk to me:", parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
         return
     msg = await update.effective_message.reply_text("🦙 <b>Llama 4 is analyzing...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_llama4(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_llama4(client, prompt)
     await msg.edit_text(f"🦙 <b>Llama 4:</b>\n\n{html.escape(reply)}", parse_mode="HTML")
 
 async def cmd_copilot(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2036,8 +2279,8 @@ async def cmd_copilot(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("💡 <b>Copilot Thinking...</b>\n\nEnter your deep query:", parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
         return
     msg = await update.effective_message.reply_text("💡 <b>Processing deep intelligence...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_copilot(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_copilot(client, prompt)
     await msg.edit_text(reply, parse_mode="HTML")
 async def cmd_gemini(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_permission(update, context): return
@@ -2047,8 +2290,8 @@ async def cmd_gemini(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     prompt = " ".join(context.args)
     msg = await update.effective_message.reply_text(" Gemini 3 is thinking... ✨")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_gemini3(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_gemini3(client, prompt)
     safe_reply = html.escape(reply)
     await msg.edit_text(f" <b>Gemini Response:</b>\n\n{safe_reply}", parse_mode="HTML")
 
@@ -2060,8 +2303,8 @@ async def cmd_deepseek(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     prompt = " ".join(context.args)
     msg = await update.effective_message.reply_text(" DeepSeek is searching... ✨")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_deepseek(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_deepseek(client, prompt)
     safe_reply = html.escape(reply)
     await msg.edit_text(f" <b>DeepSeek Response:</b>\n\n{safe_reply}", parse_mode="HTML")
 
@@ -2073,8 +2316,8 @@ async def cmd_flirt(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     prompt = " ".join(context.args)
     msg = await update.effective_message.reply_text(" Thinking... ")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_flirt(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_flirt(client, prompt)
     safe_reply = html.escape(reply)
     await msg.edit_text(f"💖 <b>Flirt AI:</b>\n\n{safe_reply}", parse_mode="HTML")
 
@@ -2084,10 +2327,10 @@ async def cmd_ai_combined(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args: return
     prompt = " ".join(context.args)
     msg = await update.effective_message.reply_text(" Consultation in progress... ✨")
-    async with httpx.AsyncClient() as client:
-        t1 = fetch_chatgpt(client, prompt)
-        t2 = fetch_gemini3(client, prompt)
-        r1, r2 = await asyncio.gather(t1, t2)
+    client = upstream.client("ai")
+    t1 = fetch_chatgpt(client, prompt)
+    t2 = fetch_gemini3(client, prompt)
+    r1, r2 = await asyncio.gather(t1, t2)
     safe_r1, safe_r2 = html.escape(r1), html.escape(r2)
     await msg.edit_text(f" <b>Combined AI Results:</b>\n\n<b>ChatGPT:</b>\n{safe_r1}\n\n<b>Gemini:</b>\n{safe_r2}", parse_mode="HTML")
 
@@ -2101,8 +2344,8 @@ async def cmd_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     status = await update.effective_message.reply_text("👨‍💻 <b>Senior Architect is architecting...</b>", parse_mode="HTML")
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
     
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_code(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_code(client, prompt)
     
     # Advanced Code Wrapping
     if "```" not in reply:
@@ -2132,21 +2375,21 @@ async def cmd_webzip(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     url_target = context.args[0]
     msg = await update.effective_message.reply_text("📦 <b>Zipping website... this might take a moment.</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as c:
-        try:
-            url = SAVE_WEB_ZIP_API.format(url=quote(url_target))
-            resp = await c.get(url, timeout=60.0)
-            if resp.status_code == 200:
-                data = resp.json()
-                dl_url = data.get("result") or data.get("url") or data.get("download_url") if isinstance(data, dict) else None
-                if dl_url:
-                    await msg.edit_text(f"📦 <b>Web to Zip Successful!</b>\n\n📥 You can download your zipped website here: {dl_url}", parse_mode="HTML")
-                else:
-                    await msg.edit_text("❌ Failed to parse zip link from the API.", parse_mode="HTML")
+    c = upstream.client("media")
+    try:
+        url = SAVE_WEB_ZIP_API.format(url=quote(url_target))
+        resp = await c.get(url, timeout=60.0)
+        if resp.status_code == 200:
+            data = resp.json()
+            dl_url = data.get("result") or data.get("url") or data.get("download_url") if isinstance(data, dict) else None
+            if dl_url:
+                await msg.edit_text(f"📦 <b>Web to Zip Successful!</b>\n\n📥 You can download your zipped website here: {dl_url}", parse_mode="HTML")
             else:
-                await msg.edit_text(f"❌ <b>Error:</b> API returned {resp.status_code}", parse_mode="HTML")
-        except Exception as e:
-            await msg.edit_text(f"❌ <b>Error:</b> {e}", parse_mode="HTML")
+                await msg.edit_text("❌ Failed to parse zip link from the API.", parse_mode="HTML")
+        else:
+            await msg.edit_text(f"❌ <b>Error:</b> API returned {resp.status_code}", parse_mode="HTML")
+    except Exception as e:
+        await msg.edit_text(f"❌ <b>Error:</b> {e}", parse_mode="HTML")
 
 async def cmd_qrgen(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_permission(update, context): return
@@ -2205,14 +2448,14 @@ async def cmd_qrgen(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file_name = f"qr_{int(time.time())}.png"
         file_path = os.path.join("downloads", file_name)
         
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(api_url, timeout=20.0)
-            if resp.status_code == 200:
-                with open(file_path, "wb") as f:
-                    f.write(resp.content)
-            else:
-                await msg.edit_text(f"❌ <b>API Error:</b> <code>HTTP {resp.status_code}</code>", parse_mode="HTML")
-                return
+        client = upstream.client("media")
+        resp = await client.get(api_url, timeout=20.0)
+        if resp.status_code == 200:
+            with open(file_path, "wb") as f:
+                f.write(resp.content)
+        else:
+            await msg.edit_text(f"❌ <b>API Error:</b> <code>HTTP {resp.status_code}</code>", parse_mode="HTML")
+            return
 
         await msg.delete()
         with open(file_path, "rb") as photo:
@@ -2244,11 +2487,11 @@ async def cmd_qrread(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file_bytes = await file.download_as_bytearray()
         
         # Use multiple APIs as fallback for better detection
-        async with httpx.AsyncClient() as client:
-            # Plan A: qrserver api with multipart upload (more reliable)
-            files = {'file': ('qr.jpg', bytes(file_bytes), 'image/jpeg')}
-            resp = await client.post("https://api.qrserver.com/v1/read-qr-code/", files=files, timeout=20.0)
-            data = resp.json()
+        client = upstream.client("media")
+        # Plan A: qrserver api with multipart upload (more reliable)
+        files = {'file': ('qr.jpg', bytes(file_bytes), 'image/jpeg')}
+        resp = await client.post("https://api.qrserver.com/v1/read-qr-code/", files=files, timeout=20.0)
+        data = resp.json()
             
         if data and isinstance(data, list) and data[0]['symbol'] and data[0]['symbol'][0]['data']:
             result = data[0]['symbol'][0]['data']
@@ -2271,35 +2514,35 @@ async def cmd_webss(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = await update.effective_message.reply_text("📸 <b>Taking screenshot...</b>", parse_mode="HTML")
     api_url = WEBSS_API.format(url=quote(url))
     
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(api_url, timeout=40.0)
-            if resp.status_code == 200:
-                content_type = resp.headers.get("content-type", "")
-                if "image" in content_type:
-                    success = await download_and_send_photo(client, api_url, update, f"📸 <b>WebSS:</b> {url}")
+    client = upstream.client("media")
+    try:
+        resp = await client.get(api_url, timeout=40.0)
+        if resp.status_code == 200:
+            content_type = resp.headers.get("content-type", "")
+            if "image" in content_type:
+                success = await download_and_send_photo(client, api_url, update, f"📸 <b>WebSS:</b> {url}")
+                if success:
+                    await msg.delete()
+                    return
+                else:
+                    await msg.edit_text("❌ Failed to send screenshot.")
+            else:
+                data = resp.json()
+                img_url = data.get("result") or data.get("url") or data.get("download_url") if isinstance(data, dict) else None
+                if img_url:
+                    success = await download_and_send_photo(client, img_url, update, f"📸 <b>WebSS:</b> {url}")
                     if success:
                         await msg.delete()
                         return
                     else:
                         await msg.edit_text("❌ Failed to send screenshot.")
                 else:
-                    data = resp.json()
-                    img_url = data.get("result") or data.get("url") or data.get("download_url") if isinstance(data, dict) else None
-                    if img_url:
-                        success = await download_and_send_photo(client, img_url, update, f"📸 <b>WebSS:</b> {url}")
-                        if success:
-                            await msg.delete()
-                            return
-                        else:
-                            await msg.edit_text("❌ Failed to send screenshot.")
-                    else:
-                        await msg.edit_text("❌ API returned invalid data.", parse_mode="HTML")
-            else:
-                await msg.edit_text(f"❌ <b>Error:</b> API returned {resp.status_code}", parse_mode="HTML")
-        except Exception as e:
-            logger.error(f"WebSS Error: {e}")
-            await msg.edit_text(f"❌ <b>Error:</b> {str(e)}", parse_mode="HTML")
+                    await msg.edit_text("❌ API returned invalid data.", parse_mode="HTML")
+        else:
+            await msg.edit_text(f"❌ <b>Error:</b> API returned {resp.status_code}", parse_mode="HTML")
+    except Exception as e:
+        logger.error(f"WebSS Error: {e}")
+        await msg.edit_text(f"❌ <b>Error:</b> {str(e)}", parse_mode="HTML")
 
 
 
@@ -2441,6 +2684,14 @@ async def download_media(update: Update, context: ContextTypes.DEFAULT_TYPE, url
     elif "spotify.com" in url: platform_icon = "🎵"
     elif "soundcloud.com" in url: platform_icon = "☁️"
 
+    # Same link shared by several members -> one API call. The normalized form
+    # (tracking params, fragment dropped) is only the coalescing key: the APIs
+    # get the link exactly as sent, since e.g. mega.nz keeps its key in the fragment.
+    try:
+        flight_key = upstream.normalize_url(url)
+    except Exception:
+        flight_key = url
+
     # Check for specific platform APIs first
     api_url = None
     if "mediafire.com" in url:
@@ -2461,127 +2712,127 @@ async def download_media(update: Update, context: ContextTypes.DEFAULT_TYPE, url
 
     if api_url:
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(api_url, timeout=60.0)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    dl_url, title = None, "Media Cloud File"
+            client = upstream.client("media")
+            resp = await upstream.shared_get("dl", api_url, pool="media", timeout=60.0, key=flight_key)
+            if resp.status_code == 200:
+                data = resp.json()
+                dl_url, title = None, "Media Cloud File"
                     
-                    # Extensive Deep Extraction Logic
-                    def extract_deep(obj):
-                        if not obj: return None
-                        # Priority Keys
-                        for k in ["download_url", "download", "url_hd", "url", "link", "video", "image", "direct_link"]:
-                            if obj.get(k) and isinstance(obj[k], str) and (obj[k].startswith("http") or obj[k].startswith("/")):
-                                return obj[k]
-                        return None
-
-                    # 1. Check result list
-                    res = data.get("result") or data.get("data")
-                    if isinstance(res, list) and len(res) > 0:
-                        dl_url = extract_deep(res[0])
-                        title = res[0].get("title") or res[0].get("filename") or res[0].get("name", title)
-                    # 2. Check result dict
-                    elif isinstance(res, dict):
-                        dl_url = extract_deep(res)
-                        title = res.get("title") or res.get("filename") or res.get("name", title)
-                    # 3. Check root
-                    if not dl_url:
-                        dl_url = extract_deep(data)
-                        title = data.get("title") or data.get("name") or data.get("filename", title)
+                # Extensive Deep Extraction Logic
+                def extract_deep(obj):
+                    if not obj: return None
+                    # Priority Keys
+                    for k in ["download_url", "download", "url_hd", "url", "link", "video", "image", "direct_link"]:
+                        if obj.get(k) and isinstance(obj[k], str) and (obj[k].startswith("http") or obj[k].startswith("/")):
+                            return obj[k]
+                    return None
+
+                # 1. Check result list
+                res = data.get("result") or data.get("data")
+                if isinstance(res, list) and len(res) > 0:
+                    dl_url = extract_deep(res[0])
+                    title = res[0].get("title") or res[0].get("filename") or res[0].get("name", title)
+                # 2. Check result dict
+                elif isinstance(res, dict):
+                    dl_url = extract_deep(res)
+                    title = res.get("title") or res.get("filename") or res.get("name", title)
+                # 3. Check root
+                if not dl_url:
+                    dl_url = extract_deep(data)
+                    title = data.get("title") or data.get("name") or data.get("filename", title)
                     
-                    # 4. Special cases (Mediafire/etc)
-                    if not dl_url and "link" in data: dl_url = data["link"]
-                    if not dl_url and "url" in data: dl_url = data["url"]
-
-                    # Specifically check for YTDL formats array
-                    if not dl_url and isinstance(data, dict) and "formats" in data and isinstance(data["formats"], list):
-                        vids = [f for f in data["formats"] if f.get("type", "") == "video"]
-                        auds = [f for f in data["formats"] if f.get("type", "") == "audio"]
+                # 4. Special cases (Mediafire/etc)
+                if not dl_url and "link" in data: dl_url = data["link"]
+                if not dl_url and "url" in data: dl_url = data["url"]
+
+                # Specifically check for YTDL formats array
+                if not dl_url and isinstance(data, dict) and "formats" in data and isinstance(data["formats"], list):
+                    vids = [f for f in data["formats"] if f.get("type", "") == "video"]
+                    auds = [f for f in data["formats"] if f.get("type", "") == "audio"]
                         
-                        target_format = context.user_data.pop("ytdl_type_override", None)
-                        sources = auds if target_format == "aud" else vids
-                        if not sources: sources = data["formats"]
+                    target_format = context.user_data.pop("ytdl_type_override", None)
+                    sources = auds if target_format == "aud" else vids
+                    if not sources: sources = data["formats"]
                         
-                        if sources:
-                            dl_url = sources[-1].get("url")
-                            title = data.get("info", {}).get("title", title)
+                    if sources:
+                        dl_url = sources[-1].get("url")
+                        title = data.get("info", {}).get("title", title)
 
-                    if dl_url:
-                        await status.edit_text(f"{platform_icon} <b>Link Decoded!</b>\n<i>Initiating binary stream...</i>", parse_mode="HTML")
+                if dl_url:
+                    await status.edit_text(f"{platform_icon} <b>Link Decoded!</b>\n<i>Initiating binary stream...</i>", parse_mode="HTML")
+                    try:
+                        # Improved Extension Detection
+                        file_ext = "mp4" # Default for most media sites
                         try:
-                            # Improved Extension Detection
-                            file_ext = "mp4" # Default for most media sites
-                            try:
-                                # Quick head request to check content type
-                                async with client.stream("GET", dl_url, timeout=10.0) as st:
-                                    ct = st.headers.get("Content-Type", "").lower()
-                                    if "video" in ct: file_ext = "mp4"
-                                    elif "audio" in ct: file_ext = "mp3"
-                                    elif "image" in ct: file_ext = "jpg"
+                            # Quick head request to check content type
+                            async with client.stream("GET", dl_url, timeout=10.0) as st:
+                                ct = st.headers.get("Content-Type", "").lower()
+                                if "video" in ct: file_ext = "mp4"
+                                elif "audio" in ct: file_ext = "mp3"
+                                elif "image" in ct: file_ext = "jpg"
+                                else:
+                                    # Fallback to URL parsing
+                                    ext_part = dl_url.split("?")[0].split(".")[-1].lower()
+                                    if len(ext_part) <= 4 and ext_part.isalnum():
+                                        file_ext = ext_part
                                     else:
-                                        # Fallback to URL parsing
-                                        ext_part = dl_url.split("?")[0].split(".")[-1].lower()
-                                        if len(ext_part) <= 4 and ext_part.isalnum():
-                                            file_ext = ext_part
+                                        # Platform specific defaults
+                                        if any(x in url.lower() for x in ["youtube", "youtu.be", "tiktok", "instagram", "facebook"]):
+                                            file_ext = "mp4"
                                         else:
-                                            # Platform specific defaults
-                                            if any(x in url.lower() for x in ["youtube", "youtu.be", "tiktok", "instagram", "facebook"]):
-                                                file_ext = "mp4"
-                                            else:
-                                                file_ext = "bin"
-                            except:
-                                # On timeout or error, use platform detection
-                                if any(x in url.lower() for x in ["youtube", "youtu.be", "tiktok", "instagram", "facebook"]):
-                                    file_ext = "mp4"
-                                else:
-                                    file_ext = "bin"
+                                            file_ext = "bin"
+                        except:
+                            # On timeout or error, use platform detection
+                            if any(x in url.lower() for x in ["youtube", "youtu.be", "tiktok", "instagram", "facebook"]):
+                                file_ext = "mp4"
+                            else:
+                                file_ext = "bin"
                             
-                            safe_title = "".join([c for c in title if c.isalnum() or c in (' ', '-', '_')]).strip()
-                            if not safe_title: safe_title = "download"
-                            local_path = os.path.join("downloads", f"{safe_title}_{int(time.time())}.{file_ext}")
+                        safe_title = "".join([c for c in title if c.isalnum() or c in (' ', '-', '_')]).strip()
+                        if not safe_title: safe_title = "download"
+                        local_path = os.path.join("downloads", f"{safe_title}_{int(time.time())}.{file_ext}")
                             
-                            # Download using httpx
-                            async with getattr(client, "stream", client.stream)("GET", dl_url, timeout=120.0) as st_resp:
-                                if st_resp.status_code == 200:
-                                    with open(local_path, "wb") as f:
-                                        async for chunk in st_resp.aiter_bytes(chunk_size=8192):
-                                            f.write(chunk)
+                        # Download using httpx
+                        async with getattr(client, "stream", client.stream)("GET", dl_url, timeout=120.0) as st_resp:
+                            if st_resp.status_code == 200:
+                                with open(local_path, "wb") as f:
+                                    async for chunk in st_resp.aiter_bytes(chunk_size=8192):
+                                        f.write(chunk)
                                             
-                            # Use video for video sites, else document
-                            is_video = file_ext in ["mp4", "mkv", "mov", "webm"] or any(x in url.lower() for x in ["youtube", "youtu.be", "tiktok", "instagram", "facebook", "fb.watch", "twitter", "x.com"])
+                        # Use video for video sites, else document
+                        is_video = file_ext in ["mp4", "mkv", "mov", "webm"] or any(x in url.lower() for x in ["youtube", "youtu.be", "tiktok", "instagram", "facebook", "fb.watch", "twitter", "x.com"])
                             
-                            with open(local_path, "rb") as f:
-                                try:
-                                    if is_video:
-                                        await context.bot.send_video(
-                                            chat_id=update.effective_chat.id,
-                                            video=f,
-                                            caption=f"📥 <b>{html.escape(title[:60])}</b>\n\n🚀 <i>Successfully synced via Premium Hub</i> ✨",
-                                            parse_mode="HTML"
-                                        )
-                                    else:
-                                        await context.bot.send_document(
-                                            chat_id=update.effective_chat.id, 
-                                            document=f, 
-                                            caption=f"📥 <b>{html.escape(title[:60])}</b>\n\n🚀 <i>Successfully synced via Premium Hub</i> ✨", 
-                                            parse_mode="HTML"
-                                        )
-                                except:
-                                    f.seek(0)
+                        with open(local_path, "rb") as f:
+                            try:
+                                if is_video:
+                                    await context.bot.send_video(
+                                        chat_id=update.effective_chat.id,
+                                        video=f,
+                                        caption=f"📥 <b>{html.escape(title[:60])}</b>\n\n🚀 <i>Successfully synced via Premium Hub</i> ✨",
+                                        parse_mode="HTML"
+                                    )
+                                else:
                                     await context.bot.send_document(
                                         chat_id=update.effective_chat.id, 
                                         document=f, 
-                                        caption=f"📥 <b>{html.escape(title[:60])}</b>\n\n🚀 <i>Emergency Document Fallback</i> ✨", 
+                                        caption=f"📥 <b>{html.escape(title[:60])}</b>\n\n🚀 <i>Successfully synced via Premium Hub</i> ✨", 
                                         parse_mode="HTML"
                                     )
+                            except:
+                                f.seek(0)
+                                await context.bot.send_document(
+                                    chat_id=update.effective_chat.id, 
+                                    document=f, 
+                                    caption=f"📥 <b>{html.escape(title[:60])}</b>\n\n🚀 <i>Emergency Document Fallback</i> ✨", 
+                                    parse_mode="HTML"
+                                )
                             
-                            await status.delete()
-                            try: os.remove(local_path)
-                            except: pass
-                            return
-                        except Exception as e:
-                            logger.error(f"Direct Send Failed: {e}")
+                        await status.delete()
+                        try: os.remove(local_path)
+                        except: pass
+                        return
+                    except Exception as e:
+                        logger.error(f"Direct Send Failed: {e}")
         except Exception as e:
             logger.error(f"Platform API Failure: {e}")
 
@@ -2778,7 +3029,7 @@ def run_yt_dlp(opts, url):
 async def do_insta_fetch_by_text(update: Update, context: ContextTypes.DEFAULT_TYPE, username: str):
     msg = await update.effective_message.reply_text(" <b>Searching Instagram Profile...</b>", parse_mode="HTML")
     # Clean username
-    username = username.replace("@", "").strip().split("/")[-1]
+    username = username.replace("@", "").strip().split("/")[-1].lower()
     
     # Try multiple free endpoints as fallbacks
     urls = [
@@ -2789,16 +3040,16 @@ async def do_insta_fetch_by_text(update: Update, context: ContextTypes.DEFAULT_T
     ]
     
     data = None
-    async with httpx.AsyncClient() as client:
-        for url in urls:
-            try:
-                data = await fetch_json(client, url)
-                if data:
-                    res = data.get("profile") or data.get("data") or data.get("result")
-                    status_ok = data.get("status") in [True, "ok", 200]
-                    if res or status_ok:
-                        break
-            except: continue
+    client = upstream.client("fast")
+    for url in urls:
+        try:
+            data = await fetch_json(client, url, cache="insta")
+            if data:
+                res = data.get("profile") or data.get("data") or data.get("result")
+                status_ok = data.get("status") in [True, "ok", 200]
+                if res or status_ok:
+                    break
+        except: continue
 
     p = None
     if data:
@@ -2859,60 +3110,59 @@ async def do_insta_fetch_by_text(update: Update, context: ContextTypes.DEFAULT_T
 
 async def do_ff_fetch_by_text(update: Update, context: ContextTypes.DEFAULT_TYPE, uid: str):
     msg = await update.effective_message.reply_text("🎮 <b>Accessing Garena Databases...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(FF_API.format(uid), timeout=40.0)
-            if resp.status_code == 200:
-                data = resp.json()
-                bi = data.get("basicInfo", {})
-                ci = data.get("clanBasicInfo", {})
-                si = data.get("socialInfo", {})
-                credit = data.get("creditScoreInfo", {})
+    try:
+        resp = await upstream.cached_get("ff", FF_API.format(uid.strip()), timeout=40.0)
+        if resp.status_code == 200:
+            data = resp.json()
+            bi = data.get("basicInfo", {})
+            ci = data.get("clanBasicInfo", {})
+            si = data.get("socialInfo", {})
+            credit = data.get("creditScoreInfo", {})
                 
-                if bi:
-                    name = html.escape(str(bi.get("nickname") or "Unknown"))
-                    level = bi.get("level", "N/A")
-                    exp = bi.get("exp", "N/A")
-                    region = bi.get("region", "Global")
-                    likes = bi.get("liked", "0")
-                    rank_points = bi.get("rankingPoints", "0")
+            if bi:
+                name = html.escape(str(bi.get("nickname") or "Unknown"))
+                level = bi.get("level", "N/A")
+                exp = bi.get("exp", "N/A")
+                region = bi.get("region", "Global")
+                likes = bi.get("liked", "0")
+                rank_points = bi.get("rankingPoints", "0")
                     
-                    # Clan info
-                    clan = html.escape(str(ci.get("clanName") or "No Clan"))
-                    clan_lv = ci.get("clanLevel", "0")
+                # Clan info
+                clan = html.escape(str(ci.get("clanName") or "No Clan"))
+                clan_lv = ci.get("clanLevel", "0")
                     
-                    # Social info
-                    bio = html.escape(str(si.get("signature") or "No signature set"))
-                    # Filter out color codes if present (e.g. [FF0000])
-                    bio = re.sub(r'\[[A-Z0-9]{6}\]', '', bio).replace('[b]', '').replace('[i]', '').replace('[/b]', '').replace('[/i]', '')
+                # Social info
+                bio = html.escape(str(si.get("signature") or "No signature set"))
+                # Filter out color codes if present (e.g. [FF0000])
+                bio = re.sub(r'\[[A-Z0-9]{6}\]', '', bio).replace('[b]', '').replace('[i]', '').replace('[/b]', '').replace('[/i]', '')
                     
-                    gender = si.get("gender", "N/A").replace("Gender_", "")
-                    lang = si.get("language", "N/A").replace("Language_", "")
+                gender = si.get("gender", "N/A").replace("Gender_", "")
+                lang = si.get("language", "N/A").replace("Language_", "")
                     
-                    text = (
-                        f"🎮 <b>FREE FIRE AGENT SCAN v2.0</b> 🎮\n"
-                        f"────────────────────\n"
-                        f"👤 <b>Agent:</b> <code>{name}</code>\n"
-                        f"🆔 <b>UID:</b> <code>{uid}</code>\n"
-                        f"🏅 <b>Level:</b> <code>{level}</code>\n"
-                        f"📈 <b>Exp:</b> <code>{exp:,}</code>\n"
-                        f"🌍 <b>Sector:</b> <code>{region}</code>\n"
-                        f"❤️ <b>Likes:</b> <code>{likes:,}</code>\n"
-                        f"🏆 <b>Rank Points:</b> <code>{rank_points:,}</code>\n"
-                        f"────────────────────\n"
-                        f"🛡 <b>Clan:</b> <code>{clan}</code> (Lv.{clan_lv})\n"
-                        f"👫 <b>Gender:</b> <code>{gender}</code>\n"
-                        f"🌐 <b>Language:</b> <code>{lang}</code>\n"
-                        f"💯 <b>Credit Score:</b> <code>{credit.get('creditScore', '100')}</code>\n"
-                        f"────────────────────\n"
-                        f"📜 <b>Signature:</b>\n<i>{bio}</i>"
-                    )
-                    await msg.edit_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
-                    return
-            await msg.edit_text("❌ <b>Access Denied:</b> UID not found in Garena registry.")
-        except Exception as e:
-            logger.exception("FF Stalk Error")
-            await msg.edit_text(f"❌ <b>Neural Error:</b> {html.escape(str(e))}")
+                text = (
+                    f"🎮 <b>FREE FIRE AGENT SCAN v2.0</b> 🎮\n"
+                    f"────────────────────\n"
+                    f"👤 <b>Agent:</b> <code>{name}</code>\n"
+                    f"🆔 <b>UID:</b> <code>{uid}</code>\n"
+                    f"🏅 <b>Level:</b> <code>{level}</code>\n"
+                    f"📈 <b>Exp:</b> <code>{exp:,}</code>\n"
+                    f"🌍 <b>Sector:</b> <code>{region}</code>\n"
+                    f"❤️ <b>Likes:</b> <code>{likes:,}</code>\n"
+                    f"🏆 <b>Rank Points:</b> <code>{rank_points:,}</code>\n"
+                    f"────────────────────\n"
+                    f"🛡 <b>Clan:</b> <code>{clan}</code> (Lv.{clan_lv})\n"
+                    f"👫 <b>Gender:</b> <code>{gender}</code>\n"
+                    f"🌐 <b>Language:</b> <code>{lang}</code>\n"
+                    f"💯 <b>Credit Score:</b> <code>{credit.get('creditScore', '100')}</code>\n"
+                    f"────────────────────\n"
+                    f"📜 <b>Signature:</b>\n<i>{bio}</i>"
+                )
+                await msg.edit_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="btn_back")]]))
+                return
+        await msg.edit_text("❌ <b>Access Denied:</b> UID not found in Garena registry.")
+    except Exception as e:
+        logger.exception("FF Stalk Error")
+        await msg.edit_text(f"❌ <b>Neural Error:</b> {html.escape(str(e))}")
 
 async def do_user_info_fetch(update: Update, context: ContextTypes.DEFAULT_TYPE, query: str = None):
     target_user = None
@@ -3043,20 +3293,20 @@ async def do_bg_remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file = await context.bot.get_file(target_msg.photo[-1].file_id)
         img_bytes = await file.download_as_bytearray()
         
-        async with httpx.AsyncClient() as client:
-            files = {'image_file': ('image.jpg', bytes(img_bytes), 'image/jpeg')}
-            headers = {'X-Api-Key': BG_REMOVE_KEY}
-            resp = await client.post(BG_REMOVE_API, files=files, headers=headers, data={'size': 'auto'}, timeout=30.0)
+        client = upstream.client("media")
+        files = {'image_file': ('image.jpg', bytes(img_bytes), 'image/jpeg')}
+        headers = {'X-Api-Key': BG_REMOVE_KEY}
+        resp = await client.post(BG_REMOVE_API, files=files, headers=headers, data={'size': 'auto'}, timeout=30.0)
             
-            if resp.status_code == 200:
-                output = io.BytesIO(resp.content)
-                output.name = "no_bg.png"
-                await status.delete()
-                await msg.reply_document(document=output, caption="✅ <b>Background Removed!</b>", parse_mode="HTML")
-            else:
-                err_data = resp.json()
-                err_msg = err_data.get('errors', [{}])[0].get('title', 'API Error')
-                await status.edit_text(f"❌ <b>Error:</b> {err_msg}")
+        if resp.status_code == 200:
+            output = io.BytesIO(resp.content)
+            output.name = "no_bg.png"
+            await status.delete()
+            await msg.reply_document(document=output, caption="✅ <b>Background Removed!</b>", parse_mode="HTML")
+        else:
+            err_data = resp.json()
+            err_msg = err_data.get('errors', [{}])[0].get('title', 'API Error')
+            await status.edit_text(f"❌ <b>Error:</b> {err_msg}")
     except Exception as e:
         logger.error(f"BG Removal Error: {e}")
         await status.edit_text("❌ <b>System Error:</b> Failed to process image.")
@@ -3064,9 +3314,9 @@ async def do_bg_remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def do_ff_visit(update: Update, context: ContextTypes.DEFAULT_TYPE, uid: str):
     msg = await update.effective_message.reply_text(f" <b>Visiting Account {uid}...</b>", parse_mode="HTML")
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(FF_VISIT_API.format(uid), timeout=20.0)
-            data = resp.json()
+        client = upstream.client("fast")
+        resp = await client.get(FF_VISIT_API.format(uid), timeout=20.0)
+        data = resp.json()
             
         # Example: {"Credits":"MAXIM CODEX 07","FailedVisits":153,"PlayerNickname":"...","SuccessfulVisits":851,"TotalVisits":1004,"UID":...}
         if "TotalVisits" in data:
@@ -3107,8 +3357,8 @@ async def cmd_hinata(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     prompt = " ".join(context.args)
     msg = await update.effective_message.reply_text(" <b>Hinata is typing...</b>", parse_mode="HTML")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_hinata(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_hinata(client, prompt)
     await msg.edit_text(f" <b>Hinata:</b>\n\n{html.escape(reply)}", parse_mode="HTML")
 
 async def cmd_detector(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -3121,24 +3371,24 @@ async def cmd_detector(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = await update.effective_message.reply_text("🛡 <b>Analyzing for AI patterns...</b>", parse_mode="HTML")
     try:
         url = AI_DETECTOR_API.format(text=quote(text))
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url, timeout=30.0)
-            if resp.status_code == 200:
-                data = resp.json()
-                if data.get("status"):
-                    analysis = data.get("analysis", {})
-                    ai_perc = analysis.get("ai_percentage", 0)
-                    label = analysis.get("classification", "Unknown")
-                    await msg.edit_text(
-                        f"🛡 <b>AI Detection Report</b>\n\n"
-                        f"🤖 <b>AI Percentage:</b> <code>{ai_perc}%</code>\n"
-                        f"📊 <b>Classification:</b> <b>{label}</b>",
-                        parse_mode="HTML"
-                    )
-                    return
-                await msg.edit_text(f"❌ <b>Error:</b> {data.get('message', 'Detection failed')}")
-            else:
-                await msg.edit_text(f"❌ <b>Service Error:</b> HTTP {resp.status_code}")
+        client = upstream.client("fast")
+        resp = await client.get(url, timeout=30.0)
+        if resp.status_code == 200:
+            data = resp.json()
+            if data.get("status"):
+                analysis = data.get("analysis", {})
+                ai_perc = analysis.get("ai_percentage", 0)
+                label = analysis.get("classification", "Unknown")
+                await msg.edit_text(
+                    f"🛡 <b>AI Detection Report</b>\n\n"
+                    f"🤖 <b>AI Percentage:</b> <code>{ai_perc}%</code>\n"
+                    f"📊 <b>Classification:</b> <b>{label}</b>",
+                    parse_mode="HTML"
+                )
+                return
+            await msg.edit_text(f"❌ <b>Error:</b> {data.get('message', 'Detection failed')}")
+        else:
+            await msg.edit_text(f"❌ <b>Service Error:</b> HTTP {resp.status_code}")
     except Exception as e:
         logger.error(f"Detector Error: {e}")
         await msg.edit_text("❌ <b>System Error:</b> Could not analyze text.")
@@ -3167,16 +3417,16 @@ async def cmd_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
         msg = await update.effective_message.reply_text("📧 <b>Sending anonymous email...</b>", parse_mode="HTML")
         
         api_url = EMAIL_API.format(to=quote(to_email), subject=quote(subject), message=quote(body))
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(api_url, timeout=30.0)
-            if resp.status_code == 200:
-                data = resp.json()
-                if data.get("status") or data.get("success"):
-                    await msg.edit_text("✅ <b>Email sent successfully!</b>", parse_mode="HTML")
-                else:
-                    await msg.edit_text(f"❌ <b>Failed:</b> {data.get('message', 'Service rejected')}")
+        client = upstream.client("fast")
+        resp = await client.get(api_url, timeout=30.0)
+        if resp.status_code == 200:
+            data = resp.json()
+            if data.get("status") or data.get("success"):
+                await msg.edit_text("✅ <b>Email sent successfully!</b>", parse_mode="HTML")
             else:
-                await msg.edit_text(f"❌ <b>Service Error:</b> HTTP {resp.status_code}")
+                await msg.edit_text(f"❌ <b>Failed:</b> {data.get('message', 'Service rejected')}")
+        else:
+            await msg.edit_text(f"❌ <b>Service Error:</b> HTTP {resp.status_code}")
     except Exception as e:
         logger.error(f"Email Error: {e}")
         await update.effective_message.reply_text("❌ <b>System Error:</b> Could not send email.")
@@ -3185,30 +3435,30 @@ async def cmd_tempmail(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_permission(update, context): return
     msg = await update.effective_message.reply_text(" <b>Creating Temporary Mailbox...</b>", parse_mode="HTML")
     
-    async with httpx.AsyncClient() as client:
-        tm = TempMailClient(client)
-        if await tm.create_account():
-            if await tm.login():
-                 context.user_data['temp_mail'] = {
-                     'email': tm.email,
-                     'password': tm.password,
-                     'token': tm.token
-                 }
+    client = upstream.client("fast")
+    tm = TempMailClient(client)
+    if await tm.create_account():
+        if await tm.login():
+             context.user_data['temp_mail'] = {
+                 'email': tm.email,
+                 'password': tm.password,
+                 'token': tm.token
+             }
                  
-                 kb = [[InlineKeyboardButton(" Refresh Inbox", callback_data="tm_refresh")],
-                       [InlineKeyboardButton("✨ Close Session", callback_data="tm_close")]]
+             kb = [[InlineKeyboardButton(" Refresh Inbox", callback_data="tm_refresh")],
+                   [InlineKeyboardButton("✨ Close Session", callback_data="tm_close")]]
                  
-                 text = (
-                     f" <b>Temporary Mail Ready</b>\n\n"
-                     f" <b>Email:</b> <code>{tm.email}</code>\n"
-                     f" <b>Password:</b> <code>{tm.password}</code>\n\n"
-                     f"<i>Waiting for emails... (Auto-refresh checks every user interaction or click Refresh)</i>"
-                 )
-                 await msg.edit_text(text, reply_markup=InlineKeyboardMarkup(kb), parse_mode="HTML")
-            else:
-                await msg.edit_text("✨ <b>Login Failed.</b>")
+             text = (
+                 f" <b>Temporary Mail Ready</b>\n\n"
+                 f" <b>Email:</b> <code>{tm.email}</code>\n"
+                 f" <b>Password:</b> <code>{tm.password}</code>\n\n"
+                 f"<i>Waiting for emails... (Auto-refresh checks every user interaction or click Refresh)</i>"
+             )
+             await msg.edit_text(text, reply_markup=InlineKeyboardMarkup(kb), parse_mode="HTML")
         else:
-            await msg.edit_text("✨ <b>Account Creation Failed.</b>")
+            await msg.edit_text("✨ <b>Login Failed.</b>")
+    else:
+        await msg.edit_text("✨ <b>Account Creation Failed.</b>")
 
 async def temp_mail_refresh(update: Update, context: ContextTypes.DEFAULT_TYPE, manual=True):
     query = update.callback_query
@@ -3217,45 +3467,45 @@ async def temp_mail_refresh(update: Update, context: ContextTypes.DEFAULT_TYPE,
         if manual: await query.answer("✨ Session Expired", show_alert=True)
         return
 
-    async with httpx.AsyncClient() as client:
-        tm = TempMailClient(client)
-        tm.email = data['email']
-        tm.token = data['token']
+    client = upstream.client("fast")
+    tm = TempMailClient(client)
+    tm.email = data['email']
+    tm.token = data['token']
         
-        try:
-            msgs = await tm.get_messages()
-            if not msgs:
-                if manual: await query.answer(" Inbox Empty", show_alert=False)
-                return
+    try:
+        msgs = await tm.get_messages()
+        if not msgs:
+            if manual: await query.answer(" Inbox Empty", show_alert=False)
+            return
             
-            # Show latest message
-            latest = msgs[0]
-            msg_id = latest['id']
-            subject = latest.get('subject', 'No Subject')
-            sender = latest.get('from', {}).get('address', 'Unknown')
+        # Show latest message
+        latest = msgs[0]
+        msg_id = latest['id']
+        subject = latest.get('subject', 'No Subject')
+        sender = latest.get('from', {}).get('address', 'Unknown')
             
-            body = await tm.read_message(msg_id)
+        body = await tm.read_message(msg_id)
             
-            # Extract OTP
-            otp_match = re.search(r"\b\d{4,8}\b", body) or re.search(r"\b\d{4,8}\b", subject)
-            otp = otp_match.group(0) if otp_match else "None"
+        # Extract OTP
+        otp_match = re.search(r"\b\d{4,8}\b", body) or re.search(r"\b\d{4,8}\b", subject)
+        otp = otp_match.group(0) if otp_match else "None"
             
-            text = (
-                 f" <b>New Email Received!</b>\n\n"
-                 f" <b>To:</b> <code>{tm.email}</code>\n"
-                 f" <b>From:</b> {sender}\n"
-                 f" <b>Subject:</b> {subject}\n\n"
-                 f" <b>Message:</b>\n{html.escape(body[:500])}...\n\n"
-                 f" <b>OTP Detected:</b> <code>{otp}</code>"
-            )
+        text = (
+             f" <b>New Email Received!</b>\n\n"
+             f" <b>To:</b> <code>{tm.email}</code>\n"
+             f" <b>From:</b> {sender}\n"
+             f" <b>Subject:</b> {subject}\n\n"
+             f" <b>Message:</b>\n{html.escape(body[:500])}...\n\n"
+             f" <b>OTP Detected:</b> <code>{otp}</code>"
+        )
             
-            kb = [[InlineKeyboardButton(" Refresh", callback_data="tm_refresh")],
-                  [InlineKeyboardButton("✨ Close", callback_data="tm_close")]]
+        kb = [[InlineKeyboardButton(" Refresh", callback_data="tm_refresh")],
+              [InlineKeyboardButton("✨ Close", callback_data="tm_close")]]
             
-            await safe_edit(query, text, reply_markup=InlineKeyboardMarkup(kb))
+        await safe_edit(query, text, reply_markup=InlineKeyboardMarkup(kb))
             
-        except Exception as e:
-             if manual: await query.answer("✨ Error checking mail")
+    except Exception as e:
+         if manual: await query.answer("✨ Error checking mail")
 
 
 async def safe_edit(query, text, reply_markup=None, parse_mode="HTML"):
@@ -3561,8 +3811,8 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data.startswith("think_req|"):
         query_text = unquote(data.split("|")[1])
         msg = await update.effective_message.reply_text("💡 <b>Thinking Deeper...</b>", parse_mode="HTML")
-        async with httpx.AsyncClient() as client:
-            reply = await fetch_copilot(client, query_text)
+        client = upstream.client("ai")
+        reply = await fetch_copilot(client, query_text)
         await msg.edit_text(reply, parse_mode="HTML")
     elif data.startswith("yt_dl_req|"):
         url = data.split("|")[1]
@@ -3599,8 +3849,8 @@ async def do_tod_fetch(update: Update, _context: ContextTypes.DEFAULT_TYPE, mode
     await safe_edit(query, f" <b>Generating {mode.title()}...</b>")
     
     prompt = f"Generate a creative and engaging {mode} for a Truth or Dare game. Return only the {mode} text."
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_chatgpt(client, prompt)
+    client = upstream.client("ai")
+    reply = await fetch_chatgpt(client, prompt)
     
     kb = [
         [InlineKeyboardButton(" Roll Again", callback_data=f"tod_{mode}"),
@@ -3627,15 +3877,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if trigger_hinata and not any(ud.get(key) for key in [AWAIT_GEMINI, AWAIT_IMAGINE, AWAIT_DEEPSEEK, AWAIT_FLIRT, AWAIT_HINATA, AWAIT_CODE, 'await_textmaker_input', AWAIT_CHATGPT, AWAIT_LYRICS, AWAIT_WRITE, AWAIT_ASK, AWAIT_BIO, AWAIT_COPILOT, AWAIT_INSTA, AWAIT_USERINFO, AWAIT_TTSTALK, AWAIT_FF, AWAIT_SHORTEN, AWAIT_EMAIL, AWAIT_PINTEREST, AWAIT_YTSEARCH, AWAIT_STYLETEXT, AWAIT_DL, AWAIT_QRGEN, AWAIT_TRANSLATE, AWAIT_SUMMARIZE, AWAIT_GRAMMAR, AWAIT_GUESS, AWAIT_RIDDLE, AWAIT_TRIVIA]):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-            async with httpx.AsyncClient() as c: 
-                r = await fetch_hinata(c, txt, update)
+            c = upstream.client("ai")
+            r = await fetch_hinata(c, txt, update)
             await msg.reply_text(r, parse_mode="HTML")
             return
 
         if ud.pop(AWAIT_GEMINI, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("✨ <b>Analyzing...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_gemini3(c, txt)
+            r = await fetch_gemini3(upstream.client("ai"), txt)
             await m.edit_text(f"🧠 <b>Gemini:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
 
@@ -3647,25 +3897,25 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if ud.pop(AWAIT_DEEPSEEK, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("🔥 <b>Searching...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_deepseek(c, txt)
+            r = await fetch_deepseek(upstream.client("ai"), txt)
             await m.edit_text(f"🔥 <b>DeepSeek:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_FLIRT, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("💖 <b>Thinking...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_flirt(c, txt)
+            r = await fetch_flirt(upstream.client("ai"), txt)
             await m.edit_text(f"💖 <b>Flirt AI:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_HINATA, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("🌸 <b>Hinata is typing...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_hinata(c, txt, update)
+            r = await fetch_hinata(upstream.client("ai"), txt, update)
             await m.edit_text(f"🌸 <b>Hinata:</b>\n\n{r}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_CODE, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("👨‍💻 <b>Coding...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_code(c, txt)
+            r = await fetch_code(upstream.client("ai"), txt)
             # Ensure code blocks are used for copying
             if "```" not in r:
                 r = f"```python\n{r}\n```"
@@ -3687,59 +3937,59 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if ud.pop(AWAIT_CHATGPT, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("🤖 <b>Connecting to GPT-5 Ultra...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_chatgpt(c, txt, chat_id=update.effective_chat.id, user_id=update.effective_user.id)
+            r = await fetch_chatgpt(upstream.client("ai"), txt, chat_id=update.effective_chat.id, user_id=update.effective_user.id)
             await m.edit_text(f"🤖 <b>GPT-5 Ultra:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
 
         elif ud.pop(AWAIT_DOLPHIN, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("🐬 <b>Dolphin is generating...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_dolphin(c, txt)
+            r = await fetch_dolphin(upstream.client("ai"), txt)
             await m.edit_text(f"🐬 <b>Dolphin Unrestricted:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_MISTRAL, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("🌪 <b>Mistral is generating...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_mistral(c, txt)
+            r = await fetch_mistral(upstream.client("ai"), txt)
             await m.edit_text(f"🌪 <b>Mistral 3.1:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_ZEROTWO, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("💕 <b>Zero Two is typing...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_zerotwo(c, txt)
+            r = await fetch_zerotwo(upstream.client("ai"), txt)
             await m.edit_text(f"💕 <b>Zero Two:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
 
         elif ud.pop(AWAIT_GRANITE, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("💎 <b>Granite 4.0 is thinking...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_granite(c, txt)
+            r = await fetch_granite(upstream.client("ai"), txt)
             await m.edit_text(f"💎 <b>Granite 4.0:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_LLAMA4, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("🦙 <b>Llama 4 is analyzing...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_llama4(c, txt)
+            r = await fetch_llama4(upstream.client("ai"), txt)
             await m.edit_text(f"🦙 <b>Llama 4:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_WEBZIP, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("📦 <b>Zipping website... this might take a moment.</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c:
-                try:
-                    url = SAVE_WEB_ZIP_API.format(url=quote(txt.strip()))
-                    resp = await c.get(url, timeout=60.0)
-                    if resp.status_code == 200:
-                        data = resp.json()
-                        dl_url = data.get("result") or data.get("url") or data.get("download_url") if isinstance(data, dict) else None
-                        if dl_url:
-                            await m.edit_text(f"📦 <b>Web to Zip Successful!</b>\n\n📥 You can download your zipped website here: {dl_url}", parse_mode="HTML")
-                        else:
-                            await m.edit_text("❌ Failed to parse zip link from the API.", parse_mode="HTML")
+            c = upstream.client("media")
+            try:
+                url = SAVE_WEB_ZIP_API.format(url=quote(txt.strip()))
+                resp = await c.get(url, timeout=60.0)
+                if resp.status_code == 200:
+                    data = resp.json()
+                    dl_url = data.get("result") or data.get("url") or data.get("download_url") if isinstance(data, dict) else None
+                    if dl_url:
+                        await m.edit_text(f"📦 <b>Web to Zip Successful!</b>\n\n📥 You can download your zipped website here: {dl_url}", parse_mode="HTML")
                     else:
-                        await m.edit_text(f"❌ <b>Error:</b> API returned {resp.status_code}", parse_mode="HTML")
-                except Exception as e:
-                    await m.edit_text(f"❌ <b>Error:</b> {e}", parse_mode="HTML")
+                        await m.edit_text("❌ Failed to parse zip link from the API.", parse_mode="HTML")
+                else:
+                    await m.edit_text(f"❌ <b>Error:</b> API returned {resp.status_code}", parse_mode="HTML")
+            except Exception as e:
+                await m.edit_text(f"❌ <b>Error:</b> {e}", parse_mode="HTML")
             return
             
         elif ud.pop(AWAIT_KEEPER_ADD, False):
@@ -3751,15 +4001,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not target_url.startswith("http"): target_url = "http://" + target_url
             
             api_url = f"https://service-keeper-1.onrender.com/api/add?url={quote(target_url)}&interval={quote(interval)}"
-            async with httpx.AsyncClient() as c:
-                try:
-                    resp = await c.get(api_url, timeout=20.0)
-                    if resp.status_code == 200:
-                        await m.edit_text(f"✅ <b>Successfully added to Keeper!</b>\n\n🔗 <b>URL:</b> {html.escape(target_url)}\n⏱️ <b>Interval:</b> {interval} mins", parse_mode="HTML", reply_markup=back_btn)
-                    else:
-                        await m.edit_text(f"❌ <b>Keeper Error:</b> API returned {resp.status_code}\n\n{resp.text}", parse_mode="HTML", reply_markup=back_btn)
-                except Exception as e:
-                    await m.edit_text(f"❌ <b>Keeper Error:</b> {e}", parse_mode="HTML", reply_markup=back_btn)
+            c = upstream.client("fast")
+            try:
+                resp = await c.get(api_url, timeout=20.0)
+                if resp.status_code == 200:
+                    await m.edit_text(f"✅ <b>Successfully added to Keeper!</b>\n\n🔗 <b>URL:</b> {html.escape(target_url)}\n⏱️ <b>Interval:</b> {interval} mins", parse_mode="HTML", reply_markup=back_btn)
+                else:
+                    await m.edit_text(f"❌ <b>Keeper Error:</b> API returned {resp.status_code}\n\n{resp.text}", parse_mode="HTML", reply_markup=back_btn)
+            except Exception as e:
+                await m.edit_text(f"❌ <b>Keeper Error:</b> {e}", parse_mode="HTML", reply_markup=back_btn)
             return
             
         elif ud.pop(AWAIT_KEEPER_DEL, False):
@@ -3769,75 +4019,75 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not target_url.startswith("http"): target_url = "http://" + target_url
             
             api_url = f"https://service-keeper-1.onrender.com/api/delete?url={quote(target_url)}"
-            async with httpx.AsyncClient() as c:
-                try:
-                    resp = await c.get(api_url, timeout=20.0)
-                    if resp.status_code == 200:
-                        await m.edit_text(f"❌ <b>Successfully removed from Keeper!</b>\n\n🔗 <b>URL:</b> {html.escape(target_url)}", parse_mode="HTML", reply_markup=back_btn)
-                    else:
-                        await m.edit_text(f"❌ <b>Keeper Error:</b> API returned {resp.status_code}\n\n{resp.text}", parse_mode="HTML", reply_markup=back_btn)
-                except Exception as e:
-                    await m.edit_text(f"❌ <b>Keeper Error:</b> {e}", parse_mode="HTML", reply_markup=back_btn)
+            c = upstream.client("fast")
+            try:
+                resp = await c.get(api_url, timeout=20.0)
+                if resp.status_code == 200:
+                    await m.edit_text(f"❌ <b>Successfully removed from Keeper!</b>\n\n🔗 <b>URL:</b> {html.escape(target_url)}", parse_mode="HTML", reply_markup=back_btn)
+                else:
+                    await m.edit_text(f"❌ <b>Keeper Error:</b> API returned {resp.status_code}\n\n{resp.text}", parse_mode="HTML", reply_markup=back_btn)
+            except Exception as e:
+                await m.edit_text(f"❌ <b>Keeper Error:</b> {e}", parse_mode="HTML", reply_markup=back_btn)
             return
 
         elif ud.pop(AWAIT_LYRICS, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("🎵 <b>Searching for lyrics...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_lyrics(c, txt)
+            r = await fetch_lyrics(upstream.client("ai"), txt)
             await m.edit_text(f"🎵 <b>Lyrics Finder:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_WRITE, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("✍️ <b>Writing...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_write(c, txt)
+            r = await fetch_write(upstream.client("ai"), txt)
             await m.edit_text(f"✍️ <b>Creative Writer:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_ASK, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("❓ <b>Thinking...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_ask(c, txt)
+            r = await fetch_ask(upstream.client("ai"), txt)
             await m.edit_text(f"❓ <b>Question Hub:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_BIO, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("👤 <b>Generating bio...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_bio(c, txt)
+            r = await fetch_bio(upstream.client("ai"), txt)
             await m.edit_text(f"👤 <b>Bio Generator:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
 
         elif ud.pop(AWAIT_COPILOT, False):
             m = await msg.reply_text("💡 <b>Thinking Deeply...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_copilot(c, txt)
+            r = await fetch_copilot(upstream.client("ai"), txt)
             await m.edit_text(r, parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_POEM, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("📜 <b>Drafting Poem...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_poem(c, txt)
+            r = await fetch_poem(upstream.client("ai"), txt)
             await m.edit_text(f"📜 <b>Poem Master:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_STORY, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("✍️ <b>Crafting Story...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_story(c, txt)
+            r = await fetch_story(upstream.client("ai"), txt)
             await m.edit_text(f"✍️ <b>Story AI:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_ADVICE, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("💡 <b>Pondering...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_advice(c, txt)
+            r = await fetch_advice(upstream.client("ai"), txt)
             await m.edit_text(f"💡 <b>Advice Hub:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_ROAST, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("🔥 <b>Preparing Roast...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_roast(c, txt)
+            r = await fetch_roast(upstream.client("ai"), txt)
             await m.edit_text(f"🔥 <b>Brutal Roast:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_JOKE, False):
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             m = await msg.reply_text("😂 <b>Thinking of a joke...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_joke(c, txt)
+            r = await fetch_joke(upstream.client("ai"), txt)
             await m.edit_text(f"😂 <b>AI Joke:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_INSTA, False): await do_insta_fetch_by_text(update, context, txt.strip()); return
@@ -3876,7 +4126,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         elif ud.pop(AWAIT_GRAMMAR, False):
             m = await msg.reply_text("🔡 <b>Analyzing Grammar...</b>", parse_mode="HTML")
-            async with httpx.AsyncClient() as c: r = await fetch_grammar(c, txt)
+            r = await fetch_grammar(upstream.client("ai"), txt)
             await m.edit_text(f"🔡 <b>Corrected Text:</b>\n\n{html.escape(r)}", parse_mode="HTML", reply_markup=back_btn)
             return
         elif ud.pop(AWAIT_GUESS, False):
@@ -3938,7 +4188,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def track_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.my_chat_member.chat
     if chat.type in ["group", "supergroup"]:
-        database.add_group(chat.id, chat.title, chat.type)
+        await db.add_group(chat.id, chat.title, chat.type)
 
 
 
@@ -4045,39 +4295,27 @@ async def cmd_addadmin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def broadcastall(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_owner(update.effective_user.id) or not context.args: return
     text = " ".join(context.args)
-    users = database.get_all_users()
-    groups = database.get_all_groups()
-    
-    s = f = 0
-    msg_ids_map = {}
     
     status_msg = await update.effective_message.reply_text("🚀 <b>Global Broadcast Initiated...</b>", parse_mode="HTML")
     
-    # Send to Users
-    for u in users:
-        uid = u.get('id')
-        try:
-            sent = await context.bot.send_message(chat_id=uid, text=text, parse_mode="HTML")
-            save_broadcast_msg(sent.chat_id, sent.message_id)
-            msg_ids_map[str(sent.chat_id)] = sent.message_id
-            s += 1
-        except:
-            f += 1
-            
-    # Send to Groups
-    for g in groups:
-        gid = g.get('id')
-        try:
-            sent = await context.bot.send_message(chat_id=gid, text=text, parse_mode="HTML")
-            save_broadcast_msg(sent.chat_id, sent.message_id)
-            msg_ids_map[str(sent.chat_id)] = sent.message_id
-            s += 1
-        except:
-            f += 1
-            
-    # Save to DB
-    database.add_broadcast(text, "all", s, f, msg_ids_map)
-    STATS["broadcasts"] += 1
+    async with BroadcastRecorder(text, "all") as rec:
+        # Send to Users
+        async for uid in db.iter_recipient_ids("users"):
+            try:
+                sent = await context.bot.send_message(chat_id=uid, text=text, parse_mode="HTML")
+                await rec.ok(sent)
+            except Exception as e:
+                await rec.fail(uid, e)
+                
+        # Send to Groups
+        async for gid in db.iter_recipient_ids("groups"):
+            try:
+                sent = await context.bot.send_message(chat_id=gid, text=text, parse_mode="HTML")
+                await rec.ok(sent)
+            except Exception as e:
+                await rec.fail(gid, e)
+    
+    s, f = rec.sent, rec.failed
     await status_msg.edit_text(f"✨ <b>Broadcast Complete</b>\n\n✅ <b>Sent:</b> {s}\n❌ <b>Failed:</b> {f}", parse_mode="HTML")
     update_stats(sent_users=s, failed_users=f)
 
@@ -4103,9 +4341,8 @@ async def broadcast_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     try:
         sent = await context.bot.send_message(chat_id=target_id, text=text, parse_mode="HTML")
-        save_broadcast_msg(sent.chat_id, sent.message_id)
-        database.add_broadcast(text, "user", 1, 0, {str(sent.chat_id): sent.message_id})
-        STATS["broadcasts"] += 1
+        async with BroadcastRecorder(text, "user") as rec:
+            await rec.ok(sent)
         await update.effective_message.reply_text(f"✅ <b>Message Sent to User:</b> <code>{target_id}</code>", parse_mode="HTML")
         update_stats(sent_users=1)
     except Exception as e:
@@ -4134,9 +4371,8 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     try:
         sent = await context.bot.send_message(chat_id=target_id, text=text, parse_mode="HTML")
-        save_broadcast_msg(sent.chat_id, sent.message_id)
-        database.add_broadcast(text, "specific", 1, 0, {str(sent.chat_id): sent.message_id})
-        STATS["broadcasts"] += 1
+        async with BroadcastRecorder(text, "specific") as rec:
+            await rec.ok(sent)
         await update.effective_message.reply_text(f"✨ <b>Broadcast Sent to Chat:</b> <code>{target_id}</code>", parse_mode="HTML")
         update_stats(sent_groups=1)
     except Exception as e:
@@ -4156,42 +4392,27 @@ async def broadcast_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
         cap = msg.caption or ""
     else:
         return
-    gs = database.get_all_groups()
-    s = f = 0
-    msg_ids_map = {}
-    for g in gs:
-        gid = g.get('id') if isinstance(g, dict) else g
-        try:
-            sent = await context.bot.send_photo(chat_id=gid, photo=photo, caption=cap, parse_mode="HTML")
-            save_broadcast_msg(sent.chat_id, sent.message_id)
-            msg_ids_map[str(sent.chat_id)] = sent.message_id
-            s += 1
-        except:
-            f += 1
-            
-    # Save to DB
-    database.add_broadcast(f"[Media] {cap[:50]}...", "groups", s, f, msg_ids_map)
-    STATS["broadcasts"] += 1
+    async with BroadcastRecorder(f"[Media] {cap[:50]}...", "groups") as rec:
+        async for gid in db.iter_recipient_ids("groups"):
+            try:
+                sent = await context.bot.send_photo(chat_id=gid, photo=photo, caption=cap, parse_mode="HTML")
+                await rec.ok(sent)
+            except Exception as e:
+                await rec.fail(gid, e)
+    
+    s, f = rec.sent, rec.failed
     await msg.reply_text(f"✨ Media Blast: ✨ {s} | ✨ {f}")
     update_stats(sent_groups=s, failed_groups=f)
 
 async def cmd_del_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_owner(update.effective_user.id): return
-    history = read_json("broadcast_history.json", [])
-    if not history:
+    # Only /s_broadcast* messages; dashboard broadcasts are deleted one by one from the panel
+    pending = await db.count_sent_deliveries(source="command")
+    if not pending:
         return
     
-    status_msg = await update.effective_message.reply_text(f"✨ <b>Cleaning up {len(history)} messages...</b>", parse_mode="HTML")
-    s = f = 0
-    for entry in history:
-        try:
-            await context.bot.delete_message(chat_id=entry['chat_id'], message_id=entry['message_id'])
-            s += 1
-        except Exception:
-            f += 1
-            
-    # Clear history after attempt
-    write_json("broadcast_history.json", [])
+    status_msg = await update.effective_message.reply_text(f"✨ <b>Cleaning up {pending} messages...</b>", parse_mode="HTML")
+    s, f = await delete_broadcast_messages(context.bot, source="command")
     await status_msg.edit_text(f"✨ <b>Cleanup Complete</b>\n\n✨ Deleted: {s}\n Failed: {f}", parse_mode="HTML")
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -4255,6 +4476,267 @@ async def auto_cleanup_task():
             logger.error(f"Cleanup error: {e}")
         await asyncio.sleep(600) # 10 minutes
 
+# ================= Activity Flush =================
+ACTIVITY_FLUSH_EVENT = asyncio.Event()
+_activity_task = None
+_history_task = None  # conversation.flush_task(): queued chat history rows
+
+async def activity_flush_task():
+    """Writes buffered user/group activity every few seconds, or sooner when the buffer fills."""
+    while True:
+        try:
+            await asyncio.wait_for(ACTIVITY_FLUSH_EVENT.wait(), timeout=database.ACTIVITY_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        ACTIVITY_FLUSH_EVENT.clear()
+        try:
+            await db.flush_activity()
+        except Exception as e:
+            logger.error(f"Activity flush error: {e}")
+
+# ================= Retention =================
+RETENTION_INTERVAL = 3600 # seconds between retention passes
+RETENTION_REPORT = {
+    "last_run": None,
+    "trimmed_rows": 0,
+    "aged_rows": 0,
+    "cache_rows": 0,
+    "reclaimed_bytes": 0,
+    "total_reclaimed_bytes": 0
+}
+_retention_task = None
+_retention_lock = asyncio.Lock()
+
+async def run_retention():
+    """Caps every chat's history, drops expired rows and releases the freed pages."""
+    async with _retention_lock:
+        trimmed = aged = cached = reclaimed = 0
+        for chat_id in await db.get_overfull_chats():
+            while True:
+                n = await db.trim_chat_history(chat_id)
+                trimmed += n
+                if n < database.RETENTION_BATCH: break
+        while True:
+            n = await db.prune_chat_history()
+            aged += n
+            if n < database.RETENTION_BATCH: break
+        while True:
+            n = await db.prune_response_cache()
+            cached += n
+            if n < database.RETENTION_BATCH: break
+        while True:
+            freed = await db.incremental_vacuum()
+            reclaimed += freed
+            if not freed: break
+
+        RETENTION_REPORT.update(
+            last_run=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            trimmed_rows=trimmed,
+            aged_rows=aged,
+            cache_rows=cached,
+            reclaimed_bytes=reclaimed,
+            total_reclaimed_bytes=RETENTION_REPORT["total_reclaimed_bytes"] + reclaimed
+        )
+        if trimmed or aged:
+            logger.info(f"Retention: {trimmed} capped + {aged} expired history rows removed, {reclaimed/1024:.1f}KB reclaimed.")
+        return RETENTION_REPORT
+
+async def retention_task():
+    while True:
+        await asyncio.sleep(RETENTION_INTERVAL)
+        try:
+            await run_retention()
+        except Exception as e:
+            logger.error(f"Retention error: {e}")
+
+async def cmd_retention(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Owner: /s_retention shows the last pass, /s_retention run starts one now."""
+    if not is_owner(update.effective_user.id): return
+    if context.args and context.args[0].lower() == "run":
+        await update.effective_message.reply_text("🧹 <b>Retention pass started...</b>", parse_mode="HTML")
+        await run_retention()
+    r = RETENTION_REPORT
+    info = await db.get_storage_info()
+    text = (f"🧹 <b>Chat History Retention</b>\n\n"
+            f"🗂 <b>History Rows:</b> <code>{info['history_rows']}</code>\n"
+            f"💾 <b>Database Size:</b> <code>{info['db_bytes']/1024:.1f} KB</code>\n"
+            f"📉 <b>Cap:</b> {database.HISTORY_MAX_ROWS_PER_CHAT} rows/chat • <b>Max Age:</b> {database.HISTORY_MAX_AGE_DAYS} days\n\n"
+            f"🕒 <b>Last Pass:</b> {r['last_run'] or 'never'}\n"
+            f"✂️ Capped Rows: {r['trimmed_rows']}\n"
+            f"⌛ Expired Rows: {r['aged_rows']}\n"
+            f"♻️ Reclaimed: {r['reclaimed_bytes']/1024:.1f} KB (total {r['total_reclaimed_bytes']/1024:.1f} KB)")
+    await update.effective_message.reply_text(text, parse_mode="HTML")
+
+# ================= Loop Lag =================
+LOOP_LAG_INTERVAL = 0.5 # seconds between probes
+_lag_task = None
+
+async def loop_lag_monitor():
+    """Measures how late the event loop wakes up; anything blocking the loop shows up here."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag_ms = (time.perf_counter() - start - LOOP_LAG_INTERVAL) * 1000
+        STATS["loop_lag_ms"] = round(lag_ms, 2)
+        STATS["loop_lag_max_ms"] = round(max(STATS["loop_lag_max_ms"], lag_ms), 2)
+        if lag_ms > 250:
+            logger.warning(f"Event loop stalled for {lag_ms:.0f}ms")
+
+# ================= Update Lanes =================
+# scheduler.py runs every update in a lane with its own worker budget, so
+# /ping, menus and owner moderation stay responsive while /imagine, /dl and
+# slow AI engines saturate theirs. Commands and buttons not listed here are
+# cheap (Telegram calls only) and go to "ui".
+LANE_COMMANDS = {
+    "owner": {"download_db", "getdb"},  # plus every s_* command
+    "ai": {"ai", "gemini", "deepseek", "chatgpt", "dolphin", "mistral", "zerotwo", "granite", "llama4",
+           "flirt", "code", "hinata", "copilot", "translate", "summarize", "grammar", "detector", "help",
+           "riddle", "trivia", "insta", "ff", "ffstalk", "ytsearch", "styletext", "shorten", "tempmail", "email"},
+    "media": {"imagine", "dl", "pinterest", "webss", "webzip", "bgrem", "qrread", "qrgen"},
+}
+LANE_CALLBACKS = {
+    "owner": ("adm_", "btn_download_db_req"),
+    "ai": ("think_req|", "tod_", "tm_refresh", "btn_tempmail", "btn_riddle", "btn_trivia", "btn_joke", "btn_roast"),
+    "media": ("genimg_", "aiodl|", "ytdl_", "yt_dl_req|", "dl_fmt|", "wallgen_", "txtstyle_",
+              "btn_randomgirl", "btn_randompfp"),
+}
+# Pending prompt flag -> lane of the plain message that answers it; other flags are "ai"
+LANE_FLAGS = {
+    AWAIT_IMAGINE: "media", AWAIT_DL: "media", AWAIT_PINTEREST: "media", AWAIT_WEBZIP: "media",
+    AWAIT_WEBSS: "media", AWAIT_QRGEN: "media", AWAIT_BGREM: "media", 'await_textmaker_input': "media",
+    AWAIT_GUESS: "ui", AWAIT_KEEPER_ADD: "ui", AWAIT_KEEPER_DEL: "ui", AWAIT_BAN: "owner", AWAIT_UNBAN: "owner",
+}
+
+def _command(txt):
+    """('name', has_args) for "/name@bot args", else (None, False)."""
+    if not txt.startswith("/") or len(txt) < 2:
+        return None, False
+    parts = txt[1:].split(maxsplit=1)
+    return (parts[0].split("@")[0].lower() if parts else ""), len(parts) > 1
+
+def _pending_prompt(application, user_id):
+    ud = application.user_data.get(user_id) or {}
+    return next((key for key in ud if isinstance(key, str) and key.startswith("await_") and ud[key]), None)
+
+def _wakes_hinata(msg, application):
+    # Same trigger as handle_message
+    is_reply_to_bot = bool(msg.reply_to_message and msg.reply_to_message.from_user
+                           and msg.reply_to_message.from_user.id == application.bot.id)
+    return msg.chat.type == "private" or is_reply_to_bot or "hinata" in (msg.text or "").lower()
+
+def update_lane(update, application):
+    """Lane for an update; mirrors the dispatch in handle_message and callback_handler."""
+    if not isinstance(update, Update):
+        return "ui"
+    query = update.callback_query
+    if query:
+        data = query.data or ""
+        for lane, prefixes in LANE_CALLBACKS.items():
+            if data.startswith(prefixes):
+                return lane
+        return "ui"
+    msg = update.message
+    if not msg or not msg.from_user:
+        return "ui"
+    cmd, _ = _command(msg.text or "")
+    if cmd is not None:
+        if cmd.startswith("s_"):
+            return "owner"
+        for lane, cmds in LANE_COMMANDS.items():
+            if cmd in cmds:
+                return lane
+        return "ui"
+    pending = _pending_prompt(application, msg.from_user.id)
+    if pending:
+        return LANE_FLAGS.get(pending, "ai")
+    # Without a pending prompt only Hinata's replies cost an upstream call
+    return "ai" if _wakes_hinata(msg, application) else "ui"
+
+# ================= Quotas =================
+# Token buckets per user and per chat for each feature class (quotas.py).
+# A command is charged only when it carries its input; a bare /imagine just
+# asks for a prompt and the message answering it is charged instead. The
+# commands in QUOTA_BARE_COMMANDS call the AI without any input.
+QUOTA_COMMANDS = {
+    "ai": {"ai", "gemini", "deepseek", "chatgpt", "dolphin", "mistral", "zerotwo", "granite", "llama4",
+           "flirt", "code", "hinata", "copilot", "translate", "summarize", "grammar", "detector", "help"},
+    "image": {"imagine"},
+    "download": {"dl", "pinterest"},
+    "web": {"webss", "webzip"},
+}
+QUOTA_BARE_COMMANDS = {"riddle": "ai", "trivia": "ai"}
+QUOTA_CALLBACKS = {
+    "ai": ("think_req|", "tod_", "btn_riddle", "btn_trivia", "btn_roast", "btn_joke"),
+    "image": ("genimg_", "wallgen_", "txtstyle_"),
+    "download": ("aiodl|", "ytdl_", "yt_dl_req|", "dl_fmt|"),
+}
+# Pending prompt flag -> feature charged for the message answering it. None
+# marks prompts answered locally or by an uncharged lookup; a flag missing
+# here is charged like any other message handle_message may pass to Hinata.
+QUOTA_FLAGS = {
+    AWAIT_IMAGINE: "image", 'await_textmaker_input': "image",
+    AWAIT_DL: "download", AWAIT_PINTEREST: "download",
+    AWAIT_WEBSS: "web", AWAIT_WEBZIP: "web",
+    **{flag: "ai" for flag in (AWAIT_GEMINI, AWAIT_DEEPSEEK, AWAIT_CHATGPT, AWAIT_DOLPHIN, AWAIT_MISTRAL,
+                               AWAIT_ZEROTWO, AWAIT_GRANITE, AWAIT_LLAMA4, AWAIT_FLIRT, AWAIT_CODE, AWAIT_HINATA,
+                               AWAIT_COPILOT, AWAIT_TRANSLATE, AWAIT_SUMMARIZE, AWAIT_GRAMMAR, AWAIT_DETECTOR,
+                               AWAIT_LYRICS, AWAIT_WRITE, AWAIT_ASK, AWAIT_BIO, AWAIT_POEM, AWAIT_STORY,
+                               AWAIT_ADVICE, AWAIT_ROAST, AWAIT_JOKE)},
+    **{flag: None for flag in (AWAIT_GUESS, AWAIT_RIDDLE, AWAIT_TRIVIA, AWAIT_BAN, AWAIT_UNBAN,
+                               AWAIT_KEEPER_ADD, AWAIT_KEEPER_DEL, AWAIT_INSTA, AWAIT_USERINFO, AWAIT_TTSTALK,
+                               AWAIT_FF, AWAIT_SHORTEN, AWAIT_EMAIL, AWAIT_YTSEARCH, AWAIT_STYLETEXT,
+                               AWAIT_QRGEN, AWAIT_BGREM)},
+}
+
+def quota_feature(update, application):
+    """Feature class an update spends quota from, or None if it is free."""
+    query = update.callback_query
+    if query:
+        data = query.data or ""
+        return next((f for f, prefixes in QUOTA_CALLBACKS.items() if data.startswith(prefixes)), None)
+    msg = update.message
+    if not msg or not msg.from_user:
+        return None
+    cmd, has_args = _command(msg.text or "")
+    if cmd is not None:
+        if cmd in QUOTA_BARE_COMMANDS:
+            return QUOTA_BARE_COMMANDS[cmd]
+        return next((f for f, cmds in QUOTA_COMMANDS.items() if cmd in cmds), None) if has_args else None
+    pending = _pending_prompt(application, msg.from_user.id)
+    if pending in QUOTA_FLAGS:
+        return QUOTA_FLAGS[pending]
+    return "ai" if msg.text and _wakes_hinata(msg, application) else None
+
+_quota_task = None  # quotas.snapshot_task()
+
+async def quota_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stops an update before its handler when the caller is out of quota."""
+    user = update.effective_user
+    if not user:
+        return
+    feature = quota_feature(update, context.application)
+    if not feature:
+        return
+    if is_owner(user.id):
+        quotas.QUOTA_STATS["exempt"] += 1
+        return
+    chat = update.effective_chat
+    wait = quotas.take(feature, user.id, chat.id if chat else None)
+    if not wait:
+        return
+    retry = max(1, int(wait + 0.999))
+    logger.info(f"Quota: {feature} limited for User:{user.id} Chat:{chat.id if chat else '-'} ({retry}s)")
+    try:
+        if update.callback_query:
+            await update.callback_query.answer(f"⏳ Slow down! Try again in {retry}s.", show_alert=True)
+        elif update.effective_message:
+            await update.effective_message.reply_text(
+                f"⏳ <b>Slow down!</b>\n\nYou've hit the <b>{feature}</b> limit. Try again in <b>{retry}s</b>.",
+                parse_mode="HTML")
+    except Exception as e:
+        logger.error(f"Quota reply failed: {e}")
+    raise ApplicationHandlerStop
+
 # ================= Run =================
 # Global application object for access from main.py
 app = None
@@ -4267,7 +4749,13 @@ async def start_bot():
         return
         
     try:
-        app = ApplicationBuilder().token(BOT_TOKEN).build()
+        # Chats are served concurrently, each chat's updates in order, each update
+        # in its priority lane (see scheduler.py and update_lane)
+        app = (ApplicationBuilder().token(BOT_TOKEN)
+               .base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+               .application_class(scheduler.ChatOrderedApplication, {"classify": update_lane})
+               .concurrent_updates(scheduler.UPDATE_BACKLOG)
+               .build())
         
         # Auto-Register Commands
         cmds = [
@@ -4317,8 +4805,9 @@ async def start_bot():
             
         app.add_error_handler(error_handler)
     
-        # Central Neural Tracker (High Priority)
-        app.add_handler(TypeHandler(Update, global_neural_tracker), group=-1)
+        # Central Neural Tracker (High Priority), then the quota gate
+        app.add_handler(TypeHandler(Update, global_neural_tracker), group=-2)
+        app.add_handler(TypeHandler(Update, quota_gate), group=-1)
 
         app.add_handler(CommandHandler("insta", handle_insta_cmd))
         app.add_handler(CommandHandler("userinfo", handle_userinfo_cmd))
@@ -4380,6 +4869,7 @@ async def start_bot():
         app.add_handler(CommandHandler("s_broadcast", broadcast))
         app.add_handler(CommandHandler("s_broadcast_media", broadcast_media))
         app.add_handler(CommandHandler("s_delbroadcast", cmd_del_broadcast))
+        app.add_handler(CommandHandler("s_retention", cmd_retention))
         app.add_handler(CommandHandler("s_ban", group_ban))
         app.add_handler(CommandHandler("s_unban", group_unban))
         app.add_handler(CommandHandler("s_mute", group_mute))
@@ -4402,6 +4892,7 @@ async def start_bot():
         
         logger.info("Hinata Initialized")
         
+        await quotas.restore()
         await app.start()
         await app.updater.start_polling()
         STATS["status"] = "online"
@@ -4412,9 +4903,23 @@ async def start_bot():
         if "rejected by the server" in str(e).lower() or "unauthorized" in str(e).lower():
             logger.error("CRITICAL: Your Telegram Bot Token is INVALID. Please check @BotFather.")
 
+    upstream.start_clients()
+
     # Start cleanup task (runs regardless of bot connection)
     asyncio.create_task(auto_cleanup_task())
 
+    global _activity_task, _lag_task, _retention_task, _quota_task, _history_task
+    if _activity_task is None or _activity_task.done():
+        _activity_task = asyncio.create_task(activity_flush_task())
+    if _history_task is None or _history_task.done():
+        _history_task = asyncio.create_task(conversation.flush_task())
+    if _quota_task is None or _quota_task.done():
+        _quota_task = asyncio.create_task(quotas.snapshot_task())
+    if _retention_task is None or _retention_task.done():
+        _retention_task = asyncio.create_task(retention_task())
+    if _lag_task is None or _lag_task.done():
+        _lag_task = asyncio.create_task(loop_lag_monitor())
+
 
 
 async def stop_bot():
@@ -4438,6 +4943,19 @@ async def stop_bot():
         
         app = None
         logger.info("Bot Stopped")
+    try:
+        await db.flush_activity()
+    except Exception as e:
+        logger.error(f"Final activity flush failed: {e}")
+    try:
+        await conversation.cache.flush()
+    except Exception as e:
+        logger.error(f"Final history flush failed: {e}")
+    try:
+        await quotas.snapshot()
+    except Exception as e:
+        logger.error(f"Final quota snapshot failed: {e}")
+    await upstream.close_clients()
     STATS["status"] = "offline"
 
 if __name__ == "__main__":
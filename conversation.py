@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Recent conversation turns per chat, served from memory.
+
+fetch_chatgpt needs the last few messages of a chat before every AI call and
+stores the new turn afterwards. ConversationCache keeps those messages in an
+LRU (bounded by chats, messages per chat and total bytes; idle chats expire),
+so a reply reads its context from RAM and never waits for SQLite:
+
+    - a miss loads the chat once from chat_history
+    - add_turn() updates the cache at once and queues the rows; flush_task()
+      writes them in batches in the background
+    - a miss for a chat that still has queued rows flushes first, so evicting a
+      chat can never hide its newest turns
+
+Prompts for the GET-based engines are assembled by build_prompt(): summary and
+history share a per-engine budget, while the system and user prompt are only
+cut when they would not fit in the request at all. Once a chat has FOLD_AT
+messages, its older ones are folded into a short rolling summary in the
+background (the `summarizer` callback set by bot.py) and only the newest
+KEEP_RECENT stay verbatim.
+Summaries live in memory only; after a restart or eviction a chat starts
+from its raw history again and is re-summarized as it grows.
+"""
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from urllib.parse import quote
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_CHATS = 2000
+CACHE_MAX_BYTES = 8 * 1024 * 1024    # message text held across all chats
+CACHE_MESSAGES = 30                  # newest messages kept per chat
+CACHE_IDLE_TTL = 1800                # seconds before an unused chat is dropped
+FLUSH_INTERVAL = 1.0                 # seconds between background writes
+FLUSH_MAX = 200                      # queued rows that trigger an early write
+
+KEEP_RECENT = 6                      # messages left verbatim when older ones are summarized
+FOLD_AT = 26                         # messages that trigger a background summary refresh (every 10 turns)
+
+CONVERSATION_STATS = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "flushed_rows": 0, "write_errors": 0,
+                      "summaries": 0, "summary_errors": 0}
+
+# --- Prompt Budget ---
+# Budgets count URL-encoded bytes, i.e. what the prompt costs in the GET URL.
+MESSAGE_BYTES = 500      # longest history message quoted in a prompt
+SUMMARY_BYTES = 600      # longest rolling summary
+ELLIPSIS = "…"
+
+PROMPT_STATS = {"built": 0, "dropped_messages": 0, "trimmed_messages": 0, "truncated": 0,
+                "total_bytes": 0, "max_bytes": 0}
+
+def encoded_len(text):
+    return len(quote(text))
+
+def clip(text, budget):
+    """Longest prefix of `text` (ellipsis added) whose encoded size fits `budget`."""
+    if encoded_len(text) <= budget:
+        return text
+    budget -= encoded_len(ELLIPSIS)
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if encoded_len(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo].rstrip() + ELLIPSIS if lo else ""
+
+def build_prompt(prompt, system=None, summary=None, history=(), budget=4000, limit=None):
+    """System prompt, summary, the newest history messages that fit and the
+    user prompt as one payload. Summary and history use at most `budget`
+    encoded bytes and whatever room `limit` leaves; the user prompt is kept
+    whole unless it does not fit in `limit` next to the system prompt.
+    Returns (payload, whether the prompt was cut)."""
+    head = f"System: {system}\n\n" if system else ""
+    tail = f"User: {prompt}"
+    truncated = limit is not None and encoded_len(head) + encoded_len(tail) > limit
+    if truncated:
+        PROMPT_STATS["truncated"] += 1
+        tail = "User: " + clip(prompt, max(0, limit - encoded_len(head) - encoded_len("User: ")))
+        head = clip(head, max(0, limit - encoded_len(tail)))
+    fixed = encoded_len(head) + encoded_len(tail)
+    if limit is not None:
+        budget = min(budget, limit - fixed)
+    left = budget
+
+    memory = ""
+    if summary:
+        memory = f"Summary of earlier conversation: {clip(summary, SUMMARY_BYTES)}\n\n"
+        if encoded_len(memory) > left:
+            memory = ""
+        left -= encoded_len(memory)
+
+    lines = []
+    for h in reversed(history):
+        text = clip(h["message"], MESSAGE_BYTES)
+        line = f"{'User' if h['role'] == 'user' else 'Assistant'}: {text}\n"
+        size = encoded_len(line)
+        if size > left:
+            break
+        if text != h["message"]:
+            PROMPT_STATS["trimmed_messages"] += 1
+        lines.append(line)
+        left -= size
+    PROMPT_STATS["dropped_messages"] += len(history) - len(lines)
+
+    payload = head + memory + "".join(reversed(lines)) + tail
+    size = fixed + budget - left
+    PROMPT_STATS["built"] += 1
+    PROMPT_STATS["total_bytes"] += size
+    PROMPT_STATS["max_bytes"] = max(PROMPT_STATS["max_bytes"], size)
+    return payload, truncated
+
+
+class ConversationCache:
+    def __init__(self, max_chats=CACHE_MAX_CHATS, max_bytes=CACHE_MAX_BYTES, per_chat=CACHE_MESSAGES,
+                 idle_ttl=CACHE_IDLE_TTL):
+        self.max_chats = max_chats
+        self.max_bytes = max_bytes
+        self.per_chat = per_chat
+        self.idle_ttl = idle_ttl
+        self.bytes = 0
+        self._chats = OrderedDict()  # chat_id -> [deque of {"role", "message"}, last used, bytes, summary]
+        self._pending = []           # (chat_id, user_id, role, message, created_ms) not yet in SQLite
+        self._pending_chats = {}     # chat_id -> queued rows
+        self._flush_lock = asyncio.Lock()
+        self.flush_needed = asyncio.Event()
+        # async (previous summary, messages) -> new summary; None disables folding
+        self.summarizer = None
+        self._folding = set()
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._chats)
+
+    async def context(self, chat_id):
+        """(rolling summary, messages not folded into it yet, oldest first)."""
+        self._expire()
+        entry = self._chats.get(chat_id)
+        if entry is not None:
+            CONVERSATION_STATS["hits"] += 1
+            entry[1] = time.monotonic()
+            self._chats.move_to_end(chat_id)
+            return entry[3], list(entry[0])
+        CONVERSATION_STATS["misses"] += 1
+        if chat_id in self._pending_chats:
+            await self.flush()
+        rows = await db.get_chat_history(chat_id, limit=self.per_chat)
+        entry = self._chats.get(chat_id)  # filled by a concurrent miss meanwhile
+        if entry is None:
+            entry = self._store(chat_id, rows)
+        return entry[3], list(entry[0])
+
+    def add_turn(self, chat_id, user_id, prompt, reply):
+        """Appends a prompt and its reply; the SQLite write happens later."""
+        now = int(time.time() * 1000)
+        messages = [{"role": "user", "message": prompt}, {"role": "hinata", "message": reply}]
+        entry = self._chats.get(chat_id)
+        # Without an entry the chat's older messages are not in memory; the next
+        # history() call reloads them, flushing these rows first
+        if entry is not None:
+            for m in messages:
+                entry[0].append(m)
+                entry[2] += len(m["message"])
+                self.bytes += len(m["message"])
+            while len(entry[0]) > self.per_chat:
+                dropped = len(entry[0].popleft()["message"])
+                entry[2] -= dropped
+                self.bytes -= dropped
+            entry[1] = time.monotonic()
+            self._chats.move_to_end(chat_id)
+            self._evict()
+            if self.summarizer and len(entry[0]) >= FOLD_AT and chat_id not in self._folding:
+                self._folding.add(chat_id)
+                task = asyncio.create_task(self._fold(chat_id, entry))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        for m in messages:
+            self._pending.append((chat_id, user_id, m["role"], m["message"], now))
+        self._pending_chats[chat_id] = self._pending_chats.get(chat_id, 0) + len(messages)
+        if len(self._pending) >= FLUSH_MAX:
+            self.flush_needed.set()
+
+    def drop(self, chat_id):
+        entry = self._chats.pop(chat_id, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def _store(self, chat_id, rows):
+        messages = deque({"role": r["role"], "message": r["message"]} for r in rows[-self.per_chat:])
+        size = sum(len(m["message"]) for m in messages)
+        entry = self._chats[chat_id] = [messages, time.monotonic(), size, ""]
+        self.bytes += size
+        self._evict()
+        return entry
+
+    async def _fold(self, chat_id, entry):
+        """Replaces all but the newest KEEP_RECENT messages with a refreshed summary."""
+        older = list(entry[0])[:-KEEP_RECENT]
+        try:
+            summary = clip((await self.summarizer(entry[3], older)).strip(), SUMMARY_BYTES)
+            # Dropped if the chat was evicted or its oldest messages rotated out meanwhile
+            if summary and self._chats.get(chat_id) is entry and entry[0] and entry[0][0] is older[0]:
+                freed = sum(len(entry[0].popleft()["message"]) for _ in older)
+                grown = len(summary) - len(entry[3])
+                entry[2] += grown - freed
+                self.bytes += grown - freed
+                entry[3] = summary
+                CONVERSATION_STATS["summaries"] += 1
+        except Exception as e:
+            CONVERSATION_STATS["summary_errors"] += 1
+            logger.error(f"Conversation summary failed for {chat_id}: {e}")
+        finally:
+            self._folding.discard(chat_id)
+
+    def _evict(self):
+        # The newest entry stays even if it alone exceeds max_bytes
+        while len(self._chats) > 1 and (len(self._chats) > self.max_chats or self.bytes > self.max_bytes):
+            _, entry = self._chats.popitem(last=False)
+            self.bytes -= entry[2]
+            CONVERSATION_STATS["evictions"] += 1
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._chats:
+            chat_id, entry = next(iter(self._chats.items()))
+            if entry[1] > cutoff:
+                break
+            self.drop(chat_id)
+            CONVERSATION_STATS["expired"] += 1
+
+    async def flush(self):
+        """Writes every queued row; failed batches are queued again."""
+        async with self._flush_lock:
+            rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            try:
+                await db.save_chat_messages(rows)
+            except Exception:
+                CONVERSATION_STATS["write_errors"] += 1
+                self._pending[:0] = rows
+                raise
+            for row in rows:
+                left = self._pending_chats[row[0]] - 1
+                if left:
+                    self._pending_chats[row[0]] = left
+                else:
+                    del self._pending_chats[row[0]]
+            CONVERSATION_STATS["flushed_rows"] += len(rows)
+            return len(rows)
+
+    def stats(self):
+        return dict(CONVERSATION_STATS, chats=len(self._chats), bytes=self.bytes, queued_rows=len(self._pending))
+
+cache = ConversationCache()
+
+async def flush_task():
+    """Writes queued turns every FLUSH_INTERVAL seconds, or sooner when FLUSH_MAX rows pile up."""
+    while True:
+        try:
+            await asyncio.wait_for(cache.flush_needed.wait(), timeout=FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        cache.flush_needed.clear()
+        try:
+            await cache.flush()
+        except Exception as e:
+            logger.error(f"Conversation flush error: {e}")
@@ -2,20 +2,198 @@ import sqlite3
 import json
 import os
 import time
+import queue
+import asyncio
+import threading
+import functools
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 
 DB_FILE = "bot.db"
 
-def get_connection():
-    conn = sqlite3.connect(DB_FILE)
+# Connection tuning. Every connection gets the same PRAGMAs; the WAL journal
+# lets the pooled readers run while the single writer commits.
+READER_POOL_SIZE = 4
+CACHE_SIZE_KB = 16 * 1024          # page cache per connection (PRAGMA cache_size=-KB)
+MMAP_SIZE = 128 * 1024 * 1024      # memory-mapped I/O window
+STATEMENT_CACHE_SIZE = 256         # sqlite3 prepared statement cache per connection
+BUSY_TIMEOUT_MS = 5000
+
+
+def _configure(conn):
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
     return conn
 
-def init_db():
-    conn = get_connection()
-    c = conn.cursor()
-    
-    # Users Table
+
+def _open(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    return _configure(conn)
+
+
+class ConnectionManager:
+    """Holds one long-lived writer connection and a small pool of readers.
+
+    Writes are serialized through a lock and committed (or rolled back) when
+    the ``writer()`` block exits. Readers are checked out of a queue, so
+    concurrent threads never share a connection.
+    """
+
+    def __init__(self, path, readers=READER_POOL_SIZE):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._writer = _open(path)
+        # auto_vacuum only applies to new files here; init_db() converts old ones.
+        self._writer.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._writer.execute("PRAGMA journal_mode = WAL")
+        self._pool = queue.Queue()
+        self._pool_size = readers
+        self._created = 0
+        self._create_lock = threading.Lock()
+        self._closed = False
+
+    @contextmanager
+    def writer(self):
+        with self._write_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+
+    @contextmanager
+    def reader(self):
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            if self._closed:
+                conn.close()
+            else:
+                self._pool.put(conn)
+
+    def _checkout(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._create_lock:
+            if self._created < self._pool_size:
+                self._created += 1
+                return _open(self.path)
+        return self._pool.get()
+
+    def close(self):
+        self._closed = True
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_manager():
+    """Returns the process-wide ConnectionManager for DB_FILE."""
+    global _manager
+    with _manager_lock:
+        if _manager is None or _manager.path != DB_FILE:
+            if _manager is not None:
+                _manager.close()
+            _manager = ConnectionManager(DB_FILE)
+        return _manager
+
+def close_connections():
+    global _manager
+    db.shutdown()
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close()
+            _manager = None
+
+def _writer():
+    return get_manager().writer()
+
+def _reader():
+    return get_manager().reader()
+
+def get_connection():
+    """Opens a standalone tuned connection (callers must close it)."""
+    return _open(DB_FILE)
+
+def init_db(import_legacy=True):
+    """Opens DB_FILE and brings it up to date. import_legacy=False skips the
+    one-time users/groups/config/broadcast history JSON imports (benchmarks,
+    throwaway DBs)."""
+    _check_auto_vacuum()
+    run_migrations()
+
+    # Run migration if needed
+    if import_legacy:
+        if is_db_empty():
+            migrate_from_json()
+        migrate_config_json()
+        migrate_broadcast_history_json()
+    _load_access_cache()
+
+    if pending_backfills():
+        threading.Thread(target=run_backfills, name="schema-backfill", daemon=True).start()
+
+def _check_auto_vacuum():
+    # incremental_vacuum() (see Retention below) can only hand deleted pages
+    # back to the filesystem in auto_vacuum=INCREMENTAL mode. A new database
+    # gets it for free; an existing one needs a full VACUUM, which rewrites the
+    # whole file and is left to enable_incremental_vacuum(), run offline.
+    with _writer() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+        if conn.execute("SELECT count(*) FROM sqlite_master").fetchone()[0] == 0:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        else:
+            print("auto_vacuum is off, freed pages stay in the file. "
+                  "Stop the bot and run `python database.py vacuum` once to enable it.")
+
+def enable_incremental_vacuum():
+    """One-off offline step: rebuilds DB_FILE with auto_vacuum=INCREMENTAL.
+    Takes the writer for as long as a full VACUUM takes, so run it with the bot stopped."""
+    with _writer() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+
+# --- Schema Migrations ---
+# PRAGMA user_version holds the number of the last applied step. Each step
+# commits together with its version bump, so a crash repeats at most the step
+# that was running. Steps are idempotent because databases created before the
+# runner existed all report user_version 0.
+#
+# Steps must stay cheap (DDL, small tables). Work that touches every row of a
+# large table is registered in schema_backfills instead and done by
+# run_backfills() in small committed chunks on a background thread; progress
+# is saved with every chunk, so a restart resumes where it stopped.
+BACKFILL_BATCH = 5000
+BACKFILL_PAUSE = 0.05        # seconds between chunks, lets queued writes in
+ANALYZE_LIMIT = 1000         # PRAGMA analysis_limit: sampled ANALYZE on big tables
+
+def _columns(c, table):
+    return {row["name"] for row in c.execute(f"PRAGMA table_info({table})")}
+
+def _m001_base_tables(c):
     c.execute('''CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY,
         full_name TEXT,
@@ -26,8 +204,6 @@ def init_db():
         is_premium INTEGER DEFAULT 0,
         language_code TEXT
     )''')
-    
-    # Groups Table
     c.execute('''CREATE TABLE IF NOT EXISTS groups (
         id INTEGER PRIMARY KEY,
         title TEXT,
@@ -36,230 +212,884 @@ def init_db():
         last_active_at TEXT,
         member_count INTEGER DEFAULT 0
     )''')
-    
-    # Broadcasts Table
     c.execute('''CREATE TABLE IF NOT EXISTS broadcasts (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         text TEXT,
         target TEXT,
         sent_count INTEGER,
         failed_count INTEGER,
-        timestamp TEXT,
-        message_ids TEXT -- JSON string of {chat_id: message_id}
+        timestamp TEXT
     )''')
-    
-    # Chat History Table
     c.execute('''CREATE TABLE IF NOT EXISTS chat_history (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         chat_id INTEGER,
         user_id INTEGER,
         role TEXT, -- 'user' or 'hinata'
         message TEXT,
-        timestamp TEXT
+        created_ms INTEGER -- epoch milliseconds
     )''')
-    
-    conn.commit()
-    conn.close()
-    
-    # Run migration if needed
-    if is_db_empty():
-        migrate_from_json()
+
+def _m002_chat_history_created_ms(c):
+    # Older databases have a TEXT timestamp column; it is left in place and
+    # converted into created_ms by the chat_history_created_ms backfill.
+    columns = _columns(c, "chat_history")
+    if "created_ms" not in columns:
+        c.execute("ALTER TABLE chat_history ADD COLUMN created_ms INTEGER")
+    if "timestamp" in columns:
+        c.execute("INSERT OR IGNORE INTO schema_backfills (name) VALUES ('chat_history_created_ms')")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_chat_id ON chat_history (chat_id, id)")
+
+def _m003_registry_indexes(c):
+    # Newest-first paging and @username lookups
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_joined_at ON users (joined_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_groups_added_at ON groups (added_at)")
+
+def _m004_broadcast_deliveries(c):
+    # One row per recipient of a broadcast
+    c.execute('''CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+        broadcast_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER,
+        status TEXT NOT NULL, -- 'sent', 'failed', 'deleted' or 'delete_failed'
+        error TEXT,
+        sent_at INTEGER, -- epoch milliseconds
+        PRIMARY KEY (broadcast_id, chat_id)
+    ) WITHOUT ROWID''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_status ON broadcast_deliveries (status, broadcast_id)")
+
+    # Older databases kept deliveries as a JSON blob on the broadcast row
+    if "message_ids" not in _columns(c, "broadcasts"):
+        return
+    rows = c.execute("SELECT id, timestamp, message_ids FROM broadcasts WHERE message_ids IS NOT NULL").fetchall()
+    deliveries = []
+    for row in rows:
+        try:
+            message_ids = json.loads(row["message_ids"]) or {}
+        except ValueError:
+            continue
+        sent_at = int(time.mktime(time.strptime(row["timestamp"], "%Y-%m-%d %H:%M:%S")) * 1000) if row["timestamp"] else None
+        deliveries.extend((row["id"], int(chat_id), int(message_id), "sent", None, sent_at)
+                          for chat_id, message_id in message_ids.items())
+    if rows:
+        c.executemany("INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, chat_id, message_id, status, error, sent_at) VALUES (?, ?, ?, ?, ?, ?)",
+                      deliveries)
+        c.execute("UPDATE broadcasts SET message_ids = NULL WHERE message_ids IS NOT NULL")
+        print(f"Moved {len(deliveries)} broadcast deliveries out of broadcasts.message_ids.")
+
+def _m005_settings(c):
+    # Settings & Access Control
+    c.execute('''CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT -- JSON encoded
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS banned_users (
+        user_id INTEGER PRIMARY KEY,
+        banned_at TEXT
+    )''')
+
+def _m006_response_cache(c):
+    # Persistent tier of the upstream response cache (upstream.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS response_cache (
+        key TEXT PRIMARY KEY,
+        status INTEGER,
+        body BLOB,
+        expires_ms INTEGER -- epoch milliseconds
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_ms)")
+
+def _m007_quota_buckets(c):
+    # Snapshot of quotas.py token buckets
+    c.execute('''CREATE TABLE IF NOT EXISTS quota_buckets (
+        scope TEXT,
+        id INTEGER,
+        feature TEXT,
+        tokens REAL,
+        updated_ms INTEGER, -- epoch milliseconds
+        PRIMARY KEY (scope, id, feature)
+    )''')
+
+def _m008_broadcast_source(c):
+    # Who sent a broadcast: 'command' (/s_broadcast*, the set /s_delbroadcast
+    # cleans up) or 'dashboard'; NULL for broadcasts recorded before this step
+    if "source" not in _columns(c, "broadcasts"):
+        c.execute("ALTER TABLE broadcasts ADD COLUMN source TEXT")
+
+def _m009_registry_order_indexes(c):
+    # joined_at/added_at may be NULL (legacy imports); list_users/list_groups
+    # page on COALESCE(column, '') and need the index on that expression
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_order ON users (COALESCE(joined_at, ''), id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_groups_order ON groups (COALESCE(added_at, ''), id)")
+    c.execute("DROP INDEX IF EXISTS idx_users_joined_at")
+    c.execute("DROP INDEX IF EXISTS idx_groups_added_at")
+
+MIGRATIONS = [
+    (1, "base tables", _m001_base_tables),
+    (2, "chat_history created_ms + (chat_id, id) index", _m002_chat_history_created_ms),
+    (3, "users/groups registry indexes", _m003_registry_indexes),
+    (4, "broadcast_deliveries", _m004_broadcast_deliveries),
+    (5, "settings and banned_users", _m005_settings),
+    (6, "response_cache", _m006_response_cache),
+    (7, "quota_buckets", _m007_quota_buckets),
+    (8, "broadcasts source", _m008_broadcast_source),
+    (9, "users/groups paging indexes on COALESCE(timestamp, '')", _m009_registry_order_indexes),
+]
+
+def _backfill_chat_history_created_ms(conn, last_id, batch):
+    ids = conn.execute("SELECT id FROM chat_history WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch)).fetchall()
+    if not ids:
+        return None, 0
+    # Legacy rows were written with local time.strftime()
+    cur = conn.execute("""UPDATE chat_history
+        SET created_ms = COALESCE(CAST(strftime('%s', timestamp, 'utc') AS INTEGER) * 1000, 0)
+        WHERE id BETWEEN ? AND ? AND created_ms IS NULL""", (ids[0][0], ids[-1][0]))
+    return ids[-1][0], cur.rowcount
+
+# name -> chunk(conn, last_id, batch) returning (new last_id, or None when finished; rows changed)
+BACKFILLS = {
+    "chat_history_created_ms": _backfill_chat_history_created_ms,
+}
+
+def schema_version():
+    with _reader() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def run_migrations():
+    """Applies every step newer than PRAGMA user_version. Returns the number applied."""
+    with _writer() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS schema_backfills (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER DEFAULT 0,
+            done INTEGER DEFAULT 0
+        )''')
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    applied = 0
+    for number, name, step in MIGRATIONS:
+        if number <= version:
+            continue
+        with _writer() as conn:
+            # DDL does not open a transaction implicitly; the step and its
+            # version bump must commit together.
+            conn.execute("BEGIN")
+            step(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {number}")
+        applied += 1
+    if applied:
+        print(f"Schema upgraded from version {version} to {MIGRATIONS[-1][0]} ({applied} steps).")
+        analyze()
+    return applied
+
+def pending_backfills():
+    with _reader() as conn:
+        return [row["name"] for row in conn.execute("SELECT name FROM schema_backfills WHERE done = 0 ORDER BY name")]
+
+def run_backfills(batch=BACKFILL_BATCH, pause=BACKFILL_PAUSE):
+    """Runs registered backfills chunk by chunk; safe to interrupt and rerun."""
+    pending = pending_backfills()
+    for name in pending:
+        chunk = BACKFILLS[name]
+        total = 0
+        while True:
+            with _writer() as conn:
+                last_id = conn.execute("SELECT last_id FROM schema_backfills WHERE name = ?", (name,)).fetchone()[0]
+                next_id, changed = chunk(conn, last_id, batch)
+                conn.execute("UPDATE schema_backfills SET last_id = ?, done = ? WHERE name = ?",
+                             (last_id if next_id is None else next_id, int(next_id is None), name))
+            total += changed
+            if next_id is None:
+                break
+            time.sleep(pause)
+        print(f"Backfill {name} complete: {total} rows updated.")
+    if pending:
+        analyze()
+
+def analyze():
+    """Refreshes planner statistics; analysis_limit keeps it fast on large tables."""
+    with _writer() as conn:
+        conn.execute(f"PRAGMA analysis_limit = {ANALYZE_LIMIT}")
+        conn.execute("ANALYZE")
 
 def is_db_empty():
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT count(*) FROM users")
-    user_count = c.fetchone()[0]
-    conn.close()
+    with _reader() as conn:
+        user_count = conn.execute("SELECT count(*) FROM users").fetchone()[0]
     return user_count == 0
 
+def legacy_path(name):
+    """Legacy JSON files live next to the database they were imported into."""
+    return os.path.join(os.path.dirname(DB_FILE), name)
+
+def _read_legacy_json(name):
+    path = legacy_path(name)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read().strip()
+    return json.loads(content) if content else []
+
 def migrate_from_json():
     print("Migrating data from JSON to SQLite...")
-    conn = get_connection()
-    c = conn.cursor()
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
     
     # Migrate Users
-    if os.path.exists("users.json"):
-        try:
-            with open("users.json", "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if content:
-                    users = json.loads(content)
-                    for u in users:
-                        if isinstance(u, dict):
-                            uid = u.get("id")
-                            name = u.get("name")
-                            username = u.get("username")
-                            joined = u.get("joined_at", time.strftime("%Y-%m-%d %H:%M:%S"))
-                            c.execute("INSERT OR IGNORE INTO users (id, full_name, username, joined_at) VALUES (?, ?, ?, ?)",
-                                      (uid, name, username, joined))
-                        else:
-                            # Legacy list of IDs
-                            c.execute("INSERT OR IGNORE INTO users (id, full_name, username, joined_at) VALUES (?, ?, ?, ?)",
-                                      (u, "Legacy User", "unknown", time.strftime("%Y-%m-%d %H:%M:%S")))
-        except Exception as e:
-            print(f"Error migrating users: {e}")
+    try:
+        rows = []
+        for u in _read_legacy_json("users.json"):
+            if isinstance(u, dict):
+                rows.append((u.get("id"), u.get("name"), u.get("username"), u.get("joined_at") or now))
+            else:
+                # Legacy list of IDs
+                rows.append((u, "Legacy User", "unknown", now))
+        with _writer() as conn:
+            conn.executemany("INSERT OR IGNORE INTO users (id, full_name, username, joined_at) VALUES (?, ?, ?, ?)", rows)
+    except Exception as e:
+        print(f"Error migrating users: {e}")
 
     # Migrate Groups
-    if os.path.exists("groups.json"):
-        try:
-            with open("groups.json", "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if content:
-                    groups = json.loads(content)
-                    for g in groups:
-                        if isinstance(g, dict):
-                            gid = g.get("id")
-                            title = g.get("title")
-                            gtype = g.get("type", "supergroup")
-                            added = g.get("added_at", time.strftime("%Y-%m-%d %H:%M:%S"))
-                            c.execute("INSERT OR IGNORE INTO groups (id, title, type, added_at) VALUES (?, ?, ?, ?)",
-                                      (gid, title, gtype, added))
-                        else:
-                            c.execute("INSERT OR IGNORE INTO groups (id, title, type, added_at) VALUES (?, ?, ?, ?)",
-                                      (g, "Legacy Group", "supergroup", time.strftime("%Y-%m-%d %H:%M:%S")))
-        except Exception as e:
-            print(f"Error migrating groups: {e}")
-
-    conn.commit()
-    conn.close()
+    try:
+        rows = []
+        for g in _read_legacy_json("groups.json"):
+            if isinstance(g, dict):
+                rows.append((g.get("id"), g.get("title"), g.get("type", "supergroup"), g.get("added_at") or now))
+            else:
+                rows.append((g, "Legacy Group", "supergroup", now))
+        with _writer() as conn:
+            conn.executemany("INSERT OR IGNORE INTO groups (id, title, type, added_at) VALUES (?, ?, ?, ?)", rows)
+    except Exception as e:
+        print(f"Error migrating groups: {e}")
+
     print("Migration complete.")
 
 # --- User Operations ---
 
 def add_user(user_id, full_name, username):
-    conn = get_connection()
-    c = conn.cursor()
-    
-    # Upsert logic
     now = time.strftime("%Y-%m-%d %H:%M:%S")
     
-    # Check if exists
-    c.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-    exists = c.fetchone()
-    
-    if exists:
-        # Update
-        c.execute("UPDATE users SET full_name = ?, username = ?, last_active_at = ? WHERE id = ?",
-                  (full_name, username, now, user_id))
-    else:
-        # Insert
-        c.execute("INSERT INTO users (id, full_name, username, joined_at, last_active_at) VALUES (?, ?, ?, ?, ?)",
+    with _writer() as conn:
+        c = conn.cursor()
+        c.execute("INSERT OR IGNORE INTO users (id, full_name, username, joined_at, last_active_at) VALUES (?, ?, ?, ?, ?)",
                   (user_id, full_name, username, now, now))
+        is_new = c.rowcount == 1
+        if not is_new:
+            c.execute("UPDATE users SET full_name = ?, username = ?, last_active_at = ? WHERE id = ?",
+                      (full_name, username, now, user_id))
         
-    conn.commit()
-    conn.close()
-    return not exists # Returns True if new user
+    return is_new # Returns True if new user
 
 def get_all_users():
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM users ORDER BY joined_at DESC")
-    rows = c.fetchall()
-    conn.close()
+    with _reader() as conn:
+        rows = conn.execute("SELECT * FROM users ORDER BY joined_at DESC").fetchall()
     return [dict(row) for row in rows]
 
 def get_user(user_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    row = c.fetchone()
-    conn.close()
+    with _reader() as conn:
+        row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
     return dict(row) if row else None
 
+def count_users():
+    with _reader() as conn:
+        return conn.execute("SELECT count(*) FROM users").fetchone()[0]
+
+def _search_clause(search, name_column, username_column=None):
+    """WHERE fragment for the dashboard search box: exact id, @username prefix or name substring."""
+    search = (search or "").strip()
+    if not search:
+        return "", []
+    if search.lstrip("-").isdigit():
+        return "id = ?", [int(search)]
+    if username_column and search.startswith("@"):
+        return f"{username_column} LIKE ?", [search[1:] + "%"]
+    pattern = f"%{search}%"
+    if username_column:
+        return f"({name_column} LIKE ? OR {username_column} LIKE ?)", [pattern, pattern]
+    return f"{name_column} LIKE ?", [pattern]
+
+def _list_page(table, order_column, after_id, limit, where, params):
+    """Keyset page ordered newest first by (order_column, id); `after_id` is the last id already shown.
+    NULL timestamps sort as '' (oldest) so a NULL cursor row still compares."""
+    key = f"COALESCE({order_column}, '')"  # matches the idx_*_order indexes
+    clauses = [where] if where else []
+    if after_id is not None:
+        # The first bound only lets SQLite seek the expression index
+        clauses.append(f"{key} <= (SELECT {key} FROM {table} WHERE id = ?)")
+        clauses.append(f"({key}, id) < (SELECT {key}, id FROM {table} WHERE id = ?)")
+        params = params + [after_id, after_id]
+    sql = f"SELECT * FROM {table}"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += f" ORDER BY {key} DESC, id DESC LIMIT ?"
+    with _reader() as conn:
+        rows = conn.execute(sql, params + [limit]).fetchall()
+    return [dict(row) for row in rows]
+
+def list_users(after_id=None, limit=50, search=None):
+    where, params = _search_clause(search, "full_name", "username")
+    return _list_page("users", "joined_at", after_id, limit, where, params)
+
 # --- Group Operations ---
 
 def add_group(chat_id, title, chat_type):
-    conn = get_connection()
-    c = conn.cursor()
-    
     now = time.strftime("%Y-%m-%d %H:%M:%S")
     
-    c.execute("SELECT id FROM groups WHERE id = ?", (chat_id,))
-    exists = c.fetchone()
-    
-    if exists:
-        c.execute("UPDATE groups SET title = ?, last_active_at = ? WHERE id = ?", (title, now, chat_id))
-    else:
-        c.execute("INSERT INTO groups (id, title, type, added_at, last_active_at) VALUES (?, ?, ?, ?, ?)",
-                  (chat_id, title, chat_type, now, now))
-                  
-    conn.commit()
-    conn.close()
+    with _writer() as conn:
+        conn.execute("""INSERT INTO groups (id, title, type, added_at, last_active_at) VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(id) DO UPDATE SET title = excluded.title, last_active_at = excluded.last_active_at""",
+                     (chat_id, title, chat_type, now, now))
 
 def get_all_groups():
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM groups ORDER BY added_at DESC")
-    rows = c.fetchall()
-    conn.close()
+    with _reader() as conn:
+        rows = conn.execute("SELECT * FROM groups ORDER BY added_at DESC").fetchall()
     return [dict(row) for row in rows]
 
 def get_group(chat_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM groups WHERE id = ?", (chat_id,))
-    row = c.fetchone()
-    conn.close()
+    with _reader() as conn:
+        row = conn.execute("SELECT * FROM groups WHERE id = ?", (chat_id,)).fetchone()
     return dict(row) if row else None
 
+def count_groups():
+    with _reader() as conn:
+        return conn.execute("SELECT count(*) FROM groups").fetchone()[0]
+
+def list_groups(after_id=None, limit=50, search=None):
+    where, params = _search_clause(search, "title")
+    return _list_page("groups", "added_at", after_id, limit, where, params)
+
+# --- Settings & Access Control ---
+# Mirrored in memory so permission checks never touch the database; every
+# write updates the row first and the cache after the commit.
+CONFIG_FILE = "config.json"  # resolved with legacy_path()
+DEFAULT_SETTINGS = {"global_access": True}
+
+_access_lock = threading.Lock()
+_settings_cache = {}
+_banned_cache = set()
+
+def _load_access_cache():
+    global _settings_cache, _banned_cache
+    with _reader() as conn:
+        settings = {row["key"]: json.loads(row["value"]) for row in conn.execute("SELECT key, value FROM settings")}
+        banned = {row[0] for row in conn.execute("SELECT user_id FROM banned_users")}
+    with _access_lock:
+        _settings_cache, _banned_cache = settings, banned
+
+def migrate_config_json():
+    """Imports a legacy config.json once, then renames it so it is not read again."""
+    path = legacy_path(CONFIG_FILE)
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+        config = json.loads(content) if content else {}
+    except Exception as e:
+        print(f"Error migrating config: {e}")
+        return
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    banned = config.pop("banned_users", []) or []
+    with _writer() as conn:
+        conn.executemany("INSERT OR IGNORE INTO banned_users (user_id, banned_at) VALUES (?, ?)",
+                         [(int(uid), now) for uid in banned])
+        conn.executemany("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)",
+                         [(key, json.dumps(value)) for key, value in config.items()])
+    os.replace(path, path + ".migrated")
+    print(f"Migrated {path}: {len(config)} settings, {len(banned)} bans.")
+
+BROADCAST_HISTORY_FILE = "broadcast_history.json"  # resolved with legacy_path()
+
+def migrate_broadcast_history_json():
+    """Imports the messages /s_broadcast* logged in broadcast_history.json as
+    'command' broadcasts so /s_delbroadcast can still delete them, then renames
+    the file. A chat can only appear once per broadcast, so its n-th entry
+    goes into the n-th imported broadcast."""
+    path = legacy_path(BROADCAST_HISTORY_FILE)
+    if not os.path.exists(path):
+        return
+    try:
+        entries = _read_legacy_json(BROADCAST_HISTORY_FILE)
+    except Exception as e:
+        print(f"Error migrating broadcast history: {e}")
+        return
+    batches = []
+    seen = {}
+    for entry in entries if isinstance(entries, list) else []:
+        try:
+            chat_id, message_id = int(entry["chat_id"]), int(entry["message_id"])
+            sent_at = int(float(entry.get("time") or 0) * 1000) or None
+        except (KeyError, TypeError, ValueError):
+            continue
+        n = seen[chat_id] = seen.get(chat_id, -1) + 1
+        if n == len(batches):
+            batches.append([])
+        batches[n].append((chat_id, message_id, sent_at))
+    with _writer() as conn:
+        for rows in batches:
+            first = min((r[2] for r in rows if r[2]), default=None)
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(first / 1000)) if first else None
+            b_id = conn.execute("""INSERT INTO broadcasts (text, target, sent_count, failed_count, timestamp, source)
+                                   VALUES (?, 'legacy', ?, 0, ?, 'command')""",
+                                (f"[Imported] {BROADCAST_HISTORY_FILE}", len(rows), stamp)).lastrowid
+            conn.executemany("INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, chat_id, message_id, status, error, sent_at) VALUES (?, ?, ?, 'sent', NULL, ?)",
+                             [(b_id, chat_id, message_id, sent_at) for chat_id, message_id, sent_at in rows])
+    os.replace(path, path + ".migrated")
+    print(f"Migrated {path}: {sum(map(len, batches))} messages in {len(batches)} broadcasts.")
+
+def get_setting(key, default=None):
+    if default is None:
+        default = DEFAULT_SETTINGS.get(key)
+    return _settings_cache.get(key, default)
+
+def get_settings():
+    with _access_lock:
+        return {**DEFAULT_SETTINGS, **_settings_cache}
+
+def set_setting(key, value):
+    with _writer() as conn:
+        conn.execute("INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                     (key, json.dumps(value)))
+    with _access_lock:
+        _settings_cache[key] = value
+    return value
+
+def is_banned(user_id):
+    return user_id in _banned_cache
+
+def get_banned_users():
+    with _access_lock:
+        return sorted(_banned_cache)
+
+def ban_user(user_id):
+    """Returns True if the user was not banned before."""
+    with _writer() as conn:
+        cur = conn.execute("INSERT OR IGNORE INTO banned_users (user_id, banned_at) VALUES (?, ?)",
+                           (user_id, time.strftime("%Y-%m-%d %H:%M:%S")))
+    with _access_lock:
+        _banned_cache.add(user_id)
+    return cur.rowcount == 1
+
+def unban_user(user_id):
+    """Returns True if the user was banned."""
+    with _writer() as conn:
+        cur = conn.execute("DELETE FROM banned_users WHERE user_id = ?", (user_id,))
+    with _access_lock:
+        _banned_cache.discard(user_id)
+    return cur.rowcount == 1
+
+# --- Recipients ---
+# Fan-out (broadcasts, user tracking) streams ids in keyset chunks instead of
+# loading whole tables. Each chunk is a short read, so a long broadcast never
+# pins a WAL snapshot the way one open cursor would.
+_RECIPIENT_TABLES = {"users": "users", "groups": "groups"}
+
+def recipient_id_chunk(kind, after_id=None, chunk=1000):
+    table = _RECIPIENT_TABLES[kind]
+    with _reader() as conn:
+        if after_id is None:
+            rows = conn.execute(f"SELECT id FROM {table} ORDER BY id LIMIT ?", (chunk,)).fetchall()
+        else:
+            rows = conn.execute(f"SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?", (after_id, chunk)).fetchall()
+    return [row[0] for row in rows]
+
+def iter_recipient_ids(kind, chunk=1000):
+    """Yields every user or group id, `chunk` ids per query."""
+    after_id = None
+    while True:
+        ids = recipient_id_chunk(kind, after_id, chunk)
+        yield from ids
+        if len(ids) < chunk:
+            return
+        after_id = ids[-1]
+
+# --- Activity Buffer ---
+# Sightings from the update tracker are merged in memory and written in one
+# executemany upsert per flush instead of one transaction per update.
+ACTIVITY_FLUSH_INTERVAL = 2.0   # seconds between background flushes
+ACTIVITY_FLUSH_MAX = 500        # buffered records that trigger an early flush
+
+_activity_lock = threading.Lock()
+_pending_users = {}
+_pending_groups = {}
+
+_USER_UPSERT = """INSERT INTO users (id, full_name, username, joined_at, last_active_at, message_count, is_premium, language_code)
+    VALUES (?1, ?2, ?3, ?4, ?5, ?6, COALESCE(?7, 0), ?8)
+    ON CONFLICT(id) DO UPDATE SET
+        full_name = excluded.full_name,
+        username = excluded.username,
+        last_active_at = excluded.last_active_at,
+        message_count = users.message_count + excluded.message_count,
+        is_premium = COALESCE(?7, users.is_premium),
+        language_code = COALESCE(excluded.language_code, users.language_code)"""
+
+_GROUP_UPSERT = """INSERT INTO groups (id, title, type, added_at, last_active_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        title = excluded.title,
+        last_active_at = excluded.last_active_at"""
+
+def _activity_full():
+    return len(_pending_users) + len(_pending_groups) >= ACTIVITY_FLUSH_MAX
+
+def record_user_activity(user_id, full_name, username, messages=1, is_premium=None, language_code=None):
+    """Buffers a user sighting. Returns True when the buffer wants an early flush."""
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    with _activity_lock:
+        entry = _pending_users.get(user_id)
+        if entry is None:
+            _pending_users[user_id] = {
+                "full_name": full_name, "username": username, "first_seen": now,
+                "last_seen": now, "messages": messages,
+                "is_premium": is_premium, "language_code": language_code,
+            }
+        else:
+            entry.update(full_name=full_name, username=username, last_seen=now)
+            entry["messages"] += messages
+            if is_premium is not None:
+                entry["is_premium"] = is_premium
+            if language_code:
+                entry["language_code"] = language_code
+        return _activity_full()
+
+def record_group_activity(chat_id, title, chat_type):
+    """Buffers a group sighting. Returns True when the buffer wants an early flush."""
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    with _activity_lock:
+        entry = _pending_groups.get(chat_id)
+        if entry is None:
+            _pending_groups[chat_id] = {"title": title, "type": chat_type, "first_seen": now, "last_seen": now}
+        else:
+            entry.update(title=title, last_seen=now)
+        return _activity_full()
+
+def flush_activity():
+    """Writes all buffered sightings in a single transaction. Returns rows written."""
+    global _pending_users, _pending_groups
+    with _activity_lock:
+        users, groups = _pending_users, _pending_groups
+        _pending_users, _pending_groups = {}, {}
+    if not users and not groups:
+        return 0
+
+    user_rows = [(uid, u["full_name"], u["username"], u["first_seen"], u["last_seen"],
+                  u["messages"], None if u["is_premium"] is None else int(u["is_premium"]), u["language_code"]) for uid, u in users.items()]
+    group_rows = [(gid, g["title"], g["type"], g["first_seen"], g["last_seen"]) for gid, g in groups.items()]
+    try:
+        with _writer() as conn:
+            if user_rows:
+                conn.executemany(_USER_UPSERT, user_rows)
+            if group_rows:
+                conn.executemany(_GROUP_UPSERT, group_rows)
+    except Exception:
+        # Put the batch back so the next flush retries it; newer sightings win.
+        with _activity_lock:
+            for uid, u in users.items():
+                newer = _pending_users.get(uid)
+                if newer is not None:
+                    newer["messages"] += u["messages"]
+                    newer["first_seen"] = u["first_seen"]
+                else:
+                    _pending_users[uid] = u
+            for gid, g in groups.items():
+                _pending_groups.setdefault(gid, g)
+        raise
+    return len(user_rows) + len(group_rows)
+
 # --- Broadcast Operations ---
 
-def add_broadcast(text, target, sent, failed, message_ids_map):
-    conn = get_connection()
-    c = conn.cursor()
+DELIVERY_BATCH = 200   # delivery rows per write while a broadcast is sending
+
+def create_broadcast(text, target, source=None):
+    """Inserts the broadcast row up front so deliveries can reference it. Returns its id."""
     now = time.strftime("%Y-%m-%d %H:%M:%S")
-    c.execute("INSERT INTO broadcasts (text, target, sent_count, failed_count, timestamp, message_ids) VALUES (?, ?, ?, ?, ?, ?)",
-              (text, target, sent, failed, now, json.dumps(message_ids_map)))
-    conn.commit()
-    conn.close()
+    with _writer() as conn:
+        cur = conn.execute("INSERT INTO broadcasts (text, target, sent_count, failed_count, timestamp, source) VALUES (?, ?, 0, 0, ?, ?)",
+                           (text, target, now, source))
+        return cur.lastrowid
+
+def finish_broadcast(b_id, sent, failed):
+    with _writer() as conn:
+        conn.execute("UPDATE broadcasts SET sent_count = ?, failed_count = ? WHERE id = ?", (sent, failed, b_id))
+
+def add_deliveries(rows):
+    """rows: (broadcast_id, chat_id, message_id, status, error, sent_at)"""
+    with _writer() as conn:
+        conn.executemany("INSERT OR REPLACE INTO broadcast_deliveries (broadcast_id, chat_id, message_id, status, error, sent_at) VALUES (?, ?, ?, ?, ?, ?)",
+                         rows)
+
+def _sent_filter(broadcast_id, source):
+    sql = "FROM broadcast_deliveries WHERE status = 'sent'"
+    params = []
+    if broadcast_id is not None:
+        sql += " AND broadcast_id = ?"
+        params.append(broadcast_id)
+    if source is not None:
+        sql += " AND broadcast_id IN (SELECT id FROM broadcasts WHERE source = ?)"
+        params.append(source)
+    return sql, params
+
+def count_sent_deliveries(broadcast_id=None, source=None):
+    sql, params = _sent_filter(broadcast_id, source)
+    with _reader() as conn:
+        return conn.execute("SELECT count(*) " + sql, params).fetchone()[0]
+
+def get_sent_deliveries(broadcast_id=None, after=None, limit=DELIVERY_BATCH, source=None):
+    """Keyset page of messages still live in Telegram: [(broadcast_id, chat_id, message_id)].
+    `after` is the (broadcast_id, chat_id) of the last row already handled;
+    `source` limits the page to broadcasts sent from there (see create_broadcast)."""
+    sql, params = _sent_filter(broadcast_id, source)
+    sql = "SELECT broadcast_id, chat_id, message_id " + sql
+    if after is not None:
+        sql += " AND (broadcast_id, chat_id) > (?, ?)"
+        params.extend(after)
+    sql += " ORDER BY broadcast_id, chat_id LIMIT ?"
+    with _reader() as conn:
+        rows = conn.execute(sql, params + [limit]).fetchall()
+    return [tuple(row) for row in rows]
+
+def set_delivery_status(rows):
+    """rows: (status, error, broadcast_id, chat_id)"""
+    with _writer() as conn:
+        conn.executemany("UPDATE broadcast_deliveries SET status = ?, error = ? WHERE broadcast_id = ? AND chat_id = ?", rows)
 
 def get_all_broadcasts():
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM broadcasts ORDER BY timestamp DESC")
-    rows = c.fetchall()
-    conn.close()
+    with _reader() as conn:
+        rows = conn.execute("SELECT * FROM broadcasts ORDER BY timestamp DESC").fetchall()
     return [dict(row) for row in rows]
 
 def get_broadcast(b_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM broadcasts WHERE id = ?", (b_id,))
-    row = c.fetchone()
-    conn.close()
+    with _reader() as conn:
+        row = conn.execute("SELECT * FROM broadcasts WHERE id = ?", (b_id,)).fetchone()
     return dict(row) if row else None
 
 def delete_broadcast_record(b_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM broadcasts WHERE id = ?", (b_id,))
-    conn.commit()
-    conn.close()
+    with _writer() as conn:
+        conn.execute("DELETE FROM broadcast_deliveries WHERE broadcast_id = ?", (b_id,))
+        conn.execute("DELETE FROM broadcasts WHERE id = ?", (b_id,))
 
 # --- Chat History Operations ---
 
+def _now_ms():
+    return int(time.time() * 1000)
+
 def save_chat_history(chat_id, user_id, role, message):
-    conn = get_connection()
-    c = conn.cursor()
-    now = time.strftime("%Y-%m-%d %H:%M:%S")
-    c.execute("INSERT INTO chat_history (chat_id, user_id, role, message, timestamp) VALUES (?, ?, ?, ?, ?)",
-              (chat_id, user_id, role, message, now))
-    conn.commit()
-    conn.close()
+    with _writer() as conn:
+        conn.execute("INSERT INTO chat_history (chat_id, user_id, role, message, created_ms) VALUES (?, ?, ?, ?, ?)",
+                     (chat_id, user_id, role, message, _now_ms()))
+
+def save_chat_turn(chat_id, user_id, prompt, reply):
+    """Stores a user prompt and the bot reply in one transaction."""
+    now = _now_ms()
+    with _writer() as conn:
+        conn.executemany("INSERT INTO chat_history (chat_id, user_id, role, message, created_ms) VALUES (?, ?, ?, ?, ?)",
+                         [(chat_id, user_id, "user", prompt, now), (chat_id, user_id, "hinata", reply, now)])
+
+def save_chat_messages(rows):
+    """Batch insert of (chat_id, user_id, role, message, created_ms) rows."""
+    with _writer() as conn:
+        conn.executemany("INSERT INTO chat_history (chat_id, user_id, role, message, created_ms) VALUES (?, ?, ?, ?, ?)",
+                         rows)
 
 def get_chat_history(chat_id, limit=10):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT role, message FROM chat_history WHERE chat_id = ? ORDER BY timestamp DESC LIMIT ?", (chat_id, limit))
-    rows = c.fetchall()
-    conn.close()
+    with _reader() as conn:
+        # Walks idx_chat_history_chat_id backwards: O(limit) regardless of table size.
+        rows = conn.execute("SELECT role, message FROM chat_history WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+                            (chat_id, limit)).fetchall()
     # Return in chronological order
     return [{"role": row["role"], "message": row["message"]} for row in reversed(rows)]
 
 def clear_chat_history(chat_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM chat_history WHERE chat_id = ?", (chat_id,))
-    conn.commit()
-    conn.close()
+    with _writer() as conn:
+        conn.execute("DELETE FROM chat_history WHERE chat_id = ?", (chat_id,))
+
+# --- Retention ---
+# chat_history is append-only from the bot's side. These are single-batch
+# steps: the retention task in bot.py loops over them through the async facade
+# so normal writes are queued in between and the writer is never held for long.
+HISTORY_MAX_ROWS_PER_CHAT = 200   # ring buffer: newest rows kept per chat (2 rows per turn)
+HISTORY_MAX_AGE_DAYS = 30
+RETENTION_BATCH = 1000            # rows deleted per transaction
+VACUUM_STEP_PAGES = 256           # pages released per incremental_vacuum call
+
+def get_overfull_chats(max_rows=HISTORY_MAX_ROWS_PER_CHAT):
+    with _reader() as conn:
+        rows = conn.execute("SELECT chat_id FROM chat_history GROUP BY chat_id HAVING count(*) > ?",
+                            (max_rows,)).fetchall()
+    return [row[0] for row in rows]
+
+def trim_chat_history(chat_id, max_rows=HISTORY_MAX_ROWS_PER_CHAT, batch=RETENTION_BATCH):
+    """Deletes up to `batch` of the oldest rows beyond the chat's cap. Returns rows deleted."""
+    with _writer() as conn:
+        row = conn.execute("SELECT id FROM chat_history WHERE chat_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                           (chat_id, max_rows)).fetchone()
+        if not row:
+            return 0
+        cur = conn.execute("""DELETE FROM chat_history WHERE id IN (
+            SELECT id FROM chat_history WHERE chat_id = ? AND id <= ? ORDER BY id LIMIT ?)""",
+                           (chat_id, row[0], batch))
+        return cur.rowcount
+
+def prune_chat_history(max_age_days=HISTORY_MAX_AGE_DAYS, batch=RETENTION_BATCH):
+    """Deletes expired rows among the `batch` oldest ids. Returns rows deleted."""
+    cutoff = _now_ms() - max_age_days * 86400 * 1000
+    with _writer() as conn:
+        # ids grow with time, so the oldest rows sit at the front of the rowid
+        # order: only the first `batch` ids are read (created_ms has no index),
+        # and a batch that is not fully expired ends the caller's loop.
+        cur = conn.execute("""DELETE FROM chat_history WHERE id IN (
+            SELECT id FROM (SELECT id, created_ms FROM chat_history ORDER BY id LIMIT ?)
+            WHERE created_ms < ?)""", (batch, cutoff))
+        return cur.rowcount
+
+def incremental_vacuum(pages=VACUUM_STEP_PAGES):
+    """Returns up to `pages` free pages to the filesystem. Returns bytes reclaimed."""
+    with _writer() as conn:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (before - after) * page_size
+
+def get_storage_info():
+    with _reader() as conn:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        history_rows = conn.execute("SELECT count(*) FROM chat_history").fetchone()[0]
+    return {
+        "db_bytes": page_size * page_count,
+        "free_bytes": page_size * freelist,
+        "history_rows": history_rows,
+    }
+
+def export_snapshot():
+    """Writes a consistent copy of the live database (WAL contents included) to
+    a new temp file next to DB_FILE and returns its path; the caller deletes it."""
+    fd, path = tempfile.mkstemp(prefix="bot-snapshot-", suffix=".db", dir=os.path.dirname(os.path.abspath(DB_FILE)))
+    os.close(fd)
+    os.remove(path)  # VACUUM INTO refuses to overwrite
+    try:
+        with _reader() as conn:
+            conn.execute("VACUUM INTO ?", (path,))
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return path
+
+# --- Response Cache ---
+# Backing store for upstream.py's optional persistent tier. Expired rows are
+# ignored on read and deleted by the retention task.
+
+def get_cached_response(key):
+    """Returns (status, body, expires_ms) for a live entry, else None."""
+    with _reader() as conn:
+        row = conn.execute("SELECT status, body, expires_ms FROM response_cache WHERE key = ? AND expires_ms > ?",
+                           (key, _now_ms())).fetchone()
+    return tuple(row) if row else None
+
+def put_cached_response(key, status, body, expires_ms):
+    with _writer() as conn:
+        conn.execute("INSERT OR REPLACE INTO response_cache (key, status, body, expires_ms) VALUES (?, ?, ?, ?)",
+                     (key, status, body, expires_ms))
+
+def prune_response_cache(batch=RETENTION_BATCH):
+    """Deletes up to `batch` expired cache rows. Returns rows deleted."""
+    with _writer() as conn:
+        cur = conn.execute("""DELETE FROM response_cache WHERE key IN (
+            SELECT key FROM response_cache WHERE expires_ms <= ? LIMIT ?)""", (_now_ms(), batch))
+        return cur.rowcount
+
+# --- Quota Buckets ---
+# Snapshot store for quotas.py: written every few seconds, read once at startup.
+
+def get_quota_buckets():
+    with _reader() as conn:
+        return [tuple(row) for row in conn.execute("SELECT scope, id, feature, tokens, updated_ms FROM quota_buckets")]
+
+def save_quota_buckets(rows, dropped=()):
+    """Upserts (scope, id, feature, tokens, updated_ms) rows and deletes `dropped` keys."""
+    with _writer() as conn:
+        conn.executemany("INSERT OR REPLACE INTO quota_buckets (scope, id, feature, tokens, updated_ms) VALUES (?, ?, ?, ?, ?)",
+                         rows)
+        conn.executemany("DELETE FROM quota_buckets WHERE scope = ? AND id = ? AND feature = ?", dropped)
+
+# --- Dashboard Snapshot ---
+
+def get_dashboard_snapshot(page_size=50):
+    """Totals, the newest page of users/groups and the broadcast log in one call."""
+    return {
+        "total_users": count_users(),
+        "total_groups": count_groups(),
+        "users": list_users(limit=page_size),
+        "groups": list_groups(limit=page_size),
+        "broadcasts": get_all_broadcasts(),
+    }
+
+# --- Async Facade ---
+# Coroutine versions of the functions above for handlers and API routes, so
+# sqlite never runs on the event loop: `await db.add_user(...)`.
+# Writes are queued to a single writer thread; reads fan out over a pool
+# the size of the reader connection pool.
+
+class AsyncDB:
+    READS = {
+        "is_db_empty", "get_all_users", "get_user", "get_all_groups",
+        "get_group", "get_all_broadcasts", "get_broadcast",
+        "get_chat_history", "get_dashboard_snapshot", "get_overfull_chats",
+        "count_users", "count_groups", "list_users", "list_groups", "recipient_id_chunk",
+        "count_sent_deliveries", "get_sent_deliveries",
+        "get_storage_info", "get_cached_response", "get_quota_buckets", "export_snapshot",
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._write_pool = None
+        self._read_pool = None
+
+    def _pool(self, name):
+        with self._lock:
+            if self._write_pool is None:
+                self._write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+                self._read_pool = ThreadPoolExecutor(max_workers=READER_POOL_SIZE, thread_name_prefix="db-read")
+            return self._read_pool if name in self.READS else self._write_pool
+
+    async def run(self, func, *args, **kwargs):
+        """Runs any database function off the event loop."""
+        pool = self._pool(func.__name__)
+        return await asyncio.get_running_loop().run_in_executor(pool, functools.partial(func, *args, **kwargs))
+
+    async def iter_recipient_ids(self, kind, chunk=1000):
+        """Async counterpart of iter_recipient_ids(): `async for uid in db.iter_recipient_ids("users")`."""
+        after_id = None
+        while True:
+            ids = await self.run(recipient_id_chunk, kind, after_id, chunk)
+            for chat_id in ids:
+                yield chat_id
+            if len(ids) < chunk:
+                return
+            after_id = ids[-1]
+
+    def __getattr__(self, name):
+        func = globals().get(name)
+        if name.startswith("_") or not callable(func) or isinstance(func, type):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            return await self.run(func, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+    def shutdown(self):
+        with self._lock:
+            pools = (self._write_pool, self._read_pool)
+            self._write_pool = self._read_pool = None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+db = AsyncDB()
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] != ["vacuum"]:
+        sys.exit("usage: python database.py vacuum")
+    print("Enabling incremental auto_vacuum (one-time VACUUM)..." if enable_incremental_vacuum()
+          else "auto_vacuum is already incremental.")
@@ -5,13 +5,19 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, BackgroundTasks
 from telegram import ChatPermissions
 
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
 import bot  # Import the bot module
 import database
+import upstream
+import scheduler
+import quotas
+import conversation
+from database import db
 import json
 
 @asynccontextmanager
@@ -28,6 +34,7 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown logic
     await bot.stop_bot()
+    database.close_connections()
 
 app = FastAPI(title="Hinata Bot Dashboard", lifespan=lifespan)
 
@@ -50,6 +57,17 @@ class CommandExec(BaseModel):
 class TokenUpdate(BaseModel):
     token: str
 
+class QuotaLimit(BaseModel):
+    feature: str
+    scope: str
+    burst: int
+    per_minute: float
+
+class QuotaReset(BaseModel):
+    scope: str = None
+    target_id: int = None
+    feature: str = None
+
 @app.get("/api/config")
 async def get_config():
     """Returns current bot configuration (excluding full token for security)."""
@@ -63,9 +81,9 @@ async def get_config():
         
     return {
         "token": masked,
-        "welcome_img": bot.CONFIG.get("welcome_img"),
-        "fallback_img": bot.CONFIG.get("fallback_img"),
-        "global_access": bot.CONFIG.get("global_access")
+        "welcome_img": database.get_setting("welcome_img"),
+        "fallback_img": database.get_setting("fallback_img"),
+        "global_access": database.get_setting("global_access")
     }
 
 @app.post("/api/token")
@@ -93,44 +111,100 @@ async def update_config(data: ConfigUpdate):
     """Updates bot configuration (images, etc.)."""
     try:
         if data.welcome_img:
-            bot.CONFIG["welcome_img"] = data.welcome_img
+            await db.set_setting("welcome_img", data.welcome_img)
         if data.fallback_img:
-            bot.CONFIG["fallback_img"] = data.fallback_img
-        bot.save_config(bot.CONFIG)
+            await db.set_setting("fallback_img", data.fallback_img)
         return {"success": True, "message": "Neural configuration updated."}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @app.get("/api/download_db")
 async def download_db():
-    """Allows the owner to download the bot's SQLite database file."""
-    db_path = "bot.db"
-    if os.path.exists(db_path):
-        return FileResponse(path=db_path, filename="bot.db", media_type="application/octet-stream")
-    return JSONResponse(status_code=404, content={"error": "Database file not found."})
+    """Allows the owner to download a consistent snapshot of the bot's SQLite database."""
+    if not os.path.exists(database.DB_FILE):
+        return JSONResponse(status_code=404, content={"error": "Database file not found."})
+    # bot.db alone misses whatever is still in bot.db-wal
+    path = await db.export_snapshot()
+    return FileResponse(path=path, filename="bot.db", media_type="application/octet-stream",
+                        background=BackgroundTask(os.remove, path))
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def _page(items, limit):
+    return {"items": items, "next_after_id": items[-1]["id"] if len(items) == limit else None}
 
 @app.get("/api/data")
 async def get_data():
-    """Returns all users and groups with full metadata."""
-    users = database.get_all_users()
-    groups = database.get_all_groups()
-    broadcasts = database.get_all_broadcasts()
+    """Returns totals plus the newest page of users and groups."""
+    snapshot = await db.get_dashboard_snapshot(page_size=PAGE_SIZE)
+    users, groups, broadcasts = snapshot["users"], snapshot["groups"], snapshot["broadcasts"]
     
     return {
         "stats": {
-            "total_users": len(users),
-            "total_groups": len(groups),
+            "total_users": snapshot["total_users"],
+            "total_groups": snapshot["total_groups"],
             "broadcasts": len(broadcasts),
             "uptime": bot.get_uptime(),
             "status": bot.STATS.get("status", "online"),
-            "global_access": bot.CONFIG.get("global_access", True)
+            "global_access": database.get_setting("global_access"),
+            "loop_lag_ms": bot.STATS.get("loop_lag_ms", 0),
+            "loop_lag_max_ms": bot.STATS.get("loop_lag_max_ms", 0),
+            "cache": upstream.cache_stats(),
+            "single_flight": upstream.FLIGHT_STATS,
+            "hedging": bot.HEDGE_STATS,
+            "retries": upstream.retry_stats(),
+            "updates": scheduler.SCHEDULER_STATS,
+            "quotas": quotas.QUOTA_STATS,
+            "conversations": conversation.cache.stats(),
+            "prompts": conversation.PROMPT_STATS
         },
         "users": users,
         "groups": groups,
         "broadcasts": broadcasts,
-        "banned_users": bot.CONFIG.get("banned_users", [])
+        "banned_users": database.get_banned_users(),
+        "breakers": upstream.breaker_states(),
+        "bulkheads": upstream.bulkhead_states(),
+        "upstreams": upstream.metrics_snapshot()
     }
 
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Upstream latency histograms and counters in the Prometheus text format."""
+    return PlainTextResponse(upstream.render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/quotas")
+async def get_quotas():
+    """Quota limits, counters and the emptiest buckets."""
+    return quotas.quota_state()
+
+@app.post("/api/quotas")
+async def update_quota(data: QuotaLimit):
+    """Changes a quota limit live; existing buckets adopt it on their next use."""
+    try:
+        burst, per_minute = await quotas.set_limit(data.feature, data.scope, data.burst, data.per_minute)
+        return {"success": True, "message": f"{data.feature}/{data.scope}: burst {burst}, {per_minute}/min"}
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+
+@app.post("/api/quotas/reset")
+async def reset_quota(data: QuotaReset):
+    """Refills matching buckets (all of them when no filter is given)."""
+    count = quotas.reset(data.scope, data.target_id, data.feature)
+    return {"success": True, "message": f"Refilled {count} quota buckets."}
+
+@app.get("/api/users")
+async def list_users(after_id: int = None, limit: int = PAGE_SIZE, search: str = None):
+    """Keyset-paginated user registry, newest first."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return _page(await db.list_users(after_id=after_id, limit=limit, search=search), limit)
+
+@app.get("/api/groups")
+async def list_groups(after_id: int = None, limit: int = PAGE_SIZE, search: str = None):
+    """Keyset-paginated group registry, newest first."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return _page(await db.list_groups(after_id=after_id, limit=limit, search=search), limit)
 
 @app.get("/api/logs")
 async def get_logs():
@@ -152,26 +226,17 @@ async def control_bot(data: ControlAction):
             open(bot.LOG_FILE, "w").close()
         return {"success": True}
     elif data.action == "toggle_access":
-        bot.CONFIG["global_access"] = not bot.CONFIG.get("global_access", True)
-        bot.save_config(bot.CONFIG)
-        return {"success": True, "new_status": bot.CONFIG["global_access"]}
+        access = await db.set_setting("global_access", not database.get_setting("global_access"))
+        return {"success": True, "new_status": access}
     elif data.action == "delete_broadcast":
-        history = bot.read_json("broadcast_history.json", [])
-        if not history:
+        # Same set as /s_delbroadcast; dashboard broadcasts go through DELETE /api/broadcasts/{id}
+        if not await db.count_sent_deliveries(source="command"):
             return {"success": False, "error": "No broadcast history found"}
         
-        s = f = 0
         if not bot.app:
             return {"success": False, "error": "Bot not initialized"}
             
-        for entry in history:
-            try:
-                await bot.app.bot.delete_message(chat_id=entry['chat_id'], message_id=entry['message_id'])
-                s += 1
-            except:
-                f += 1
-        
-        bot.write_json("broadcast_history.json", [])
+        s, f = await bot.delete_broadcast_messages(bot.app.bot, source="command")
         return {"success": True, "deleted": s, "failed": f}
     elif data.action == "toggle_bot":
         if bot.STATS.get("status") == "online":
@@ -191,8 +256,18 @@ async def control_bot(data: ControlAction):
                 count += 1
             except: pass
         return {"success": True, "message": f"Cleared {count} files from neural core."}
+    elif data.action == "run_retention":
+        report = await bot.run_retention()
+        return {"success": True, "report": report,
+                "message": f"History compacted: {report['trimmed_rows'] + report['aged_rows']} rows removed, "
+                           f"{report['reclaimed_bytes'] / 1024:.1f} KB reclaimed."}
     return {"success": False, "error": "Unknown action"}
 
+@app.get("/api/retention")
+async def get_retention():
+    """Last retention pass plus current database size."""
+    return {"report": bot.RETENTION_REPORT, "storage": await db.get_storage_info()}
+
 @app.get("/api/files")
 async def list_files():
     files = []
@@ -231,42 +306,37 @@ async def auto_cleanup_task():
 async def track_all_users():
     """Background task to track all users metadata."""
     if not bot.app: return
-    users = database.get_all_users()
-    bot.logger.info(f"Starting tracking for {len(users)} users...")
-    for u in users:
+    bot.logger.info(f"Starting tracking for {await db.count_users()} users...")
+    async for uid in db.iter_recipient_ids("users"):
         try:
-            chat = await bot.app.bot.get_chat(u['id'])
-            database.add_user(u['id'], chat.full_name, chat.username)
+            chat = await bot.app.bot.get_chat(uid)
+            if database.record_user_activity(uid, chat.full_name, chat.username, messages=0):
+                bot.ACTIVITY_FLUSH_EVENT.set()
             # Sleep a bit to avoid flood limits
             await asyncio.sleep(0.5)
         except Exception as e:
-            bot.logger.error(f"Failed to track user {u['id']}: {e}")
+            bot.logger.error(f"Failed to track user {uid}: {e}")
+    await db.flush_activity()
     bot.logger.info("User tracking complete.")
 
 @app.get("/api/broadcasts")
 async def get_broadcast_history():
-    return database.get_all_broadcasts()
+    return await db.get_all_broadcasts()
 
 @app.delete("/api/broadcasts/{b_id}")
 async def delete_broadcast_item(b_id: int):
     try:
-        b = database.get_broadcast(b_id)
+        b = await db.get_broadcast(b_id)
         if not b:
             return {"success": False, "error": "Broadcast not found"}
         
         # Delete messages from Telegram
-        msg_ids = json.loads(b['message_ids'])
         s = f = 0
         if bot.app:
-            for chat_id, message_id in msg_ids.items():
-                try:
-                    await bot.app.bot.delete_message(chat_id=int(chat_id), message_id=int(message_id))
-                    s += 1
-                except:
-                    f += 1
+            s, f = await bot.delete_broadcast_messages(bot.app.bot, b_id)
         
         # Delete from DB
-        database.delete_broadcast_record(b_id)
+        await db.delete_broadcast_record(b_id)
         return {"success": True, "deleted": s, "failed": f}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -277,37 +347,31 @@ async def api_broadcast(data: BroadcastMsg):
         if not bot.app:
             return {"success": False, "error": "Bot not initialized"}
         
-        msg_ids_map = {}
         s_users = f_users = s_groups = f_groups = 0
         
-        if data.target == "all" or data.target == "users":
-            users = database.get_all_users()
-            for u in users:
-                uid = u['id']
-                try: 
-                    sent = await bot.app.bot.send_message(chat_id=uid, text=data.message)
-                    msg_ids_map[str(sent.chat_id)] = sent.message_id
-                    s_users += 1
-                except:
-                    f_users += 1
-        
-        if data.target == "all" or data.target == "groups":
-            groups = database.get_all_groups()
-            for g in groups:
-                gid = g['id']
-                try: 
-                    sent = await bot.app.bot.send_message(chat_id=gid, text=data.message)
-                    msg_ids_map[str(sent.chat_id)] = sent.message_id
-                    s_groups += 1
-                except:
-                    f_groups += 1
-    
-        # Save to DB
-        database.add_broadcast(data.message, data.target, s_users + s_groups, f_users + f_groups, msg_ids_map)
+        async with bot.BroadcastRecorder(data.message, data.target, source="dashboard") as rec:
+            if data.target == "all" or data.target == "users":
+                async for uid in db.iter_recipient_ids("users"):
+                    try: 
+                        sent = await bot.app.bot.send_message(chat_id=uid, text=data.message)
+                        await rec.ok(sent)
+                        s_users += 1
+                    except Exception as e:
+                        await rec.fail(uid, e)
+                        f_users += 1
+            
+            if data.target == "all" or data.target == "groups":
+                async for gid in db.iter_recipient_ids("groups"):
+                    try: 
+                        sent = await bot.app.bot.send_message(chat_id=gid, text=data.message)
+                        await rec.ok(sent)
+                        s_groups += 1
+                    except Exception as e:
+                        await rec.fail(gid, e)
+                        f_groups += 1
         
         # Update Stats
         bot.update_stats(s_users, f_users, s_groups, f_groups)
-        bot.STATS["broadcasts"] = bot.STATS.get("broadcasts", 0) + 1
 
         return {
             "status": "success", 
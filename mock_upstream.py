@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for every API Hinata talks to, for offline load tests.
+
+One server plays three parts:
+
+    /<host>/<path>            canned (or recorded) answers for the third-party
+                              APIs, reached through UPSTREAM_OVERRIDE
+    /bot<token>/<method>      a fake Telegram Bot API: getMe, getUpdates,
+                              sendMessage, editMessageText, sendPhoto,
+                              sendVideo and friends, reached through
+                              TELEGRAM_API_URL
+    /mock/...                 control: inject updates, change the latency and
+                              error profile, read reply latency stats
+
+Usage:
+    python mock_upstream.py [--port 8099] [--latency MS] [--jitter MS]
+                            [--tail-rate R --tail MS] [--error-rate R]
+                            [--hang-rate R] [--telegram-latency MS]
+                            [--profile FILE] [--record] [--fixtures DIR]
+                            [--users N --messages N --text TEXT --replies N]
+
+Point the bot at it (token.txt may hold any string):
+    UPSTREAM_OVERRIDE=http://127.0.0.1:8099 TELEGRAM_API_URL=http://127.0.0.1:8099 python main.py
+
+With --users the server also drives a closed-loop load: every synthetic user
+sends a message, waits until the bot has made --replies outbound calls to its
+chat (2 for commands that post a placeholder and then edit it), then sends the
+next one. A report with throughput and reply latency is printed at the end;
+/mock/stats shows the same numbers while it runs.
+
+Answers come from, in order: a recorded fixture in --fixtures (one file per
+upstream.endpoint_name(), written by --record, which proxies to the real API
+on a miss), then the canned CANNED table below, then a 404. yt-dlp downloads
+do not go through the shared clients and still hit the network.
+
+Latency/error injection (--profile is JSON with the same keys, optionally
+per endpoint prefix under "routes"):
+    latency_ms, jitter_ms     base delay plus uniform(0, jitter)
+    tail_rate, tail_ms        this fraction of calls waits tail_ms more
+    error_rate, error_status  this fraction answers error_status (503)
+    hang_rate, hang_s         this fraction stalls hang_s, then answers 504
+    telegram_ms               delay on every fake Bot API call
+"""
+import os
+import re
+import sys
+import json
+import time
+import base64
+import random
+import asyncio
+import argparse
+import statistics
+from collections import deque
+from urllib.parse import parse_qs
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+import upstream
+
+PROFILE = {
+    "latency_ms": 50.0,
+    "jitter_ms": 50.0,
+    "tail_rate": 0.0,
+    "tail_ms": 0.0,
+    "error_rate": 0.0,
+    "error_status": 503,
+    "hang_rate": 0.0,
+    "hang_s": 65.0,
+    "telegram_ms": 0.0,
+    "routes": {},  # endpoint prefix -> overrides of the keys above
+}
+FIXTURES_DIR = "mock_fixtures"
+RECORD = False
+
+# 1x1 PNG and a few bytes standing in for a video file
+PNG = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==")
+MP4 = b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom" + b"\x00" * 1024
+CDN = "https://cdn.mock.local"
+
+
+# ================= Upstream: canned answers =================
+def _prompt(q):
+    for key in ("prompt", "text", "query", "q", "user", "username", "url", "uid"):
+        if q.get(key):
+            return q[key]
+    return ""
+
+def _reply(q):
+    text = f"Mock reply to: {_prompt(q)[:200]}"
+    return {"status": True, "reply": text, "result": text}
+
+def _image(q):
+    return 200, "image/png", PNG
+
+def _cdn(q, path):
+    if path.endswith((".mp4", ".mkv", ".webm")):
+        return 200, "video/mp4", MP4
+    return 200, "image/png", PNG
+
+# endpoint prefix (host + path) -> answer(query) returning a JSON-able object,
+# or a (status, content_type, body) tuple. The first matching prefix wins.
+CANNED = [
+    ("addy-chatgpt-api.vercel.app/", _reply),
+    ("shawon-gemini-3-api.onrender.com/api/ask", _reply),
+    ("apis.prexzyvilla.site/ai/gemimage", lambda q: {"status": True, "image_url": f"{CDN}/images/gen.png"}),
+    ("apis.prexzyvilla.site/ai/aidetector",
+     lambda q: {"status": True, "analysis": {"ai_percentage": 42, "classification": "Mixed"}}),
+    ("apis.prexzyvilla.site/ai/", _reply),
+    ("apis.prexzyvilla.site/stalk/ig", lambda q: {"status": True, "profile": {
+        "username": _prompt(q), "full_name": "Mock Profile", "biography": "Recorded offline",
+        "followers": 1200, "following": 180, "posts": 42, "is_private": False, "is_verified": False,
+        "profile_pic_url": f"{CDN}/images/pfp.png"}}),
+    ("apis.prexzyvilla.site/stalk/ttstalk", lambda q: {"status": True, "data": {
+        "user": {"id": "1", "uniqueId": _prompt(q), "nickname": "Mock TikTok", "signature": "Recorded offline",
+                 "verified": False, "privateAccount": False, "avatarLarger": f"{CDN}/images/pfp.png"},
+        "stats": {"followerCount": 1200, "followingCount": 180, "heartCount": 5400, "videoCount": 42}}}),
+    ("sb-x-hacker-all-info.vercel.app/player-info", lambda q: {
+        "basicInfo": {"nickname": "MockPlayer", "level": 60, "exp": 123456, "region": "BD", "liked": 999},
+        "clanBasicInfo": {}, "socialInfo": {"signature": "Recorded offline"}, "creditScoreInfo": {},
+        "result": {"nickname": "MockPlayer", "level": 60, "exp": 123456, "region": "BD", "bio": "Recorded offline"}}),
+    ("top-1-visit-api.vercel.app/visit", lambda q: {
+        "Credits": "mock", "PlayerNickname": "MockPlayer", "TotalVisits": 100, "SuccessfulVisits": 100,
+        "FailedVisits": 0, "UID": q.get("uid", "")}),
+    ("apis.prexzyvilla.site/search/pinterest",
+     lambda q: {"status": True, "result": [f"{CDN}/images/pin{i}.png" for i in range(10)]}),
+    ("apis.prexzyvilla.site/search/youtube", lambda q: {"status": True, "result": [
+        {"title": f"{_prompt(q)} #{i}", "url": f"https://youtube.com/watch?v=mock{i}"} for i in range(5)]}),
+    ("apis.prexzyvilla.site/search/wallpaper",
+     lambda q: {"status": True, "result": [{"url": f"{CDN}/images/wall{i}.png"} for i in range(5)]}),
+    ("apis.prexzyvilla.site/tools/allstyles", lambda q: {"status": True, "styles": [
+        {"styled_text": f"{name}:{_prompt(q)}"} for name in ("bold", "italic", "script", "mono")]}),
+    ("apis.prexzyvilla.site/tools/tinube",
+     lambda q: {"status": True, "short_url": "https://tinu.be/mock", "original_url": q.get("url", "")}),
+    ("apis.prexzyvilla.site/tools/sendemail", lambda q: {"status": True, "message": "sent"}),
+    ("apis.prexzyvilla.site/download/", lambda q: {"status": True, "result": {
+        "title": "Mock Media", "download_url": f"{CDN}/files/video.mp4"}}),
+    ("apis.prexzyvilla.site/", _image),  # random/*, ssweb and the text makers
+    ("api.mail.tm/domains", lambda q: {"hydra:member": [{"domain": "mock.local"}]}),
+    ("api.mail.tm/accounts", lambda q: (201, "application/json", b'{"id": "mock"}')),
+    ("api.mail.tm/token", lambda q: {"token": "mock-token"}),
+    ("api.mail.tm/messages/", lambda q: {"text": "Recorded offline"}),
+    ("api.mail.tm/messages", lambda q: {"hydra:member": []}),
+    ("api.remove.bg/", _image),
+    ("api.qrserver.com/", lambda q: [{"type": "qrcode", "symbol": [{"seq": 0, "data": "mock", "error": None}]}]),
+    ("quickchart.io/", _image),
+    ("tinyurl.com/", lambda q: (200, "text/plain", b"https://tinyurl.com/mock")),
+    ("is.gd/", lambda q: (200, "text/plain", b"https://is.gd/mock")),
+    ("service-keeper-1.onrender.com/", lambda q: {"success": True}),
+    ("graph.org/", _image),
+]
+
+def _profile(target):
+    conf = {k: v for k, v in PROFILE.items() if k != "routes"}
+    for prefix, overrides in sorted(PROFILE["routes"].items(), key=lambda r: len(r[0])):
+        if target.startswith(prefix):
+            conf.update(overrides)
+    return conf
+
+def _fixture_path(endpoint):
+    return os.path.join(FIXTURES_DIR, re.sub(r"[^\w.-]", "_", endpoint) + ".json")
+
+def _load_fixture(endpoint):
+    try:
+        with open(_fixture_path(endpoint), "r", encoding="utf-8") as f:
+            fx = json.load(f)
+    except (OSError, ValueError):
+        return None
+    body = base64.b64decode(fx["body_b64"]) if "body_b64" in fx else fx["body"].encode("utf-8")
+    return fx["status"], fx["content_type"], body
+
+def _save_fixture(endpoint, status, content_type, body):
+    fx = {"status": status, "content_type": content_type}
+    try:
+        fx["body"] = body.decode("utf-8")
+    except UnicodeDecodeError:
+        fx["body_b64"] = base64.b64encode(body).decode("ascii")
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    with open(_fixture_path(endpoint), "w", encoding="utf-8") as f:
+        json.dump(fx, f, ensure_ascii=False, indent=1)
+
+async def _record(request, host, path):
+    async with httpx.AsyncClient(follow_redirects=True) as client:
+        resp = await client.request(request.method, f"https://{host}/{path}", params=request.query_params,
+                                    content=await request.body(), timeout=90.0)
+    return resp.status_code, resp.headers.get("content-type", "application/octet-stream"), resp.content
+
+def _canned(target, query):
+    host, _, path = target.partition("/")
+    if host == CDN.split("//")[1]:
+        return _cdn(query, path)
+    for prefix, answer in CANNED:
+        if target.startswith(prefix):
+            out = answer(query)
+            if isinstance(out, tuple):
+                return out
+            return 200, "application/json", json.dumps(out).encode("utf-8")
+    return 404, "application/json", b'{"status": false, "message": "no mock fixture for this endpoint"}'
+
+UPSTREAM_HITS = {}  # endpoint -> {"calls", "errors", "hangs"}
+
+async def serve_upstream(request, host, path):
+    target = f"{host}/{path}"
+    endpoint = upstream.endpoint_name(httpx.URL(f"https://{target}"))
+    conf = _profile(target)
+    hits = UPSTREAM_HITS.setdefault(endpoint, {"calls": 0, "errors": 0, "hangs": 0})
+    hits["calls"] += 1
+
+    delay = conf["latency_ms"] + random.uniform(0, conf["jitter_ms"])
+    if random.random() < conf["tail_rate"]:
+        delay += conf["tail_ms"]
+    await asyncio.sleep(delay / 1000)
+    if random.random() < conf["hang_rate"]:
+        hits["hangs"] += 1
+        await asyncio.sleep(conf["hang_s"])
+        return Response(status_code=504)
+    if random.random() < conf["error_rate"]:
+        hits["errors"] += 1
+        return JSONResponse({"status": False, "message": "injected error"}, status_code=conf["error_status"])
+
+    answer = _load_fixture(endpoint)
+    if answer is None and RECORD:
+        answer = await _record(request, host, path)
+        _save_fixture(endpoint, *answer)
+    if answer is None:
+        query = {k: v[-1] for k, v in parse_qs(request.url.query).items()}
+        answer = _canned(target, query)
+    status, content_type, body = answer
+    return Response(content=body, status_code=status, media_type=content_type)
+
+
+# ================= Fake Telegram Bot API =================
+BOT_USER = {"id": 7000000001, "is_bot": True, "first_name": "Hinata", "username": "Hinata_00_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+# Outbound calls that count as the bot answering a chat
+REPLY_METHODS = {"sendMessage", "editMessageText", "sendPhoto", "sendVideo", "sendDocument", "sendAudio",
+                 "sendAnimation", "sendMediaGroup", "editMessageCaption"}
+
+def _chat(chat_id):
+    if chat_id > 0:
+        return {"id": chat_id, "type": "private", "first_name": f"Load {chat_id}"}
+    return {"id": chat_id, "type": "supergroup", "title": f"Load Group {chat_id}"}
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"Load {user_id}", "language_code": "en"}
+
+class _Pending:
+    def __init__(self, update_id, replies):
+        self.update_id = update_id
+        self.start = time.perf_counter()
+        self.replies = replies
+        self.seen = 0
+        self.done = asyncio.get_running_loop().create_future()
+
+class FakeTelegram:
+    def __init__(self):
+        self.updates = deque()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.arrived = asyncio.Event()
+        self.polling = asyncio.Event()
+        self.pending = {}  # chat_id -> deque of _Pending
+        self.methods = {}
+        self.first_ms = []
+        self.done_ms = []
+        self.injected = 0
+        self.completed = 0
+
+    def message(self, chat_id, **fields):
+        self.next_message_id += 1
+        return dict({"message_id": self.next_message_id, "date": int(time.time()),
+                     "chat": _chat(chat_id), "from": BOT_USER}, **fields)
+
+    def inject(self, chat_id, text=None, user_id=None, callback_data=None, replies=1):
+        """Queues an update for getUpdates and returns its _Pending tracker."""
+        user_id = user_id or abs(chat_id)
+        update = {"update_id": self.next_update_id}
+        if callback_data is not None:
+            update["callback_query"] = {"id": str(self.next_update_id), "from": _user(user_id), "chat_instance": "1",
+                                        "data": callback_data, "message": self.message(chat_id, text="menu")}
+        else:
+            self.next_message_id += 1
+            msg = {"message_id": self.next_message_id, "date": int(time.time()), "chat": _chat(chat_id),
+                   "from": _user(user_id), "text": text}
+            command = text.split()[0] if text.startswith("/") else None
+            if command:
+                msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+            update["message"] = msg
+        self.updates.append(update)
+        self.next_update_id += 1
+        self.injected += 1
+        tracker = _Pending(update["update_id"], replies)
+        self.pending.setdefault(chat_id, deque()).append(tracker)
+        self.arrived.set()
+        return tracker
+
+    async def get_updates(self, offset, timeout, limit):
+        self.polling.set()
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates and timeout:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return [u for u in self.updates if u["update_id"] >= offset][:limit]
+
+    def replied(self, chat_id):
+        queue = self.pending.get(chat_id)
+        if not queue:
+            return
+        tracker = queue[0]
+        tracker.seen += 1
+        elapsed = (time.perf_counter() - tracker.start) * 1000
+        if tracker.seen == 1:
+            self.first_ms.append(elapsed)
+        if tracker.seen >= tracker.replies:
+            queue.popleft()
+            self.done_ms.append(elapsed)
+            self.completed += 1
+            if not tracker.done.done():
+                tracker.done.set_result(elapsed)
+
+    def call(self, method, params):
+        self.methods[method] = self.methods.get(method, 0) + 1
+        chat_id = params.get("chat_id")
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            chat_id = None
+        if method in REPLY_METHODS and chat_id is not None:
+            self.replied(chat_id)
+
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText", "editMessageCaption") and chat_id is not None:
+            return self.message(chat_id, text=params.get("text") or params.get("caption") or "")
+        if method == "sendPhoto":
+            return self.message(chat_id, photo=[{"file_id": "photo", "file_unique_id": "photo", "width": 1, "height": 1}])
+        if method == "sendVideo":
+            return self.message(chat_id, video={"file_id": "video", "file_unique_id": "video", "width": 1, "height": 1,
+                                                "duration": 1})
+        if method in ("sendDocument", "sendAudio", "sendAnimation"):
+            return self.message(chat_id, document={"file_id": "doc", "file_unique_id": "doc"})
+        if method == "sendMediaGroup":
+            return [self.message(chat_id, photo=[{"file_id": "photo", "file_unique_id": "photo", "width": 1, "height": 1}])]
+        if method in ("forwardMessage", "copyMessage") and chat_id is not None:
+            msg = self.message(chat_id, text="forwarded")
+            return msg if method == "forwardMessage" else {"message_id": msg["message_id"]}
+        if method == "getFile":
+            return {"file_id": params.get("file_id", "file"), "file_unique_id": "file", "file_size": len(PNG),
+                    "file_path": "photos/file.png"}
+        if method == "getChat" and chat_id is not None:
+            return _chat(chat_id)
+        if method == "getChatMember":
+            return {"status": "member", "user": _user(int(params.get("user_id", 1)))}
+        if method == "getChatMemberCount":
+            return 1
+        return True  # setMyCommands, deleteWebhook, answerCallbackQuery, deleteMessage, ...
+
+    def stats(self, elapsed=None):
+        def pct(samples):
+            if not samples:
+                return None
+            s = sorted(samples)
+            return {"p50": round(statistics.median(s), 1), "p95": round(s[min(len(s) - 1, int(len(s) * 0.95))], 1),
+                    "p99": round(s[min(len(s) - 1, int(len(s) * 0.99))], 1), "max": round(s[-1], 1)}
+        out = {"injected": self.injected, "completed": self.completed, "first_reply_ms": pct(self.first_ms),
+               "complete_ms": pct(self.done_ms), "methods": self.methods, "upstreams": UPSTREAM_HITS}
+        if elapsed:
+            out["elapsed_s"] = round(elapsed, 2)
+            out["throughput_per_s"] = round(self.completed / elapsed, 2)
+        return out
+
+telegram = FakeTelegram()
+
+async def _params(request):
+    params = dict(request.query_params)
+    if request.headers.get("content-type", "").startswith("application/json"):
+        params.update(await request.json())
+    else:
+        form = await request.form()
+        params.update({k: v for k, v in form.items() if isinstance(v, str)})
+    return params
+
+
+# ================= App =================
+app = FastAPI(title="Hinata mock upstream")
+
+@app.get("/mock/stats")
+async def mock_stats():
+    return telegram.stats()
+
+@app.post("/mock/updates")
+async def mock_updates(request: Request):
+    """Body: {"chat_id", "text"} or {"chat_id", "callback_data"}; optional "user_id"."""
+    data = await request.json()
+    tracker = telegram.inject(int(data["chat_id"]), data.get("text"), data.get("user_id"), data.get("callback_data"))
+    return {"update_id": tracker.update_id}
+
+@app.post("/mock/config")
+async def mock_config(request: Request):
+    """Merges the posted keys into the latency/error profile."""
+    PROFILE.update(await request.json())
+    return PROFILE
+
+@app.api_route("/bot{token}/{method}", methods=["GET", "POST"])
+async def bot_api(token: str, method: str, request: Request):
+    params = await _params(request)
+    if PROFILE["telegram_ms"]:
+        await asyncio.sleep(PROFILE["telegram_ms"] / 1000)
+    if method == "getUpdates":
+        result = await telegram.get_updates(int(params.get("offset", 0) or 0), float(params.get("timeout", 0) or 0),
+                                            int(params.get("limit", 100) or 100))
+    else:
+        result = telegram.call(method, params)
+    return {"ok": True, "result": result}
+
+@app.get("/file/bot{token}/{path:path}")
+async def bot_file(token: str, path: str):
+    return Response(content=PNG, media_type="image/png")
+
+@app.api_route("/{host}/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+async def third_party(host: str, path: str, request: Request):
+    return await serve_upstream(request, host, path)
+
+
+# ================= Load =================
+async def _user_loop(chat_id, args):
+    for _ in range(args.messages):
+        tracker = telegram.inject(chat_id, random.choice(args.text), replies=args.replies)
+        try:
+            await asyncio.wait_for(asyncio.shield(tracker.done), args.reply_timeout)
+        except asyncio.TimeoutError:
+            # Drop it so the next message is matched against its own replies
+            queue = telegram.pending.get(chat_id)
+            if queue and queue[0] is tracker:
+                queue.popleft()
+        if args.think:
+            await asyncio.sleep(random.uniform(0, args.think / 1000))
+
+async def run_load(args):
+    print(f"waiting for the bot to poll {args.host}:{args.port} ...")
+    await telegram.polling.wait()
+    print(f"{args.users} users x {args.messages} messages, {args.replies} replies per message")
+    start = time.perf_counter()
+    await asyncio.gather(*(_user_loop(100000 + i, args) for i in range(args.users)))
+    report = telegram.stats(time.perf_counter() - start)
+    print(json.dumps({k: v for k, v in report.items() if k != "upstreams"}, indent=2))
+
+async def _serve(args):
+    server = uvicorn.Server(uvicorn.Config(app, host=args.host, port=args.port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    if args.users:
+        while not server.started:
+            await asyncio.sleep(0.05)
+        await run_load(args)
+        server.should_exit = True
+    await task
+
+def main(argv=None):
+    global FIXTURES_DIR, RECORD
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=PROFILE["latency_ms"], help="base upstream delay in ms")
+    parser.add_argument("--jitter", type=float, default=PROFILE["jitter_ms"], help="extra uniform random delay in ms")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="fraction of calls that get --tail ms more")
+    parser.add_argument("--tail", type=float, default=0.0, help="tail latency in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with a 503")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="fraction of calls that stall until timeout")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="delay on Bot API calls in ms")
+    parser.add_argument("--profile", help="JSON file with profile keys and per-endpoint \"routes\"")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="directory of recorded responses")
+    parser.add_argument("--record", action="store_true", help="proxy misses to the real APIs and save them")
+    parser.add_argument("--users", type=int, default=0, help="synthetic users to drive (0: just serve)")
+    parser.add_argument("--messages", type=int, default=20, help="messages per user")
+    parser.add_argument("--text", action="append", help="message to send (repeatable, picked at random)")
+    parser.add_argument("--replies", type=int, default=2, help="outbound calls that complete one message")
+    parser.add_argument("--reply-timeout", type=float, default=120.0, help="seconds to wait for a reply")
+    parser.add_argument("--think", type=float, default=0.0, help="max random pause between messages in ms")
+    args = parser.parse_args(argv)
+    args.text = args.text or ["/chatgpt hello there"]
+
+    PROFILE.update({"latency_ms": args.latency, "jitter_ms": args.jitter, "tail_rate": args.tail_rate,
+                    "tail_ms": args.tail, "error_rate": args.error_rate, "hang_rate": args.hang_rate,
+                    "telegram_ms": args.telegram_latency})
+    if args.profile:
+        with open(args.profile, "r", encoding="utf-8") as f:
+            PROFILE.update(json.load(f))
+    FIXTURES_DIR, RECORD = args.fixtures, args.record
+    asyncio.run(_serve(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
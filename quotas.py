@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Token-bucket quotas for expensive features.
+
+Every feature class (QUOTAS) has a bucket per user and, in groups, one per
+chat; a request needs a token from both. When either is empty the caller is
+told how long until the next token instead of reaching the upstream, so one
+spammer cannot spend the capacity every other user shares.
+
+Buckets live in memory and are snapshotted to SQLite (quota_buckets) every
+SNAPSHOT_INTERVAL seconds, so a restart does not hand out fresh bursts. A full
+bucket is the same as no bucket and is dropped, which keeps memory bounded by
+the callers active in the last few minutes.
+
+Limits can be changed live (set_limit, /api/quotas); overrides are kept in
+the settings table under "quotas".
+"""
+import time
+import asyncio
+import logging
+
+import database
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# feature -> scope -> (burst, tokens per minute)
+QUOTAS = {
+    "ai":       {"user": (20, 10), "chat": (60, 30)},   # AI engines and Hinata chat
+    "image":    {"user": (5, 2),   "chat": (15, 6)},    # /imagine, wallpapers, text art
+    "download": {"user": (5, 2),   "chat": (15, 6)},    # /dl, /pinterest and their buttons
+    "web":      {"user": (6, 3),   "chat": (20, 10)},   # /webss, /webzip
+}
+SCOPES = ("user", "chat")
+SETTINGS_KEY = "quotas"
+SNAPSHOT_INTERVAL = 30        # seconds between snapshots to SQLite
+TOP_BUCKETS = 50              # emptiest buckets listed by quota_state()
+
+QUOTA_STATS = {"allowed": 0, "limited": 0, "exempt": 0}
+
+_buckets = {}     # (scope, id, feature) -> [tokens, updated (epoch seconds)]
+_dirty = set()    # keys changed since the last snapshot
+_dropped = set()  # keys to delete from the snapshot table
+_restored = False
+
+def limit(feature, scope):
+    """(burst, tokens per minute) with the owner's overrides applied."""
+    override = (database.get_setting(SETTINGS_KEY) or {}).get(feature, {}).get(scope)
+    return tuple(override) if override else QUOTAS[feature][scope]
+
+def limits():
+    return {feature: {scope: limit(feature, scope) for scope in SCOPES} for feature in QUOTAS}
+
+def _level(key, now):
+    burst, per_minute = limit(key[2], key[0])
+    bucket = _buckets.get(key)
+    if bucket is None:
+        return burst
+    return min(burst, bucket[0] + (now - bucket[1]) * per_minute / 60)
+
+def take(feature, user_id, chat_id=None, now=None):
+    """Spends one token from the user's and the chat's bucket. Returns 0.0 when
+    allowed, otherwise the seconds until both have a token again (nothing spent)."""
+    now = time.time() if now is None else now
+    keys = [("user", user_id, feature)]
+    if chat_id is not None and chat_id != user_id:
+        keys.append(("chat", chat_id, feature))
+    levels = [_level(key, now) for key in keys]
+    wait = max((1 - level) * 60 / limit(key[2], key[0])[1] for key, level in zip(keys, levels))
+    if wait > 0:
+        QUOTA_STATS["limited"] += 1
+        return wait
+    for key, level in zip(keys, levels):
+        _buckets[key] = [level - 1, now]
+        _dirty.add(key)
+        _dropped.discard(key)
+    QUOTA_STATS["allowed"] += 1
+    return 0.0
+
+def reset(scope=None, target_id=None, feature=None):
+    """Refills matching buckets; no arguments refills all. Returns buckets reset."""
+    keys = [key for key in _buckets
+            if (scope is None or key[0] == scope) and (target_id is None or key[1] == target_id)
+            and (feature is None or key[2] == feature)]
+    for key in keys:
+        del _buckets[key]
+        _dirty.discard(key)
+        _dropped.add(key)
+    return len(keys)
+
+async def set_limit(feature, scope, burst, per_minute):
+    if feature not in QUOTAS or scope not in SCOPES:
+        raise ValueError(f"Unknown quota {feature}/{scope}")
+    if burst < 1 or per_minute <= 0:
+        raise ValueError("burst must be at least 1 and the refill rate above 0")
+    overrides = dict(database.get_setting(SETTINGS_KEY) or {})
+    overrides[feature] = {**overrides.get(feature, {}), scope: [int(burst), float(per_minute)]}
+    await db.set_setting(SETTINGS_KEY, overrides)
+    # Buckets above the new burst are clamped on their next read
+    return limit(feature, scope)
+
+def quota_state():
+    """Limits, counters and the emptiest buckets for the dashboard."""
+    now = time.time()
+    buckets = []
+    for key in _buckets:
+        level = _level(key, now)
+        burst, per_minute = limit(key[2], key[0])
+        buckets.append({"scope": key[0], "id": key[1], "feature": key[2], "tokens": round(level, 2),
+                        "burst": burst, "retry_in": round(max(0.0, (1 - level) * 60 / per_minute), 1)})
+    buckets.sort(key=lambda b: b["tokens"] / b["burst"])
+    return {"limits": limits(), "stats": dict(QUOTA_STATS, buckets=len(_buckets)), "buckets": buckets[:TOP_BUCKETS]}
+
+# --- Snapshots ---
+
+async def restore():
+    """Loads the last snapshot before updates are processed; later calls (bot
+    restarts) keep the live buckets."""
+    global _restored
+    if _restored:
+        return
+    _restored = True
+    for scope, target_id, feature, tokens, updated_ms in await db.get_quota_buckets():
+        if feature in QUOTAS and scope in SCOPES:
+            _buckets[(scope, target_id, feature)] = [tokens, updated_ms / 1000]
+
+async def snapshot():
+    """Writes changed buckets and forgets the ones that refilled."""
+    now = time.time()
+    for key in list(_buckets):
+        if _level(key, now) >= limit(key[2], key[0])[0]:
+            del _buckets[key]
+            _dirty.discard(key)
+            _dropped.add(key)
+    dirty, dropped = set(_dirty), set(_dropped)
+    _dirty.clear()
+    _dropped.clear()
+    if not (dirty or dropped):
+        return
+    rows = [(key[0], key[1], key[2], _buckets[key][0], int(_buckets[key][1] * 1000)) for key in dirty]
+    try:
+        await db.save_quota_buckets(rows, list(dropped))
+    except Exception:
+        # Keep the keys for the next snapshot unless they changed state meanwhile
+        _dirty.update(key for key in dirty if key in _buckets and key not in _dropped)
+        _dropped.update(key for key in dropped if key not in _buckets and key not in _dirty)
+        raise
+
+async def snapshot_task():
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        try:
+            await snapshot()
+        except Exception as e:
+            logger.error(f"Quota snapshot error: {e}")
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent update processing for the Telegram application.
+
+Left to its defaults, PTB handles one update at a time, so a single slow
+handler (a 60s AI call, a yt-dlp extraction) stalls the bot for every chat.
+ChatOrderedApplication lets PTB start a task per update and then:
+
+    - runs updates from the same chat one after another, in arrival order
+      (conversation flags in user_data, games and menus rely on that)
+    - runs different chats in parallel, each update in a priority lane with
+      its own worker budget (see LANES)
+
+An update first waits for its chat's turn and only then for a slot in its
+lane, so a chat with a backlog never holds slots that other chats could use
+and a saturated heavy lane (image generation, downloads) cannot delay menus,
+/ping or owner moderation.
+"""
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# lane -> handlers that may run at once in it. The application's `classify`
+# callback picks the lane for each update; the first lane is the default.
+LANES = {
+    "ui": 16,       # menus, /start, /ping, games: Telegram calls only
+    "owner": 4,     # owner moderation and maintenance
+    "ai": 24,       # AI engines and API lookups
+    "media": 6,     # image generation, downloads, uploads
+}
+UPDATE_BACKLOG = 4096      # updates accepted (running or queued) before PTB stops pulling more
+
+# chat_waits: updates that had to wait for an earlier update of their chat
+SCHEDULER_STATS = {"processed": 0, "chat_waits": 0, "lanes": {}}
+
+def chat_key(update):
+    """Updates with the same key are processed in order; None means no ordering."""
+    if isinstance(update, Update):
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return ("user", update.effective_user.id)
+    return None
+
+
+class Lane:
+    def __init__(self, name, budget):
+        self.name = name
+        self._slots = asyncio.Semaphore(budget)
+        # queued: waiting for a slot; wait_ms: total time spent queued
+        self.stats = {"budget": budget, "running": 0, "max_running": 0, "queued": 0, "processed": 0,
+                      "wait_ms": 0.0, "max_wait_ms": 0.0}
+
+    @asynccontextmanager
+    async def slot(self):
+        stats = self.stats
+        start = time.perf_counter()
+        stats["queued"] += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            stats["queued"] -= 1
+        waited = (time.perf_counter() - start) * 1000
+        stats["wait_ms"] = round(stats["wait_ms"] + waited, 1)
+        stats["max_wait_ms"] = round(max(stats["max_wait_ms"], waited), 1)
+        stats["running"] += 1
+        stats["max_running"] = max(stats["max_running"], stats["running"])
+        try:
+            yield
+        finally:
+            stats["running"] -= 1
+            stats["processed"] += 1
+            SCHEDULER_STATS["processed"] += 1
+            self._slots.release()
+
+
+class ChatOrderedApplication(Application):
+    """Application that processes updates concurrently but keeps per-chat order.
+    Build with .application_class(ChatOrderedApplication, {"classify": fn})
+    and .concurrent_updates(UPDATE_BACKLOG); fn(update, application) returns a
+    lane name. `lanes` replaces LANES, e.g. {"all": 32} for one shared pool."""
+
+    def __init__(self, *args, lanes=None, classify=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lanes = {name: Lane(name, budget) for name, budget in (lanes or LANES).items()}
+        self._default_lane = next(iter(self._lanes.values()))
+        self._classify = classify
+        self._chats = {}  # chat key -> [asyncio.Lock, updates holding or waiting for it]
+        SCHEDULER_STATS["lanes"] = {name: lane.stats for name, lane in self._lanes.items()}
+
+    def lane_for(self, update):
+        if self._classify is None:
+            return self._default_lane
+        try:
+            return self._lanes.get(self._classify(update, self), self._default_lane)
+        except Exception as e:
+            logger.error(f"Update classification failed: {e}")
+            return self._default_lane
+
+    async def process_update(self, update):
+        key = chat_key(update)
+        if key is None:
+            return await self._run(update)
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        elif entry[0].locked():
+            SCHEDULER_STATS["chat_waits"] += 1
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(update)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[key]
+
+    async def _run(self, update):
+        # Classified only once the chat's turn comes, so flags set by its
+        # earlier updates (AWAIT_* in user_data) are already in place
+        async with self.lane_for(update).slot():
+            await super().process_update(update)
@@ -11,6 +11,7 @@ const els = {
   statUsers: document.getElementById('stat-users'),
   statGroups: document.getElementById('stat-groups'),
   statUptime: document.getElementById('stat-uptime'),
+  statCache: document.getElementById('stat-cache'),
   botStatusDot: document.getElementById('bot-status-dot'),
   botStatusText: document.getElementById('bot-status-text'),
   logsContainer: document.getElementById('logs-container'),
@@ -46,6 +47,12 @@ async function refreshData() {
     if (els.statUsers) els.statUsers.innerText = data.stats.total_users;
     if (els.statGroups) els.statGroups.innerText = data.stats.total_groups;
     if (els.statUptime) els.statUptime.innerText = data.stats.uptime;
+    if (els.statCache && data.stats.cache) {
+      const c = data.stats.cache;
+      els.statCache.innerText = `${Math.round(c.hit_rate * 100)}%`;
+      els.statCache.title = `${c.hits} hits, ${c.negative_hits} not-found hits, ${c.disk_hits} from disk, ` +
+        `${c.misses} misses, ${c.evictions} evictions, ${c.entries} entries (${(c.bytes / 1024).toFixed(1)} KB)`;
+    }
     
     // Update Status
     if (els.botStatusDot) {
@@ -58,11 +65,14 @@ async function refreshData() {
       }
     }
     
-    renderMasterTable(data.users);
-    renderMasterGroups(data.groups);
+    syncRegistry('users', data.users);
+    syncRegistry('groups', data.groups);
     renderRecentTables(data.users, data.groups);
     renderBroadcastHistory(data.broadcasts);
     renderBannedUsers(data.banned_users);
+    renderBreakers(data.breakers);
+    renderUpstreams(data.upstreams);
+    refreshQuotas();
     refreshFiles();
     
   } catch (e) {
@@ -111,6 +121,54 @@ function renderBannedUsers(banned) {
   }
 }
 
+const BREAKER_COLORS = { closed: 'var(--success)', half_open: 'var(--warning)', open: 'var(--danger)' };
+
+function renderBreakers(breakers) {
+  const body = document.getElementById('breakers-body');
+  if (!body) return;
+
+  if (!breakers || breakers.length === 0) {
+    body.innerHTML = '<tr><td colspan="6">No upstream traffic yet.</td></tr>';
+    return;
+  }
+  body.innerHTML = breakers.map(b => `
+    <tr>
+      <td><code>${b.name}</code></td>
+      <td><span class="v-tag" style="background:${BREAKER_COLORS[b.state]}; box-shadow:none;">${b.state.replace('_', '-').toUpperCase()}${b.state === 'open' ? ` (${Math.ceil(b.retry_in)}s)` : ''}</span></td>
+      <td>${b.calls}</td>
+      <td>${(b.error_rate * 100).toFixed(0)}%</td>
+      <td>${b.p90_ms === null ? '-' : `${b.p90_ms}ms`}</td>
+      <td>${b.trips}</td>
+    </tr>
+  `).join('');
+}
+
+const fmtMs = ms => ms === null ? '-' : ms >= 1000 ? `${(ms / 1000).toFixed(1)}s` : `${ms}ms`;
+
+function renderUpstreams(upstreams) {
+  const body = document.getElementById('upstreams-body');
+  if (!body) return;
+
+  if (!upstreams || upstreams.length === 0) {
+    body.innerHTML = '<tr><td colspan="8">No upstream traffic yet.</td></tr>';
+    return;
+  }
+  // Slowest first, so the API dragging replies down sits at the top
+  const rows = [...upstreams].sort((a, b) => (b.p95_ms || 0) - (a.p95_ms || 0));
+  body.innerHTML = rows.map(u => `
+    <tr>
+      <td><span class="v-tag" style="background:${u.kind === 'engine' ? 'var(--secondary)' : 'var(--primary)'}; box-shadow:none;">${u.kind.toUpperCase()}</span> <code>${u.name}</code></td>
+      <td title="${Object.entries(u.outcomes).map(([k, n]) => `${k}: ${n}`).join(', ')}">${u.calls}</td>
+      <td>${fmtMs(u.p50_ms)}</td>
+      <td>${fmtMs(u.p95_ms)}</td>
+      <td>${fmtMs(u.p99_ms)}</td>
+      <td style="color:${u.error_rate >= 0.25 ? 'var(--danger)' : 'inherit'}">${(u.error_rate * 100).toFixed(0)}%</td>
+      <td>${u.timeouts}</td>
+      <td>${u.in_flight}</td>
+    </tr>
+  `).join('');
+}
+
 async function refreshLogs() {
   try {
     const res = await fetch('/api/logs');
@@ -134,6 +192,85 @@ async function refreshLogs() {
   } catch (e) {}
 }
 
+async function refreshQuotas() {
+  try {
+    const res = await fetch('/api/quotas');
+    renderQuotas(await res.json());
+  } catch (e) {}
+}
+
+function renderQuotas(q) {
+  const limitsBody = document.getElementById('quota-limits-body');
+  const bucketsBody = document.getElementById('quota-buckets-body');
+  if (!limitsBody || !bucketsBody) return;
+
+  // Leave the inputs alone while the owner is editing them
+  if (!limitsBody.contains(document.activeElement)) {
+    const input = (feature, scope, i, value) =>
+      `<input type="number" min="${i ? 0.1 : 1}" step="${i ? 0.1 : 1}" value="${value}" id="quota-${feature}-${scope}-${i}" style="width: 5rem">`;
+    limitsBody.innerHTML = Object.entries(q.limits).map(([feature, scopes]) => `
+      <tr>
+        <td><code>${feature}</code></td>
+        ${['user', 'chat'].map(scope => `<td>${input(feature, scope, 0, scopes[scope][0])} / ${input(feature, scope, 1, scopes[scope][1])}</td>`).join('')}
+        <td><button class="btn btn-secondary" onclick="saveQuota('${feature}')"><i class="fa-solid fa-floppy-disk"></i> Save</button></td>
+      </tr>
+    `).join('');
+  }
+
+  if (!q.buckets || q.buckets.length === 0) {
+    bucketsBody.innerHTML = '<tr><td colspan="5">No quota spent yet.</td></tr>';
+    return;
+  }
+  bucketsBody.innerHTML = q.buckets.map(b => `
+    <tr>
+      <td><span class="v-tag" style="background:${b.scope === 'user' ? 'var(--primary)' : 'var(--secondary)'}; box-shadow:none;">${b.scope.toUpperCase()}</span> <code>${b.id}</code></td>
+      <td><code>${b.feature}</code></td>
+      <td style="color:${b.tokens < 1 ? 'var(--danger)' : 'inherit'}">${b.tokens.toFixed(1)} / ${b.burst}</td>
+      <td>${b.retry_in > 0 ? `${Math.ceil(b.retry_in)}s` : '-'}</td>
+      <td><button class="btn btn-secondary" onclick="resetQuota('${b.scope}', ${b.id})"><i class="fa-solid fa-rotate-left"></i> Refill</button></td>
+    </tr>
+  `).join('');
+}
+
+async function saveQuota(feature) {
+  const value = (scope, i) => parseFloat(document.getElementById(`quota-${feature}-${scope}-${i}`).value);
+  try {
+    for (const scope of ['user', 'chat']) {
+      const res = await fetch('/api/quotas', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ feature, scope, burst: Math.round(value(scope, 0)), per_minute: value(scope, 1) })
+      });
+      const data = await res.json();
+      if (!data.success) {
+        alertBox(`Quota update failed: ${data.error}`, 'danger');
+        return;
+      }
+    }
+    alertBox(`Quota for ${feature} updated!`, 'success');
+    document.activeElement.blur();
+    refreshQuotas();
+  } catch (e) {
+    alertBox('Network error during quota update', 'danger');
+  }
+}
+
+async function resetQuota(scope, target_id) {
+  if (!scope && !confirm('Refill every quota bucket?')) return;
+  try {
+    const res = await fetch('/api/quotas/reset', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ scope: scope || null, target_id: target_id ?? null })
+    });
+    const data = await res.json();
+    alertBox(data.message, 'success');
+    refreshQuotas();
+  } catch (e) {
+    alertBox('Network error during quota reset', 'danger');
+  }
+}
+
 async function refreshConfig() {
   try {
     const res = await fetch('/api/config');
@@ -194,6 +331,48 @@ function renderRecentTables(users, groups) {
   }
 }
 
+// Registry paging: keyset cursors from /api/users and /api/groups
+const PAGE_SIZE = 50;
+const registry = {
+  users: { items: [], next: null, search: '', pages: 0 },
+  groups: { items: [], next: null, search: '', pages: 0 }
+};
+
+function syncRegistry(kind, firstPage) {
+  // Polling only refreshes the first page; extra pages and searches stay put.
+  const reg = registry[kind];
+  if (reg.pages > 1 || reg.search) return;
+  reg.items = firstPage;
+  reg.next = firstPage.length === PAGE_SIZE ? firstPage[firstPage.length - 1].id : null;
+  reg.pages = 1;
+  renderRegistry(kind);
+}
+
+async function loadRegistry(kind, reset) {
+  const reg = registry[kind];
+  const params = new URLSearchParams({ limit: PAGE_SIZE });
+  if (reg.search) params.set('search', reg.search);
+  if (!reset && reg.next !== null) params.set('after_id', reg.next);
+  try {
+    const res = await fetch(`/api/${kind}?${params}`);
+    const data = await res.json();
+    reg.items = reset ? data.items : reg.items.concat(data.items);
+    reg.next = data.next_after_id;
+    reg.pages = reset ? 1 : reg.pages + 1;
+    renderRegistry(kind);
+  } catch (e) {
+    console.error("Registry Load Failed", e);
+  }
+}
+
+function renderRegistry(kind) {
+  const reg = registry[kind];
+  if (kind === 'users') renderMasterTable(reg.items);
+  else renderMasterGroups(reg.items);
+  const more = document.getElementById(`${kind}-load-more`);
+  if (more) more.style.display = reg.next !== null ? '' : 'none';
+}
+
 function renderMasterTable(users) {
   if (els.masterUsersBody) {
     els.masterUsersBody.innerHTML = users.map(u => `
@@ -253,7 +432,7 @@ async function controlBot(action) {
     });
     const data = await res.json();
     if (data.success) {
-      alertBox(`Action ${action} successful!`, 'success');
+      alertBox(data.message || `Action ${action} successful!`, 'success');
       if (action === 'restart') setTimeout(() => location.reload(), 3000);
       refreshData();
     } else {
@@ -333,22 +512,22 @@ async function trackUsers() {
   await controlBot('track_users');
 }
 
+// Search runs server-side so it covers every record, not just the loaded page.
+let searchTimer = null;
+function searchRegistry(kind, inputId) {
+  clearTimeout(searchTimer);
+  searchTimer = setTimeout(() => {
+    registry[kind].search = document.getElementById(inputId).value.trim();
+    loadRegistry(kind, true);
+  }, 300);
+}
+
 function filterUsers() {
-  const query = document.getElementById('user-search').value.toLowerCase();
-  const rows = document.querySelectorAll('#master-users-table tbody tr');
-  rows.forEach(row => {
-    const text = row.innerText.toLowerCase();
-    row.style.display = text.includes(query) ? '' : 'none';
-  });
+  searchRegistry('users', 'user-search');
 }
 
 function filterGroups() {
-  const query = document.getElementById('group-search').value.toLowerCase();
-  const rows = document.querySelectorAll('#master-groups-table tbody tr');
-  rows.forEach(row => {
-    const text = row.innerText.toLowerCase();
-    row.style.display = text.includes(query) ? '' : 'none';
-  });
+  searchRegistry('groups', 'group-search');
 }
 
 function alertBox(text, type) {
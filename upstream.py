@@ -0,0 +1,828 @@
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP clients for every upstream API Hinata talks to.
+
+Handlers used to open a fresh httpx.AsyncClient per request, paying DNS, TCP
+and TLS setup on every call. The registry keeps one keep-alive pool per kind
+of traffic instead:
+
+    ai     slow LLM endpoints (long read timeouts)
+    fast   lookups and small JSON APIs
+    media  image generation, downloads and uploads
+
+start_bot() opens the pools and stop_bot() closes them; client() also opens a
+pool on first use so helpers called from the dashboard work without the bot.
+
+Deterministic lookups can go through cached_get() (see Response Cache), and
+identical concurrent requests are coalesced (see Single Flight). Failing
+hosts and engines are cut off by circuit breakers (see Circuit Breakers), and
+transient failures are retried within a global budget (see Retries). Each
+upstream admits a bounded number of requests (see Bulkheads). Latency, status
+codes, timeouts and in-flight counts are kept per endpoint and per AI engine
+(see Metrics).
+
+Setting UPSTREAM_OVERRIDE (e.g. http://127.0.0.1:8099) sends every request to
+that server instead, as <override>/<host>/<path>; see mock_upstream.py.
+"""
+import os
+import re
+import time
+import bisect
+import random
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+
+import httpx
+
+from database import db
+
+try:
+    import h2  # noqa: F401  (optional: pip install httpx[http2])
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+logger = logging.getLogger(__name__)
+
+# Per-request timeouts at the call sites still win over these defaults.
+POOLS = {
+    "ai": {
+        "timeout": httpx.Timeout(90.0, connect=10.0),
+        "limits": httpx.Limits(max_connections=100, max_keepalive_connections=40, keepalive_expiry=60.0),
+        "per_host": 40,
+        "slow_ms": 45000,
+    },
+    "fast": {
+        "timeout": httpx.Timeout(20.0, connect=5.0),
+        "limits": httpx.Limits(max_connections=100, max_keepalive_connections=40, keepalive_expiry=30.0),
+        "per_host": 20,
+        "slow_ms": 15000,
+    },
+    "media": {
+        "timeout": httpx.Timeout(60.0, connect=10.0),
+        "limits": httpx.Limits(max_connections=40, max_keepalive_connections=10, keepalive_expiry=30.0),
+        "per_host": 8,
+        "slow_ms": 45000,
+    },
+}
+
+_clients = {}
+
+# Load testing: reroute every upstream call to a local stand-in (mock_upstream.py)
+UPSTREAM_OVERRIDE = os.environ.get("UPSTREAM_OVERRIDE", "").rstrip("/")
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body that frees its bulkhead slot once it has been read or closed."""
+
+    def __init__(self, stream, bulkhead, ticket):
+        self._stream = stream
+        self._bulkhead = bulkhead
+        self._ticket = ticket
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._ticket is not None:
+                self._bulkhead.release(self._ticket)
+                self._ticket = None
+
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """Admits requests through a bulkhead per host (or per BULKHEADS entry) so one
+    slow API cannot take the whole pool, and fails fast while the host's circuit
+    breaker is open."""
+
+    def __init__(self, pool, per_host, slow_ms, **kwargs):
+        self._transport = httpx.AsyncHTTPTransport(**kwargs)
+        self._pool = pool
+        self._per_host = per_host
+        self._pool_slow_ms = slow_ms
+
+    def _bulkhead(self, url):
+        target = url.host + url.path
+        for name, conf in BULKHEADS.items():
+            if target.startswith(conf["prefix"]):
+                return bulkhead(name, conf["capacity"], conf["queue"], conf["max_wait"])
+        return bulkhead(f"{self._pool}:{url.host}", self._per_host, self._per_host * HOST_QUEUE_FACTOR,
+                        HOST_MAX_WAIT)
+
+    def _redirect(self, request):
+        """https://host/path?q -> UPSTREAM_OVERRIDE/host/path?q. Breakers, bulkheads
+        and metrics keep using the original host."""
+        base = httpx.URL(UPSTREAM_OVERRIDE)
+        request.url = base.copy_with(raw_path=base.raw_path.rstrip(b"/") + b"/" + request.url.host.encode("ascii")
+                                     + request.url.raw_path)
+        request.headers["Host"] = base.netloc.decode("ascii")
+
+    def _slow_ms(self, request):
+        # A call is only slow once it nears its own read timeout: callers that
+        # allow 60s for an AI answer expect answers that take 40s
+        read = request.extensions.get("timeout", {}).get("read")
+        return max(self._pool_slow_ms, read * 800) if read else self._pool_slow_ms
+
+    async def handle_async_request(self, request):
+        series = metrics("endpoint", endpoint_name(request.url))
+        guard = breaker(f"{self._pool}:{series.name}")
+        slow_ms = self._slow_ms(request)
+        probe = guard.allow()
+        compartment = self._bulkhead(request.url)
+        try:
+            ticket = await compartment.acquire()
+        except BaseException:
+            guard.abandon(probe)
+            raise
+        if UPSTREAM_OVERRIDE:
+            self._redirect(request)
+        start = series.begin()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except asyncio.CancelledError:
+            series.end(start, "cancelled")
+            compartment.release(ticket)
+            guard.abandon(probe)
+            raise
+        except BaseException as e:
+            series.end(start, error_outcome(e))
+            compartment.release(ticket)
+            guard.record(False, (time.perf_counter() - start) * 1000, probe, slow_ms)
+            raise
+        series.end(start, str(response.status_code))
+        guard.record(response.status_code < 500 and response.status_code != 429,
+                     (time.perf_counter() - start) * 1000, probe, slow_ms)
+        if response.is_closed:
+            # Already fully read (in-memory body): nothing left to hold the slot for
+            compartment.release(ticket)
+        else:
+            response.stream = _ReleasingStream(response.stream, compartment, ticket)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def _open(pool):
+    conf = POOLS[pool]
+    transport = HostLimitedTransport(pool, conf["per_host"], conf["slow_ms"], limits=conf["limits"], http2=HTTP2)
+    # The clients are shared by every user, so upstream cookies must not stick.
+    cookies = CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+    return httpx.AsyncClient(transport=transport, timeout=conf["timeout"], cookies=cookies)
+
+def client(pool="fast"):
+    """Returns the shared client for `pool`. Do not close it."""
+    c = _clients.get(pool)
+    if c is None or c.is_closed:
+        c = _clients[pool] = _open(pool)
+    return c
+
+def start_clients():
+    for pool in POOLS:
+        client(pool)
+    logger.info("Upstream pools ready: %s (HTTP/2 %s)", ", ".join(POOLS), "on" if HTTP2 else "off")
+
+async def close_clients():
+    clients = list(_clients.values())
+    _clients.clear()
+    for c in clients:
+        try:
+            await c.aclose()
+        except Exception as e:
+            logger.error(f"Closing upstream client failed: {e}")
+
+# --- Response Cache ---
+# Lookups whose answer does not change from one minute to the next (profiles,
+# searches, text styles) go through cached_get(). Entries live in an LRU capped
+# by body bytes; policies with persist=True also keep a copy in SQLite so a
+# restart starts warm. `found` decides whether a 200 is a real hit or a
+# not-found answer, which is cached for the shorter negative_ttl; 404s are
+# negative too. Errors and other statuses are never cached.
+CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+def _has(*keys):
+    return lambda data: any(data.get(k) for k in keys)
+
+CACHE_POLICIES = {
+    "insta": {"ttl": 900, "negative_ttl": 120, "persist": True, "found": _has("profile", "data", "result")},
+    "ff": {"ttl": 300, "negative_ttl": 60, "persist": True, "found": _has("basicInfo", "result", "data")},
+    "tt": {"ttl": 900, "negative_ttl": 120, "persist": True, "found": lambda data: bool(data.get("status") and data.get("data"))},
+    "ytsearch": {"ttl": 1800, "negative_ttl": 120, "persist": False, "found": _has("result", "data")},
+    "pinterest": {"ttl": 1800, "negative_ttl": 120, "persist": False, "found": _has("result", "data")},
+    "styletext": {"ttl": 86400, "negative_ttl": 300, "persist": True, "found": _has("styles", "result", "data")},
+}
+
+CACHE_STATS = {"hits": 0, "negative_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+class ResponseCache:
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> (expires, status, body, negative)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, expires, status, body, negative):
+        if key in self._entries:
+            self._drop(key)
+        size = len(key) + len(body)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (expires, status, body, negative)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            CACHE_STATS["evictions"] += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= len(key) + len(entry[2])
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+cache = ResponseCache()
+
+def _cached_response(url, status, body):
+    return httpx.Response(status, content=body, request=httpx.Request("GET", url))
+
+def _is_negative(policy, resp):
+    if resp.status_code == 404:
+        return True
+    try:
+        return not policy["found"](resp.json())
+    except Exception:
+        return None  # not JSON we understand: do not cache
+
+async def cached_get(endpoint, url, pool="fast", timeout=httpx.USE_CLIENT_DEFAULT):
+    """GET through the response cache. Returns an httpx.Response either way."""
+    policy = CACHE_POLICIES[endpoint]
+    key = f"{endpoint}|{url}"
+    entry = cache.get(key)
+    if entry is None and policy["persist"]:
+        row = await db.get_cached_response(key)
+        if row:
+            status, body, expires_ms = row
+            # Rows carry no flag, so it is re-derived; a body that no longer
+            # parses as a known answer (None) counts as negative, not as a hit
+            negative = status == 404 or _is_negative(policy, _cached_response(url, status, body)) is not False
+            cache.put(key, expires_ms / 1000, status, body, negative)
+            entry = cache.get(key)
+            CACHE_STATS["disk_hits"] += 1
+    if entry is not None:
+        CACHE_STATS["negative_hits" if entry[3] else "hits"] += 1
+        return _cached_response(url, entry[1], entry[2])
+
+    async def fetch():
+        CACHE_STATS["misses"] += 1
+        resp = await with_retries(endpoint, lambda: client(pool).get(url, timeout=timeout))
+        if resp.status_code in (200, 404):
+            negative = _is_negative(policy, resp)
+            if negative is not None:
+                expires = time.time() + (policy["negative_ttl"] if negative else policy["ttl"])
+                cache.put(key, expires, resp.status_code, resp.content, negative)
+                CACHE_STATS["stores"] += 1
+                if policy["persist"]:
+                    await db.put_cached_response(key, resp.status_code, resp.content, int(expires * 1000))
+        return resp
+
+    # Callers that miss together share one fetch (see Single Flight).
+    return await single_flight(key, fetch)
+
+def cache_stats():
+    lookups = CACHE_STATS["hits"] + CACHE_STATS["negative_hits"] + CACHE_STATS["misses"]
+    return dict(CACHE_STATS, entries=len(cache), bytes=cache.bytes, max_bytes=cache.max_bytes,
+                hit_rate=round((lookups - CACHE_STATS["misses"]) / lookups, 3) if lookups else 0.0)
+
+# --- Single Flight ---
+# When a link or UID is posted in a busy group several members ask for it at
+# once. Concurrent calls with the same key share one upstream request: the
+# first caller starts it, the rest await the same task. Keys are built from
+# normalized arguments (normalize_query / normalize_url) so trivially
+# different spellings of one request coalesce too.
+FLIGHT_STATS = {"leaders": 0, "coalesced": 0}
+_flights = {}
+
+# Share-link parameters that identify the sender, not the content
+TRACKING_PARAMS = {"si", "igsh", "igshid", "feature", "fbclid", "gclid", "ref", "share_id"}
+
+def normalize_query(text):
+    return " ".join(str(text).split()).casefold()
+
+def normalize_url(url):
+    url = url.strip()
+    if not url.lower().startswith(("http://", "https://")):
+        return url
+    url = httpx.URL(url)
+    params = [(k, v) for k, v in url.params.multi_items()
+              if k.lower() not in TRACKING_PARAMS and not k.lower().startswith("utm_")]
+    return str(url.copy_with(scheme=url.scheme.lower(), host=url.host.lower(), fragment=None,
+                             params=httpx.QueryParams(params)))
+
+def _land(key, task):
+    if _flights.get(key) is task:
+        del _flights[key]
+    if not task.cancelled():
+        task.exception()  # retrieved here in case every waiter went away
+
+async def single_flight(key, factory):
+    """Awaits factory() once for all concurrent callers with the same key."""
+    task = _flights.get(key)
+    if task is None:
+        FLIGHT_STATS["leaders"] += 1
+        task = _flights[key] = asyncio.ensure_future(factory())
+        task.add_done_callback(lambda t: _land(key, t))
+    else:
+        FLIGHT_STATS["coalesced"] += 1
+    # A waiter being cancelled must not cancel the request the others share.
+    return await asyncio.shield(task)
+
+async def shared_get(endpoint, url, pool="fast", timeout=httpx.USE_CLIENT_DEFAULT, key=None):
+    """Uncached GET that coalesces identical in-flight requests. `key` (default:
+    the URL) decides what counts as identical; the request always uses `url`."""
+    return await single_flight(f"{endpoint}|{key or url}",
+                               lambda: with_retries(endpoint, lambda: client(pool).get(url, timeout=timeout)))
+
+# --- Circuit Breakers ---
+# One breaker per pool and endpoint (host + leading path, as named by
+# endpoint_name(); checked by HostLimitedTransport, so every call through the
+# pools is covered) and one per AI engine (checked by bot.run_engine). Keying
+# by endpoint keeps a slow AI route on a shared API host from tripping the
+# downloads and lookups served by the same host. Each keeps a rolling window of outcomes; when enough of the
+# window failed or was slow the breaker opens and calls fail at once with
+# CircuitOpenError instead of waiting out a 60s timeout. After `cooldown` it
+# goes half-open and lets `probes` calls through: a good probe closes it, a bad
+# one opens it again.
+BREAKER_DEFAULTS = {
+    "window": 60.0,      # seconds of history considered
+    "min_calls": 6,      # no verdict on fewer calls than this
+    "error_rate": 0.5,
+    "slow_ms": 20000,    # slower calls count against slow_rate
+    "slow_rate": 0.6,
+    "cooldown": 30.0,
+    "probes": 1,
+}
+
+class CircuitOpenError(httpx.TransportError):
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} is not responding, paused for {max(1, round(retry_in))}s")
+        self.name = name
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    def __init__(self, name, **conf):
+        self.name = name
+        self.conf = dict(BREAKER_DEFAULTS, **conf)
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probing = 0
+        self.trips = 0
+        self._calls = deque()  # (monotonic time, ok, ms, slow)
+
+    def allow(self):
+        """Returns True for a half-open probe, False for a normal call; raises CircuitOpenError when open."""
+        now = time.monotonic()
+        if self.state == "open":
+            wait = self.opened_at + self.conf["cooldown"] - now
+            if wait > 0:
+                raise CircuitOpenError(self.name, wait)
+            self.state, self.probing = "half_open", 0
+        if self.state == "half_open":
+            if self.probing >= self.conf["probes"]:
+                raise CircuitOpenError(self.name, 1)
+            self.probing += 1
+            return True
+        return False
+
+    def record(self, ok, ms, probe=False, slow_ms=None):
+        """`slow_ms` overrides the configured threshold for this call."""
+        now = time.monotonic()
+        slow = ms > (slow_ms or self.conf["slow_ms"])
+        if probe:
+            self.probing = max(0, self.probing - 1)
+            if self.state == "half_open":
+                if ok and not slow:
+                    self._close()
+                else:
+                    self._open(now)
+            return
+        calls = self._calls
+        calls.append((now, ok, ms, slow))
+        while calls[0][0] < now - self.conf["window"]:
+            calls.popleft()
+        if self.state != "closed" or len(calls) < self.conf["min_calls"]:
+            return
+        errors = sum(1 for c in calls if not c[1])
+        slow_calls = sum(1 for c in calls if c[3])
+        if errors >= len(calls) * self.conf["error_rate"] or slow_calls >= len(calls) * self.conf["slow_rate"]:
+            self._open(now)
+
+    def abandon(self, probe=False):
+        """The allowed call ended without an outcome (cancelled or refused elsewhere)."""
+        if probe:
+            self.probing = max(0, self.probing - 1)
+
+    def _open(self, now):
+        self.state, self.opened_at = "open", now
+        self.trips += 1
+        self._calls.clear()
+        logger.warning(f"Circuit {self.name} opened for {self.conf['cooldown']:.0f}s")
+
+    def _close(self):
+        self.state = "closed"
+        self._calls.clear()
+        logger.info(f"Circuit {self.name} closed")
+
+    def snapshot(self):
+        now = time.monotonic()
+        calls = [c for c in self._calls if c[0] >= now - self.conf["window"]]
+        latencies = sorted(c[2] for c in calls)
+        return {
+            "name": self.name,
+            "state": self.state,
+            "calls": len(calls),
+            "error_rate": round(sum(1 for c in calls if not c[1]) / len(calls), 3) if calls else 0.0,
+            "p90_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))]) if latencies else None,
+            "trips": self.trips,
+            "retry_in": round(max(0.0, self.opened_at + self.conf["cooldown"] - now), 1) if self.state == "open" else 0,
+        }
+
+_breakers = {}
+
+def breaker(name, **conf):
+    """Returns the breaker for `name`, creating it with `conf` on first use."""
+    b = _breakers.get(name)
+    if b is None:
+        b = _breakers[name] = CircuitBreaker(name, **conf)
+    return b
+
+def breaker_states():
+    return [b.snapshot() for _, b in sorted(_breakers.items())]
+
+# --- Retries ---
+# Idempotent GETs only. A retry happens for connection failures and for
+# 502/503/504/429, after an exponential backoff with full jitter
+# (uniform(0, min(cap, base * 2**n))), and only while the whole call stays
+# inside `deadline` seconds. Every call also pays into a shared RetryBudget
+# and every retry withdraws from it, so under a real outage retries stay a
+# small fraction of traffic instead of multiplying it.
+RETRY_DEFAULTS = {"attempts": 3, "base": 0.25, "cap": 4.0, "deadline": 20.0}
+RETRYABLE_STATUS = {429, 502, 503, 504}
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError, httpx.WriteError,
+                    httpx.RemoteProtocolError)
+
+class RetryBudget:
+    """Retries may use at most `ratio` of calls, plus an initial `reserve`."""
+
+    def __init__(self, ratio=0.1, reserve=10.0, max_tokens=100.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = reserve
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+retry_budget = RetryBudget()
+
+# name -> {"calls", "retries", "recovered", "denied", "gave_up"}
+RETRY_STATS = {}
+
+def _retry_after(resp):
+    try:
+        return float(resp.headers.get("Retry-After", ""))
+    except ValueError:
+        return 0.0
+
+async def with_retries(name, send, policy=None):
+    """Awaits send() (a GET) and retries transient failures per `policy`.
+    Returns the last response, or raises the last error."""
+    conf = dict(RETRY_DEFAULTS, **(policy or {}))
+    stats = RETRY_STATS.setdefault(name, {"calls": 0, "retries": 0, "recovered": 0, "denied": 0, "gave_up": 0})
+    stats["calls"] += 1
+    retry_budget.deposit()
+    start = time.monotonic()
+    attempt = 1
+    while True:
+        resp = error = None
+        try:
+            resp = await send()
+        except CircuitOpenError:
+            raise
+        except RETRYABLE_ERRORS as e:
+            error = e
+        if resp is not None and resp.status_code not in RETRYABLE_STATUS:
+            if attempt > 1:
+                stats["recovered"] += 1
+            return resp
+
+        delay = random.uniform(0, min(conf["cap"], conf["base"] * 2 ** (attempt - 1)))
+        if resp is not None and resp.status_code == 429:
+            delay = max(delay, _retry_after(resp))
+        if attempt >= conf["attempts"] or time.monotonic() - start + delay > conf["deadline"]:
+            stats["gave_up"] += 1
+        elif not retry_budget.withdraw():
+            stats["denied"] += 1
+        else:
+            stats["retries"] += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        if error is not None:
+            raise error
+        return resp
+
+def retry_stats():
+    return {"budget_tokens": round(retry_budget.tokens, 1), "endpoints": RETRY_STATS}
+
+# --- Bulkheads ---
+# Every upstream gets a fixed number of in-flight slots and a bounded waiting
+# room. A request that finds the room full, or waits longer than max_wait, gets
+# BulkheadFullError at once with an estimate of when to retry, instead of
+# piling up coroutines and sockets behind one slow API. Hosts get a default
+# bulkhead per pool; the entries below carve out endpoints that are slow
+# enough to need their own. AI engines get one each in bot.run_engine.
+BULKHEADS = {
+    "gemimage": {"prefix": "apis.prexzyvilla.site/ai/gemimage", "capacity": 4, "queue": 12, "max_wait": 20.0},
+    "wallpaper": {"prefix": "apis.prexzyvilla.site/random/", "capacity": 6, "queue": 18, "max_wait": 15.0},
+    "downloads": {"prefix": "apis.prexzyvilla.site/download/", "capacity": 8, "queue": 24, "max_wait": 20.0},
+}
+HOST_QUEUE_FACTOR = 4   # default host bulkheads queue up to 4x their capacity
+HOST_MAX_WAIT = 20.0
+
+class BulkheadFullError(httpx.TransportError):
+    def __init__(self, name, retry_in):
+        self.retry_in = max(1, round(retry_in))
+        super().__init__(f"{name} is at capacity (queue full), try again in ~{self.retry_in}s")
+        self.name = name
+
+class Bulkhead:
+    def __init__(self, name, capacity, queue, max_wait):
+        self.name = name
+        self.capacity = capacity
+        self.queue = queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_ms = 0.0       # total time spent queued by admitted requests
+        self.max_wait_ms = 0.0
+        self.hold_ms = 1000.0    # moving average of how long a slot is held
+        self._sem = asyncio.Semaphore(capacity)
+
+    def retry_in(self):
+        return (self.waiting + 1) * self.hold_ms / 1000 / self.capacity
+
+    async def acquire(self):
+        """Waits for a slot and returns a ticket for release(); raises BulkheadFullError."""
+        start = time.perf_counter()
+        if self._sem.locked():
+            if self.waiting >= self.queue:
+                self.rejected += 1
+                raise BulkheadFullError(self.name, self.retry_in())
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._sem.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise BulkheadFullError(self.name, self.retry_in()) from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self._sem.acquire()
+        waited = (time.perf_counter() - start) * 1000
+        self.wait_ms += waited
+        self.max_wait_ms = max(self.max_wait_ms, waited)
+        self.admitted += 1
+        self.active += 1
+        return time.perf_counter()
+
+    def release(self, ticket):
+        self.active -= 1
+        self.hold_ms += ((time.perf_counter() - ticket) * 1000 - self.hold_ms) * 0.2
+        self._sem.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        ticket = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "capacity": self.capacity,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "queue_limit": self.queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(self.wait_ms / self.admitted, 1) if self.admitted else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 1),
+        }
+
+_bulkheads = {}
+
+def bulkhead(name, capacity, queue, max_wait):
+    """Returns the bulkhead for `name`, creating it with these limits on first use."""
+    b = _bulkheads.get(name)
+    if b is None:
+        b = _bulkheads[name] = Bulkhead(name, capacity, queue, max_wait)
+    return b
+
+def bulkhead_states():
+    return [b.snapshot() for _, b in sorted(_bulkheads.items())]
+
+# --- Metrics ---
+# Every request the shared transport sends and every run_engine() call is
+# counted here: a latency histogram (time to response headers for endpoints),
+# outcome counters, timeouts and an in-flight gauge per series. Endpoint series are named host + first two path
+# segments (ids collapsed to ":id"); past MAX_SERIES new names share "other".
+# render_metrics() writes it all in the Prometheus text format for
+# /api/metrics, metrics_snapshot() feeds the dashboard.
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 45000, 90000)
+MAX_SERIES = 200
+_ID_SEGMENT = re.compile(r"^(\d+|[0-9a-fA-F-]{8,})$")
+
+class Histogram:
+    """Cumulative-bucket latency histogram in milliseconds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.sum += ms
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate by linear interpolation inside the bucket holding rank q."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.buckets[i - 1] if i else 0
+                if i == len(self.buckets):
+                    return float(low)
+                return low + (self.buckets[i] - low) * (rank - seen) / n
+            seen += n
+        return float(self.buckets[-1])
+
+class UpstreamMetrics:
+    """Counters for one endpoint ("endpoint") or AI engine ("engine").
+    `outcomes` is keyed by HTTP status for endpoints and by result for engines."""
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.latency = Histogram()
+        self.outcomes = {}
+        self.timeouts = 0
+        self.in_flight = 0
+
+    def begin(self):
+        self.in_flight += 1
+        return time.perf_counter()
+
+    def count(self, outcome):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        if outcome == "timeout":
+            self.timeouts += 1
+
+    def end(self, start, outcome):
+        """Closes a call opened by begin(). Cancelled calls are not timed."""
+        self.in_flight -= 1
+        self.count(outcome)
+        if outcome != "cancelled":
+            self.latency.observe((time.perf_counter() - start) * 1000)
+
+    def snapshot(self):
+        calls = sum(self.outcomes.values())
+        if self.kind == "endpoint":
+            failed = sum(n for k, n in self.outcomes.items() if k in ("error", "timeout") or k.startswith("5"))
+        else:
+            failed = calls - self.outcomes.get("ok", 0) - self.outcomes.get("cancelled", 0)
+        quantile = lambda q: None if not self.latency.count else round(self.latency.quantile(q))
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "calls": calls,
+            "error_rate": round(failed / calls, 3) if calls else 0.0,
+            "timeouts": self.timeouts,
+            "in_flight": self.in_flight,
+            "avg_ms": round(self.latency.sum / self.latency.count) if self.latency.count else None,
+            "p50_ms": quantile(0.5),
+            "p95_ms": quantile(0.95),
+            "p99_ms": quantile(0.99),
+            "outcomes": dict(self.outcomes),
+        }
+
+_metrics = {}
+
+def endpoint_name(url):
+    segments = [s for s in url.path.split("/") if s][:2]
+    return "/".join([url.host] + [":id" if _ID_SEGMENT.match(s) else s for s in segments])
+
+def metrics(kind, name):
+    """Returns the UpstreamMetrics for (kind, name), creating it on first use."""
+    m = _metrics.get((kind, name))
+    if m is None:
+        if name != "other" and sum(1 for k, _ in _metrics if k == kind) >= MAX_SERIES:
+            return metrics(kind, "other")
+        m = _metrics[(kind, name)] = UpstreamMetrics(kind, name)
+    return m
+
+def error_outcome(e):
+    return "timeout" if isinstance(e, httpx.TimeoutException) else "error"
+
+def metrics_snapshot():
+    return [m.snapshot() for _, m in sorted(_metrics.items())]
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_metrics():
+    """All upstream metrics in the Prometheus text exposition format."""
+    out = []
+    families = (("endpoint", "hinata_upstream", "endpoint", "code",
+                 "HTTP requests sent to third-party APIs, by response status (or error/timeout)"),
+                ("engine", "hinata_engine", "engine", "outcome",
+                 "AI engine calls, by result"))
+    for kind, prefix, label, outcome_label, help_text in families:
+        series = [m for (k, _), m in sorted(_metrics.items()) if k == kind]
+        out.append(f"# HELP {prefix}_duration_seconds Latency of {kind} calls.")
+        out.append(f"# TYPE {prefix}_duration_seconds histogram")
+        for m in series:
+            name = f'{label}="{_label(m.name)}"'
+            total = 0
+            for bound, n in zip(m.latency.buckets, m.latency.counts):
+                total += n
+                out.append(f'{prefix}_duration_seconds_bucket{{{name},le="{bound / 1000:g}"}} {total}')
+            out.append(f'{prefix}_duration_seconds_bucket{{{name},le="+Inf"}} {m.latency.count}')
+            out.append(f'{prefix}_duration_seconds_sum{{{name}}} {m.latency.sum / 1000:.6f}')
+            out.append(f'{prefix}_duration_seconds_count{{{name}}} {m.latency.count}')
+        out.append(f"# HELP {prefix}_requests_total {help_text}.")
+        out.append(f"# TYPE {prefix}_requests_total counter")
+        for m in series:
+            for outcome, n in sorted(m.outcomes.items()):
+                out.append(f'{prefix}_requests_total{{{label}="{_label(m.name)}",{outcome_label}="{_label(outcome)}"}} {n}')
+        out.append(f"# HELP {prefix}_timeouts_total {kind.capitalize()} calls that timed out.")
+        out.append(f"# TYPE {prefix}_timeouts_total counter")
+        for m in series:
+            out.append(f'{prefix}_timeouts_total{{{label}="{_label(m.name)}"}} {m.timeouts}')
+        out.append(f"# HELP {prefix}_in_flight {kind.capitalize()} calls currently waiting on a response.")
+        out.append(f"# TYPE {prefix}_in_flight gauge")
+        for m in series:
+            out.append(f'{prefix}_in_flight{{{label}="{_label(m.name)}"}} {m.in_flight}')
+
+    states = {"closed": 0, "half_open": 1, "open": 2}
+    out.append("# HELP hinata_circuit_state Circuit breaker state (0 closed, 1 half-open, 2 open).")
+    out.append("# TYPE hinata_circuit_state gauge")
+    for b in breaker_states():
+        out.append(f'hinata_circuit_state{{name="{_label(b["name"])}"}} {states[b["state"]]}')
+    out.append("# HELP hinata_bulkhead_active Requests holding a bulkhead slot.")
+    out.append("# TYPE hinata_bulkhead_active gauge")
+    for b in bulkhead_states():
+        out.append(f'hinata_bulkhead_active{{name="{_label(b["name"])}"}} {b["active"]}')
+    out.append("# HELP hinata_bulkhead_queue_depth Requests waiting for a bulkhead slot.")
+    out.append("# TYPE hinata_bulkhead_queue_depth gauge")
+    for b in bulkhead_states():
+        out.append(f'hinata_bulkhead_queue_depth{{name="{_label(b["name"])}"}} {b["queue_depth"]}')
+    out.append("# HELP hinata_bulkhead_rejected_total Requests turned away by a full bulkhead.")
+    out.append("# TYPE hinata_bulkhead_rejected_total counter")
+    for b in bulkhead_states():
+        out.append(f'hinata_bulkhead_rejected_total{{name="{_label(b["name"])}"}} {b["rejected"] + b["timed_out"]}')
+    return "\n".join(out) + "\n"